@@ -0,0 +1,104 @@
+# This Source Code Form is subject to the terms of the Mozilla Public
+# License, v. 2.0. If a copy of the MPL was not distributed with this
+# file, You can obtain one at http://mozilla.org/MPL/2.0/.
+
+import datetime
+import threading
+
+class AccessDateWriter:
+    """
+    Write-behind buffer for the `last_accessed` column.
+
+    Accessed ids are collected in memory with one timestamp per id and are
+    written to the database in bulk by a background thread, either every
+    `flush_interval` seconds or as soon as `flush_size` ids are buffered.
+    A `flush_interval` of 0 disables buffering and writes every access
+    immediately.
+    """
+
+    def __init__(self, db, flush_interval=5, flush_size=1000):
+        if not isinstance(flush_interval, (int, float)):
+            raise TypeError("Flush interval must be a number.")
+        elif not isinstance(flush_size, int):
+            raise TypeError("Flush size must be an integer type.")
+        if flush_interval < 0:
+            raise ValueError("Flush interval cannot be negative.")
+        elif flush_size < 1:
+            raise ValueError("Flush size must be greater than 0.")
+
+        self.db = db
+        self.flush_interval = flush_interval
+        self.flush_size = flush_size
+        self._buffer = {} # id -> last access time
+        self._lock = threading.Lock()
+        self._flush_lock = threading.Lock()
+        self._wake = threading.Event()
+        self._stopped = threading.Event()
+        self._thread = None
+        self.flushed = 0
+        self.flush_errors = 0
+
+        if self.flush_interval > 0:
+            self._thread = threading.Thread(
+                target=self._run, name="access-date-writer", daemon=True)
+            self._thread.start()
+
+    def record(self, id, accessed_on=None):
+        if accessed_on is None:
+            accessed_on = datetime.datetime.now()
+        if self._thread is None:
+            self.db.update_access_dates({id: accessed_on})
+            return
+
+        with self._lock:
+            self._buffer[id] = accessed_on
+            pending = len(self._buffer)
+        if pending >= self.flush_size:
+            self._wake.set()
+
+    def flush(self):
+        """
+        Write all buffered access dates to the database.
+
+        Return
+        int: Number of ids written
+        """
+        with self._flush_lock:
+            with self._lock:
+                if len(self._buffer) == 0:
+                    return 0
+                batch = self._buffer
+                self._buffer = {}
+
+            try:
+                self.db.update_access_dates(batch)
+            except Exception as e:
+                print(f"WARNING: Failed to write access dates, will retry. {e}")
+                self.flush_errors += 1
+                # Put the batch back without overwriting newer accesses
+                with self._lock:
+                    for id, accessed_on in batch.items():
+                        self._buffer.setdefault(id, accessed_on)
+                return 0
+
+            self.flushed += len(batch)
+            return len(batch)
+
+    def _run(self):
+        while not self._stopped.is_set():
+            self._wake.wait(self.flush_interval)
+            self._wake.clear()
+            self.flush()
+
+    def close(self):
+        """Stop the background thread and drain the buffer."""
+        self._stopped.set()
+        self._wake.set()
+        if self._thread is not None:
+            self._thread.join()
+            self._thread = None
+        self.flush()
+
+    def pending(self):
+        with self._lock:
+            return len(self._buffer)
@@ -2,30 +2,52 @@
 # License, v. 2.0. If a copy of the MPL was not distributed with this
 # file, You can obtain one at http://mozilla.org/MPL/2.0/.
 
+import datetime
 from enum import Enum
 import falcon
 import io, os
 from app_info import API_VERSION
 from logic import Logic
+from entry import Entry
+from config_parser import ConfigParser as Config
+from metrics import REGISTRY, CONTENT_TYPE as METRICS_CONTENT_TYPE, MetricsMiddleware
+from sequence_id import IdSpaceExhausted
+from tracing import ServerTimingMiddleware
 import mimetypes
 
-logic_instance = None
-
 class GenerateLink:
 
+    # Longest lifetime of an expiring link, 10 years
+    MAX_EXPIRES_IN = 10 * 365 * 24 * 3600
+
+    def __init__(self, logic):
+        self._logic = logic
+
     def on_post(self, req, resp):
-        if not ServerStatus.check_status(resp):
+        if not ServerStatus.check_status(resp) or not GenerateLink.check_writable(self._logic, resp):
             return
         
         request_body = req.get_media()
 
-        if request_body is None or not "uri" in request_body:
+        if not isinstance(request_body, dict) or not "uri" in request_body:
             resp.status = falcon.HTTP_400
             resp.media = {"msg": "Invalid request."}
             return
         
         try:
-            entry = logic_instance.gen_new_id(request_body["uri"].strip())
+            expires_at = GenerateLink.expires_at(request_body)
+        except ValueError:
+            resp.status = falcon.HTTP_400
+            resp.media = {"msg": "Invalid expires_in."}
+            return
+
+        try:
+            entry = self._logic.gen_new_id(request_body["uri"].strip(), expires_at)
+        except IdSpaceExhausted as e:
+            print(f"WARNING: {e}")
+            resp.status = falcon.HTTP_503
+            resp.media = {"msg": "Please try again later."}
+            return
         except ValueError as e:
             print(f"WARNING: {e}")
             resp.status = falcon.HTTP_400
@@ -37,19 +59,100 @@ class GenerateLink:
             resp.media = {"msg": "Please try again later."}
             return
 
+        resp.media = GenerateLink.payload(entry)
+
+    @staticmethod
+    def check_writable(logic, resp):
+        if not logic.read_only:
+            return True
+        resp.status = falcon.HTTP_405
+        resp.media = {"msg": "Shortening is not available on this server."}
+        return False
+
+    @staticmethod
+    def expires_at(request_body):
+        """
+        Return
+        None: Link does not expire
+        datetime: Expiry of a link expiring `expires_in` seconds from now
+
+        Raises:
+        ValueError: `expires_in` not a number of seconds in range
+        """
+        expires_in = request_body.get("expires_in")
+        if expires_in is None:
+            return None
+        if isinstance(expires_in, bool) or not isinstance(expires_in, int):
+            raise ValueError("expires_in must be an integer.")
+        if expires_in < 1 or expires_in > GenerateLink.MAX_EXPIRES_IN:
+            raise ValueError(f"expires_in must be between 1 and {GenerateLink.MAX_EXPIRES_IN}.")
+        return datetime.datetime.now().replace(microsecond=0) + datetime.timedelta(seconds=expires_in)
+
+    @staticmethod
+    def payload(entry):
         payload = {
             "id": f"{entry.id}",
             "html_safe_uri": f"{entry.html_safe_uri}",
             "raw_uri": f"{entry.uri}",
             'encoded_uri': entry.encoded_uri,
         }
-
-        resp.media = payload
+        if not entry.expires_at is None:
+            payload["expires_at"] = entry.expires_at.isoformat()
+        return payload
     
     def process_response(self, req, resp, resource, req_succeeded):
         resp.content_type = mimetypes.types_map[".json"]
 
+class GenerateLinkBatch:
+
+    def __init__(self, logic, max_size=100):
+        self._logic = logic
+        self._max_size = max_size
+
+    def on_post(self, req, resp):
+        if not ServerStatus.check_status(resp) or not GenerateLink.check_writable(self._logic, resp):
+            return
+
+        request_body = req.get_media()
+
+        if not isinstance(request_body, dict) or not isinstance(request_body.get("uris"), list):
+            resp.status = falcon.HTTP_400
+            resp.media = {"msg": "Invalid request."}
+            return
+
+        if len(request_body["uris"]) > self._max_size:
+            resp.status = falcon.HTTP_400
+            resp.media = {"msg": f"Too many URIs, maximum is {self._max_size}."}
+            return
+
+        try:
+            entries = self._logic.gen_new_ids(request_body["uris"])
+        except IdSpaceExhausted as e:
+            print(f"WARNING: {e}")
+            resp.status = falcon.HTTP_503
+            resp.media = {"msg": "Please try again later."}
+            return
+
+        results = []
+        for result in entries:
+            if isinstance(result, Entry):
+                results.append(GenerateLink.payload(result))
+            elif result is None:
+                results.append({"msg": "Please try again later."})
+            else:
+                print(f"WARNING: {result}")
+                results.append({"msg": "Invalid URI."})
+
+        resp.media = {"results": results}
+
+    def process_response(self, req, resp, resource, req_succeeded):
+        resp.content_type = mimetypes.types_map[".json"]
+
 class RetrieveLink:
+
+    def __init__(self, logic):
+        self._logic = logic
+
     def on_get(self, req, resp):
         if not ServerStatus.check_status(resp):
             return
@@ -61,23 +164,194 @@ class RetrieveLink:
             resp.media = {"msg": "Undefined id."}
             return
         
-        result = logic_instance.get_uri(id_requested.strip())
+        result = self._logic.get_uri(id_requested.strip())
         # id does not exist in DB
         if result is None:
             resp.status = falcon.HTTP_404
             resp.media = {"msg": "ID not found."}
             return
 
+        if result.is_expired():
+            resp.status = falcon.HTTP_410
+            resp.media = {"msg": "Link expired."}
+            return
+
+        resp.media = RetrieveLink.payload(result)
+
+    @staticmethod
+    def payload(entry):
         payload = {
-            'html_safe_uri': result.html_safe_uri,
-            'raw_uri': result.uri,
-            'encoded_uri': result.encoded_uri,
+            'html_safe_uri': entry.html_safe_uri,
+            'raw_uri': entry.uri,
+            'encoded_uri': entry.encoded_uri,
+        }
+        if not entry.expires_at is None:
+            payload["expires_at"] = entry.expires_at.isoformat()
+        return payload
+
+    def process_response(self, req, resp, resource, req_succeeded):
+        resp.content_type = mimetypes.types_map[".json"]
+
+class RetrieveLinkBatch:
+
+    def __init__(self, logic, max_size=100):
+        self._logic = logic
+        self._max_size = max_size
+
+    def on_get(self, req, resp):
+        self.retrieve(resp, req.get_param_as_list("id", default=[]))
+
+    def on_post(self, req, resp):
+        request_body = req.get_media()
+
+        if not isinstance(request_body, dict) or not isinstance(request_body.get("ids"), list):
+            resp.status = falcon.HTTP_400
+            resp.media = {"msg": "Invalid request."}
+            return
+
+        self.retrieve(resp, request_body["ids"])
+
+    def retrieve(self, resp, ids):
+        if not ServerStatus.check_status(resp):
+            return
+
+        if len(ids) == 0:
+            resp.status = falcon.HTTP_400
+            resp.media = {"msg": "Undefined id."}
+            return
+
+        if len(ids) > self._max_size:
+            resp.status = falcon.HTTP_400
+            resp.media = {"msg": f"Too many ids, maximum is {self._max_size}."}
+            return
+
+        valid_ids = []
+        for i, id in enumerate(ids):
+            if isinstance(id, str):
+                ids[i] = id = id.strip()
+                if id != "" and len(id) <= Entry.ID_CHAR_MAXLEN:
+                    valid_ids.append(id)
+
+        entries = self._logic.get_uris(valid_ids)
+        results = []
+        for id in ids:
+            entry = entries.get(id) if isinstance(id, str) else None
+            if entry is None:
+                msg = "ID not found." if isinstance(id, str) and id in entries else "Invalid id."
+                results.append({"id": id, "found": False, "msg": msg})
+            elif entry.is_expired():
+                results.append({"id": id, "found": False, "msg": "Link expired."})
+            else:
+                payload = RetrieveLink.payload(entry)
+                payload.update({"id": id, "found": True})
+                results.append(payload)
+
+        resp.media = {"results": results}
+
+    def process_response(self, req, resp, resource, req_succeeded):
+        resp.content_type = mimetypes.types_map[".json"]
+
+class LinkStats:
+    """
+    Clicks of a link from the daily rollup table, in total and per day for
+    the last `days` days, counted up to the last flush of the counters.
+    """
+
+    MAX_DAYS = 366
+
+    def __init__(self, logic):
+        self._logic = logic
+
+    def on_get(self, req, resp):
+        if not ServerStatus.check_status(resp):
+            return
+        id_requested = req.get_param("id")
+
+        if id_requested is None or id_requested.strip() == "" \
+                or len(id_requested.strip()) > Entry.ID_CHAR_MAXLEN:
+            resp.status = falcon.HTTP_400
+            resp.media = {"msg": "Undefined id."}
+            return
+        id_requested = id_requested.strip()
+
+        days = req.get_param("days", default="30")
+        if not days.isdigit() or int(days) < 1 or int(days) > LinkStats.MAX_DAYS:
+            resp.status = falcon.HTTP_400
+            resp.media = {"msg": f"Invalid days, maximum is {LinkStats.MAX_DAYS}."}
+            return
+
+        result = self._logic.get_clicks(id_requested, int(days))
+        if result is None:
+            resp.status = falcon.HTTP_404
+            resp.media = {"msg": "ID not found."}
+            return
+
+        total, daily = result
+        resp.media = {
+            "id": id_requested,
+            "total": total,
+            "days": [{"date": day.isoformat(), "clicks": clicks} for day, clicks in daily],
         }
-        resp.media = payload
 
     def process_response(self, req, resp, resource, req_succeeded):
         resp.content_type = mimetypes.types_map[".json"]
 
+class Redirect:
+    """
+    Redirect `GET /{id}` straight to the stored URI.
+
+    Reserved paths and ids that cannot be a short link are served from the
+    documentation directory instead.
+    """
+
+    REDIRECT_STATUS = {
+        301: falcon.HTTP_301,
+        302: falcon.HTTP_302,
+        307: falcon.HTTP_307,
+        308: falcon.HTTP_308,
+    }
+
+    def __init__(self, logic, doc, status=302, cache_control="public, max-age=300"):
+        if status not in Redirect.REDIRECT_STATUS:
+            raise ValueError(f"Unsupported redirect status {status}.")
+        self._logic = logic
+        self._doc = doc
+        self._status = Redirect.REDIRECT_STATUS[status]
+        self._cache_control = cache_control
+
+    def on_get(self, req, resp, id):
+        if id in self._logic.reserved_path or len(id) > Entry.ID_CHAR_MAXLEN:
+            self._serve_doc(req, resp, id)
+            return
+
+        if not ServerStatus.check_status(resp):
+            return
+
+        result = self._logic.get_uri(id)
+        if result is None:
+            self._serve_doc(req, resp, id)
+            return
+
+        if result.is_expired():
+            resp.status = falcon.HTTP_410
+            resp.media = {"msg": "Link expired."}
+            return
+
+        resp.status = self._status
+        resp.location = result.encoded_uri
+        if not result.expires_at is None:
+            # Caches must not keep serving the redirect once the link expired
+            resp.set_header("Cache-Control", "no-store")
+        elif self._cache_control:
+            resp.set_header("Cache-Control", self._cache_control)
+
+    def _serve_doc(self, req, resp, name):
+        if not self._doc.exists(name):
+            resp.status = falcon.HTTP_404
+            resp.media = {"msg": "ID not found."}
+            return
+        self._doc.on_get(req, resp, name)
+
 class ServerStatus:
 
     class ServerStatus(Enum):
@@ -91,12 +365,29 @@ class ServerStatus:
         resp.media = {"status": ServerStatus.status.value}
     
     @staticmethod
-    def check_status(resp):
-        if logic_instance.is_db_up():
+    def follow(logic):
+        """Set the initial status from `logic` and follow its health monitor."""
+        if logic.maintenance_mode:
+            ServerStatus.status = ServerStatus.ServerStatus.MAINTENANCE
+        elif logic.init_ok:
+            ServerStatus.status = ServerStatus.ServerStatus.OK
+        else:
+            ServerStatus.status = ServerStatus.ServerStatus.DOWN
+        logic.health_monitor.add_listener(ServerStatus.update_db_health)
+
+    @staticmethod
+    def update_db_health(healthy):
+        """Listener for the background health monitor."""
+        if ServerStatus.status == ServerStatus.ServerStatus.MAINTENANCE:
+            return
+        if healthy:
             ServerStatus.status = ServerStatus.ServerStatus.OK
         else:
             ServerStatus.status = ServerStatus.ServerStatus.DOWN
 
+    @staticmethod
+    def check_status(resp):
+        # Status is kept up to date by the health monitor, no I/O here
         if ServerStatus.status == ServerStatus.ServerStatus.OK:
             return True
         elif ServerStatus.status == ServerStatus.ServerStatus.MAINTENANCE:
@@ -111,6 +402,16 @@ class ServerStatus:
     def process_response(self, req, resp, resource, req_succeeded):
         resp.content_type = mimetypes.types_map[".json"]
 
+class Metrics:
+    """Prometheus scrape target, request and query metrics plus `Logic.stats()`."""
+
+    def __init__(self, logic):
+        self._logic = logic
+
+    def on_get(self, req, resp):
+        resp.content_type = METRICS_CONTENT_TYPE
+        resp.text = REGISTRY.render(self._logic.stats())
+
 class Doc:
 
     def __init__(self, storage_path):
@@ -124,25 +425,49 @@ class Doc:
         content_length = os.path.getsize(filename)
         return stream, content_length
 
+    def exists(self, name):
+        filename = os.path.abspath(f"{self._storage_path}/{name}")
+        return filename.startswith(f"{self._storage_path}/") and os.path.isfile(filename)
+
     def on_get(self, req, resp, name="index.html"):
         path = name
         resp.content_type = mimetypes.guess_type(path)[0]
         resp.stream, resp.content_length = self.open(path)
 
-app = falcon.App(cors_enable=True)
-logic_instance = Logic()
-if logic_instance.maintenance_mode:
-    ServerStatus.status = ServerStatus.ServerStatus.MAINTENANCE
-elif logic_instance.init_ok:
-    ServerStatus.status = ServerStatus.ServerStatus.OK
-else:
-    ServerStatus.status = ServerStatus.ServerStatus.DOWN
+def create_app(logic=None, doc_path="../doc/build/"):
+    """
+    Build the WSGI app. Nothing connects to the database until this is
+    called, pass `logic` to serve from an already configured `Logic`.
+
+    Return
+    falcon.App: The API server
+    """
+    if logic is None:
+        logic = Logic()
+    ServerStatus.follow(logic)
 
-doc = Doc("../doc/build/")
+    config = Config.get_config()["preference"]
+    middleware = [MetricsMiddleware()]
+    if Config.get_config().get("tracing", {}).get("server_timing", True):
+        middleware.append(ServerTimingMiddleware())
+    app = falcon.App(cors_enable=True, middleware=middleware)
+    doc = Doc(doc_path)
 
-app.add_static_route("/", doc._storage_path)
-app.add_route("/", doc)
+    app.add_static_route("/", doc._storage_path)
+    app.add_route("/", doc)
+    app.add_route("/{id}", Redirect(
+        logic,
+        doc,
+        config.get("redirect_status", 302),
+        config.get("redirect_cache_control", "public, max-age=300")))
 
-app.add_route(f'/api/{API_VERSION}/shorten', GenerateLink())
-app.add_route(f'/api/{API_VERSION}/retrieve', RetrieveLink())
-app.add_route(f'/api/{API_VERSION}/status', ServerStatus())
+    app.add_route(f'/api/{API_VERSION}/shorten', GenerateLink(logic))
+    app.add_route(f'/api/{API_VERSION}/shorten/batch', GenerateLinkBatch(
+        logic, config.get("batch_max_size", 100)))
+    app.add_route(f'/api/{API_VERSION}/retrieve', RetrieveLink(logic))
+    app.add_route(f'/api/{API_VERSION}/retrieve/batch', RetrieveLinkBatch(
+        logic, config.get("batch_max_size", 100)))
+    app.add_route(f'/api/{API_VERSION}/stats', LinkStats(logic))
+    app.add_route(f'/api/{API_VERSION}/status', ServerStatus())
+    app.add_route(f'/api/{API_VERSION}/metrics', Metrics(logic))
+    return app
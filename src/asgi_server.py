@@ -0,0 +1,219 @@
+# This Source Code Form is subject to the terms of the Mozilla Public
+# License, v. 2.0. If a copy of the MPL was not distributed with this
+# file, You can obtain one at http://mozilla.org/MPL/2.0/.
+
+"""
+ASGI variant of `api_server`, one process serves many requests in flight
+while waiting on the database.
+
+    uvicorn --factory main:main_asgi --port 8081
+
+Responses are the same as the WSGI server's, batch endpoints are only
+served by the WSGI server.
+"""
+
+import asyncio
+import mimetypes
+import falcon
+import falcon.asgi
+import api_server
+from api_server import GenerateLink as SyncGenerateLink, RetrieveLink as SyncRetrieveLink
+from app_info import API_VERSION
+from async_db_client import AsyncDBClient, ThreadedAsyncBackend
+from async_logic import AsyncLogic
+from config_parser import ConfigParser as Config
+from entry import Entry
+from logic import Logic
+from mariadb_client import DBClient
+from sequence_id import IdSpaceExhausted
+from metrics import MetricsMiddleware
+from tracing import ServerTimingMiddleware
+
+ServerStatusState = api_server.ServerStatus
+
+class GenerateLink:
+
+    def __init__(self, logic):
+        self._logic = logic
+
+    async def on_post(self, req, resp):
+        if not ServerStatusState.check_status(resp) \
+                or not SyncGenerateLink.check_writable(self._logic.logic, resp):
+            return
+
+        request_body = await req.get_media()
+
+        if not isinstance(request_body, dict) or not "uri" in request_body:
+            resp.status = falcon.HTTP_400
+            resp.media = {"msg": "Invalid request."}
+            return
+
+        try:
+            expires_at = SyncGenerateLink.expires_at(request_body)
+        except ValueError:
+            resp.status = falcon.HTTP_400
+            resp.media = {"msg": "Invalid expires_in."}
+            return
+
+        try:
+            entry = await self._logic.gen_new_id(request_body["uri"].strip(), expires_at)
+        except IdSpaceExhausted as e:
+            print(f"WARNING: {e}")
+            resp.status = falcon.HTTP_503
+            resp.media = {"msg": "Please try again later."}
+            return
+        except ValueError as e:
+            print(f"WARNING: {e}")
+            resp.status = falcon.HTTP_400
+            resp.media = {"msg": "Invalid URI."}
+            return
+
+        if entry == None:
+            resp.status = falcon.HTTP_500
+            resp.media = {"msg": "Please try again later."}
+            return
+
+        resp.media = SyncGenerateLink.payload(entry)
+
+class RetrieveLink:
+
+    def __init__(self, logic):
+        self._logic = logic
+
+    async def on_get(self, req, resp):
+        if not ServerStatusState.check_status(resp):
+            return
+        id_requested = req.get_param("id")
+
+        if id_requested is None or id_requested == "":
+            resp.status = falcon.HTTP_400
+            resp.media = {"msg": "Undefined id."}
+            return
+
+        result = await self._logic.get_uri(id_requested.strip())
+        if result is None:
+            resp.status = falcon.HTTP_404
+            resp.media = {"msg": "ID not found."}
+            return
+
+        if result.is_expired():
+            resp.status = falcon.HTTP_410
+            resp.media = {"msg": "Link expired."}
+            return
+
+        resp.media = SyncRetrieveLink.payload(result)
+
+class Redirect(api_server.Redirect):
+    """Async `api_server.Redirect`, `logic` is an `AsyncLogic`."""
+
+    async def on_get(self, req, resp, id):
+        if id in self._logic.logic.reserved_path or len(id) > Entry.ID_CHAR_MAXLEN:
+            await self._serve_doc(req, resp, id)
+            return
+
+        if not ServerStatusState.check_status(resp):
+            return
+
+        result = await self._logic.get_uri(id)
+        if result is None:
+            await self._serve_doc(req, resp, id)
+            return
+
+        if result.is_expired():
+            resp.status = falcon.HTTP_410
+            resp.media = {"msg": "Link expired."}
+            return
+
+        resp.status = self._status
+        resp.location = result.encoded_uri
+        if not result.expires_at is None:
+            resp.set_header("Cache-Control", "no-store")
+        elif self._cache_control:
+            resp.set_header("Cache-Control", self._cache_control)
+
+    async def _serve_doc(self, req, resp, name):
+        if not self._doc.exists(name):
+            resp.status = falcon.HTTP_404
+            resp.media = {"msg": "ID not found."}
+            return
+        await self._doc.on_get(req, resp, name)
+
+class ServerStatus:
+
+    async def on_get(self, req, resp):
+        resp.media = {"status": ServerStatusState.status.value}
+
+class Metrics(api_server.Metrics):
+    """`logic` is the `Logic` behind the `AsyncLogic`."""
+
+    async def on_get(self, req, resp):
+        super().on_get(req, resp)
+
+class Doc(api_server.Doc):
+
+    async def on_get(self, req, resp, name="index.html"):
+        stream, _ = self.open(name)
+        with stream:
+            resp.data = await asyncio.to_thread(stream.read)
+        resp.content_type = mimetypes.guess_type(name)[0]
+
+class Lifespan:
+    """Open and close the async database client with the ASGI server."""
+
+    def __init__(self, db):
+        self._db = db
+
+    async def process_startup(self, scope, event):
+        await self._db.connect()
+
+    async def process_shutdown(self, scope, event):
+        await self._db.close()
+
+def create_asgi_app(logic=None, db=None, doc_path="../doc/build/"):
+    """
+    Build the ASGI app. `logic` keeps its blocking backend for background
+    work, requests use `db`. By default MariaDB is reached through
+    aiomysql on the `[database]` primary, other backends (shards, the
+    embedded replica) run in worker threads.
+
+    Return
+    falcon.asgi.App: The API server
+    """
+    if logic is None:
+        logic = Logic()
+    if db is None:
+        if isinstance(logic.db, DBClient):
+            if len(logic.db.replicas) > 0:
+                print("WARNING: ASGI requests are served by the primary only, read replicas are not used.")
+            config = Config.get_config()["database"]
+            db = AsyncDBClient(
+                config["user"], config["password"], config["host"], config["port"],
+                pool_min_size=config.get("pool_min_size", 1),
+                pool_max_size=config.get("async_pool_max_size", 100),
+                pool_timeout=config.get("pool_timeout", 5),
+                archive=logic.db.archive)
+        else:
+            db = ThreadedAsyncBackend(logic.db)
+    ServerStatusState.follow(logic)
+    async_logic = AsyncLogic(logic, db)
+
+    config = Config.get_config()["preference"]
+    middleware = [Lifespan(db), MetricsMiddleware()]
+    if Config.get_config().get("tracing", {}).get("server_timing", True):
+        middleware.append(ServerTimingMiddleware())
+    app = falcon.asgi.App(cors_enable=True, middleware=middleware)
+    doc = Doc(doc_path)
+
+    app.add_static_route("/", doc._storage_path)
+    app.add_route("/", doc)
+    app.add_route("/{id}", Redirect(
+        async_logic,
+        doc,
+        config.get("redirect_status", 302),
+        config.get("redirect_cache_control", "public, max-age=300")))
+
+    app.add_route(f'/api/{API_VERSION}/shorten', GenerateLink(async_logic))
+    app.add_route(f'/api/{API_VERSION}/retrieve', RetrieveLink(async_logic))
+    app.add_route(f'/api/{API_VERSION}/status', ServerStatus())
+    app.add_route(f'/api/{API_VERSION}/metrics', Metrics(logic))
+    return app
@@ -0,0 +1,199 @@
+# This Source Code Form is subject to the terms of the Mozilla Public
+# License, v. 2.0. If a copy of the MPL was not distributed with this
+# file, You can obtain one at http://mozilla.org/MPL/2.0/.
+
+"""
+Async database access for the ASGI server.
+
+`AsyncDBClient` talks to MariaDB through aiomysql, which is only needed
+in ASGI mode and therefore not in requirements.txt:
+
+    pip install aiomysql
+
+`ThreadedAsyncBackend` serves any `StorageBackend` (e.g. the embedded
+replica) to the ASGI server by running its calls in worker threads.
+
+Access dates and background work (id pool, id filter, health checks)
+stay on the blocking backend of `Logic`. Both raise the same errors as
+`DBClient`, `DuplicateDigestError` when the URI is already stored and
+`mariadb.IntegrityError` when the id is taken, so `AsyncLogic` follows
+the same rules in both modes.
+"""
+
+import asyncio
+import mariadb
+from mariadb_client import DBClient, DuplicateDigestError, ARCHIVE_COLUMNS, DATABASE_NAME, ENTRY_COLUMNS, ER_DUP_ENTRY, HIGHEST_PORT
+from entry import Entry
+from metrics import instrument_query
+
+class AsyncDBClient:
+    """
+    aiomysql connection pool, opened by `connect()` from within the event
+    loop, e.g. on ASGI lifespan startup. Ids and digests not found in
+    `uri` are looked up in `uri_archive` if `archive`, and inserts check
+    it first, like `DBClient` does.
+    """
+
+    read_only = False
+
+    def __init__(self, user, password, host="::1", port=3306,
+                 pool_min_size=1, pool_max_size=100, pool_timeout=5, archive=False):
+        if not isinstance(user, str):
+            raise TypeError("Username must be a string type.")
+        elif not isinstance(password, str):
+            raise TypeError("Password must be a string type.")
+        elif not isinstance(host, str):
+            raise TypeError("Host must be a string type.")
+        elif not isinstance(port, int):
+            raise TypeError("Host must be an integer type.")
+        if port < 0 or port > HIGHEST_PORT:
+            raise TypeError(
+                f"Port number must be between 0 and {HIGHEST_PORT} inclusive.")
+
+        self._connect_args = {
+            "user": user,
+            "password": password,
+            "host": host,
+            "port": port,
+            "db": DATABASE_NAME,
+            "connect_timeout": 5,
+            "minsize": pool_min_size,
+            "maxsize": pool_max_size,
+        }
+        self.pool_timeout = pool_timeout
+        self.archive = archive
+        self.pool = None
+
+    async def connect(self):
+        import aiomysql
+        self.pool = await aiomysql.create_pool(**self._connect_args)
+
+    async def _execute(self, cmd, params=(), commit=False, archived=None):
+        """
+        Run `cmd` on a connection of the pool. If `archived` entries are
+        given, raise like `UnitOfWork.check_archived` first.
+        """
+        # Time spent waiting for a free connection is bounded like DBClient's pool
+        connection = await asyncio.wait_for(self.pool.acquire(), self.pool_timeout)
+        try:
+            async with connection.cursor() as cursor:
+                if not archived is None:
+                    check, check_params = DBClient.archived_query(archived, "%s")
+                    await cursor.execute(f"{check} LOCK IN SHARE MODE", check_params)
+                    DBClient.raise_archived(await cursor.fetchall(), archived)
+                await cursor.execute(cmd, params)
+                rows = await cursor.fetchall()
+            if commit:
+                await connection.commit()
+            return rows
+        except Exception:
+            await connection.rollback()
+            raise
+        finally:
+            self.pool.release(connection)
+
+    async def get_entry_from_id(self, id):
+        return await self.get_entries_from_ids([id])
+
+    async def get_entry_from_digest(self, digest):
+        return await self.get_entries_from_digests([digest])
+
+    @instrument_query
+    async def get_entries_from_ids(self, ids):
+        ids = list(ids)
+        for id in ids:
+            Entry.is_valid_id(id)
+        if len(ids) == 0:
+            return []
+        placeholders = ", ".join(["%s"] * len(ids))
+        entries = DBClient.to_entries(await self._execute(
+            f"SELECT {ENTRY_COLUMNS} FROM uri WHERE id IN ({placeholders})", tuple(ids)))
+
+        found = {entry.id for entry in entries}
+        missing = [id for id in dict.fromkeys(ids) if not id in found]
+        if self.archive and len(missing) > 0:
+            placeholders = ", ".join(["%s"] * len(missing))
+            entries += DBClient.to_entries(await self._execute(
+                f"SELECT {ARCHIVE_COLUMNS} FROM uri_archive WHERE id IN ({placeholders})", tuple(missing)))
+        return entries
+
+    @instrument_query
+    async def get_entries_from_digests(self, digests):
+        digests = [Entry.is_valid_digest(digest) for digest in digests]
+        if len(digests) == 0:
+            return []
+        placeholders = ", ".join(["%s"] * len(digests))
+        entries = DBClient.to_entries(await self._execute(
+            f"SELECT {ENTRY_COLUMNS} FROM uri WHERE sha256 IN ({placeholders})", tuple(digests)))
+
+        found = {entry.sha256 for entry in entries}
+        missing = [digest for digest in dict.fromkeys(digests) if not digest in found]
+        if self.archive and len(missing) > 0:
+            placeholders = ", ".join(["%s"] * len(missing))
+            entries += DBClient.to_entries(await self._execute(
+                f"SELECT {ARCHIVE_COLUMNS} FROM uri_archive WHERE sha256 IN ({placeholders})", tuple(missing)))
+        return entries
+
+    @instrument_query
+    async def create_new_entry(self, entry):
+        """
+        Raises:
+        DuplicateDigestError: URI is already stored
+        mariadb.IntegrityError: Id is already taken
+        """
+        import aiomysql
+        if not isinstance(entry, Entry):
+            raise TypeError("Not an Entry type.")
+        try:
+            await self._execute(
+                "INSERT INTO uri (id, original_uri, html_safe_uri, encoded_uri, sha256, expires_at) \
+                VALUES (%s, %s, %s, %s, %s, %s)",
+                DBClient.to_row(entry), commit=True, archived=[entry] if self.archive else None)
+        except aiomysql.IntegrityError as e:
+            if e.args[0] != ER_DUP_ENTRY:
+                raise
+            error = mariadb.IntegrityError(e.args[1])
+            if DBClient.duplicate_key(error) == "sha256":
+                raise DuplicateDigestError(e.args[1]) from e
+            raise error from e
+
+    @instrument_query
+    async def ping(self):
+        await self._execute("SELECT 1")
+
+    async def close(self):
+        if not self.pool is None:
+            self.pool.close()
+            await self.pool.wait_closed()
+            self.pool = None
+
+class ThreadedAsyncBackend:
+    """Async facade over a blocking `StorageBackend`, calls run in worker threads."""
+
+    def __init__(self, backend):
+        self.backend = backend
+        self.read_only = backend.read_only
+
+    async def connect(self):
+        pass
+
+    async def get_entry_from_id(self, id):
+        return await asyncio.to_thread(self.backend.get_entry_from_id, id)
+
+    async def get_entry_from_digest(self, digest):
+        return await asyncio.to_thread(self.backend.get_entry_from_digest, digest)
+
+    async def get_entries_from_ids(self, ids):
+        return await asyncio.to_thread(self.backend.get_entries_from_ids, list(ids))
+
+    async def get_entries_from_digests(self, digests):
+        return await asyncio.to_thread(self.backend.get_entries_from_digests, list(digests))
+
+    async def create_new_entry(self, entry):
+        await asyncio.to_thread(self.backend.create_new_entry, entry)
+
+    async def ping(self):
+        await asyncio.to_thread(self.backend.ping)
+
+    async def close(self):
+        pass
@@ -0,0 +1,119 @@
+# This Source Code Form is subject to the terms of the Mozilla Public
+# License, v. 2.0. If a copy of the MPL was not distributed with this
+# file, You can obtain one at http://mozilla.org/MPL/2.0/.
+
+import asyncio
+import mariadb
+import math
+from mariadb_client import DuplicateDigestError
+from entry import Entry
+from logic import Logic
+from metrics import ID_ATTEMPTS
+
+class AsyncLogic:
+    """
+    Request path of `Logic` on an async database client, for the ASGI
+    server. Rules and in-process state (reserved paths, charset, cache,
+    id filter, id pool, buffered access dates) are those of `logic`,
+    whose background threads keep using its blocking backend.
+
+    Mirrors the methods of `Logic` with the same name, keep both in sync.
+    """
+
+    def __init__(self, logic, db):
+        if not isinstance(logic, Logic):
+            raise TypeError("Not a Logic type.")
+        self.logic = logic
+        self.db = db
+
+    async def gen_new_id(self, long_uri, expires_at=None):
+        """
+        Shorten a URI, links that expire at `expires_at` always get a new
+        id, other links are deduplicated.
+
+        Returns:
+        None: Some error has occurred (Pool of available id running low etc..)
+        Entry: Entry instance containing the id
+        """
+        if not isinstance(long_uri, str):
+            raise TypeError(f"\"{long_uri}\" not a string.")
+
+        new_entry = Entry("", long_uri, None, None, expires_at)
+        if not expires_at is None:
+            return await self.insert_entry(new_entry)
+        return await self.insert_or_get_entry(new_entry)
+
+    async def insert_or_get_entry(self, new_entry):
+        for _ in range(2):
+            try:
+                return await self.insert_entry(new_entry)
+            except DuplicateDigestError:
+                existing_entry = await self.db.get_entry_from_digest(new_entry.sha256)
+                if len(existing_entry) > 0:
+                    self.logic.id_filter.add(existing_entry[0].id)
+                    return existing_entry[0]
+            # Existing entry was removed in the mean time, try inserting again
+        return None
+
+    async def next_id(self):
+        if not self.logic.sequence_ids is None:
+            # Blocks for a query once per block of ids
+            return await asyncio.to_thread(self.logic.next_id)
+
+        new_id = self.logic.id_pool.pop()
+        if new_id is None:
+            new_id = await self.gen_checked_id()
+        return new_id
+
+    async def insert_entry(self, new_entry):
+        for attempt in range(1, 51): # Max attempt
+            new_id = await self.next_id()
+            if new_id is None:
+                new_entry.id = ""
+                return None
+            new_entry.id = new_id
+            try:
+                await self.db.create_new_entry(new_entry)
+            except mariadb.IntegrityError:
+                continue
+            self.logic.id_filter.add(new_id)
+            ID_ATTEMPTS.observe(attempt, stage="insert")
+            return new_entry
+        print("WARNING: Cannot insert entry, max attempt reached.")
+        ID_ATTEMPTS.observe(math.inf, stage="insert")
+        new_entry.id = ""
+        return None
+
+    async def gen_checked_id(self):
+        for attempt in range(1, 52): # Max attempt
+            new_id = Logic.no_check_gen_id(self.logic.charset, self.logic.id_chars)
+            if new_id in self.logic.reserved_path:
+                continue
+            if len(await self.get_stored_entry(new_id)) == 0:
+                ID_ATTEMPTS.observe(attempt, stage="check")
+                return new_id
+        print("WARNING: Cannot generate ID, max attempt reached.")
+        ID_ATTEMPTS.observe(math.inf, stage="check")
+        return None
+
+    async def get_stored_entry(self, id):
+        if not self.logic.id_filter.might_contain(id):
+            return []
+        return await self.db.get_entry_from_id(id)
+
+    async def get_uri(self, id):
+        entry = self.logic.cache.get(id)
+        if entry is None:
+            result = await self.get_stored_entry(id)
+            if len(result) < 1:
+                return None
+            entry = result[0]
+            self.logic.cache.put(id, entry)
+        if not entry.is_expired():
+            if self.logic.access_writer.flush_interval == 0:
+                # Unbuffered access dates are written right away, off the event loop
+                await asyncio.to_thread(self.logic.access_writer.record, id)
+            else:
+                self.logic.access_writer.record(id)
+            self.logic.click_counter.record(id)
+        return entry
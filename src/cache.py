@@ -0,0 +1,91 @@
+# This Source Code Form is subject to the terms of the Mozilla Public
+# License, v. 2.0. If a copy of the MPL was not distributed with this
+# file, You can obtain one at http://mozilla.org/MPL/2.0/.
+
+from collections import OrderedDict
+import threading
+import time
+
+class LRUCache:
+    """
+    Bounded, thread-safe LRU cache where every item expires `ttl` seconds
+    after it was inserted.
+    A `max_size` of 0 disables the cache, all lookups will then miss.
+    """
+
+    def __init__(self, max_size=4096, ttl=300, clock=time.monotonic):
+        if not isinstance(max_size, int):
+            raise TypeError("Cache size must be an integer type.")
+        elif not isinstance(ttl, (int, float)):
+            raise TypeError("Cache TTL must be a number.")
+        if max_size < 0:
+            raise ValueError("Cache size cannot be negative.")
+        elif ttl <= 0:
+            raise ValueError("Cache TTL must be greater than 0.")
+
+        self.max_size = max_size
+        self.ttl = ttl
+        self._clock = clock
+        self._items = OrderedDict() # key -> (expiry time, value)
+        self._lock = threading.Lock()
+        self.hits = 0
+        self.misses = 0
+        self.evictions = 0
+        self.expirations = 0
+
+    def get(self, key):
+        """
+        Return:
+        None: Key not cached or expired
+        Any: Cached value
+        """
+        with self._lock:
+            item = self._items.get(key)
+            if item is None:
+                self.misses += 1
+                return None
+            expiry, value = item
+            if expiry <= self._clock():
+                del self._items[key]
+                self.expirations += 1
+                self.misses += 1
+                return None
+            self._items.move_to_end(key)
+            self.hits += 1
+            return value
+
+    def put(self, key, value):
+        if self.max_size == 0:
+            return
+        with self._lock:
+            self._items[key] = (self._clock() + self.ttl, value)
+            self._items.move_to_end(key)
+            while len(self._items) > self.max_size:
+                self._items.popitem(last=False)
+                self.evictions += 1
+
+    def invalidate(self, key):
+        with self._lock:
+            self._items.pop(key, None)
+
+    def clear(self):
+        with self._lock:
+            self._items.clear()
+
+    def stats(self):
+        """
+        Return
+        dict: Current size and hit/miss/eviction counters
+        """
+        with self._lock:
+            return {
+                "size": len(self._items),
+                "max_size": self.max_size,
+                "hits": self.hits,
+                "misses": self.misses,
+                "evictions": self.evictions,
+                "expirations": self.expirations,
+            }
+
+    def __len__(self):
+        return len(self._items)
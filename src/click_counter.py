@@ -0,0 +1,116 @@
+# This Source Code Form is subject to the terms of the Mozilla Public
+# License, v. 2.0. If a copy of the MPL was not distributed with this
+# file, You can obtain one at http://mozilla.org/MPL/2.0/.
+
+import datetime
+import threading
+
+class ClickCounter:
+    """
+    Write-behind click counts per id and day, for the `uri_clicks` rollup
+    table.
+
+    Clicks are counted in memory and added to the database in bulk by a
+    background thread, either every `flush_interval` seconds or as soon as
+    about `flush_size` counters are buffered, so that a click never costs
+    a write of its own. Counters are spread over `shards` dicts, each with
+    its own lock, so that concurrent requests rarely wait on each other.
+    A `flush_interval` of 0 disables counting.
+    """
+
+    def __init__(self, db, flush_interval=5, flush_size=10000, shards=16):
+        if not isinstance(flush_interval, (int, float)):
+            raise TypeError("Flush interval must be a number.")
+        elif not isinstance(flush_size, int) or not isinstance(shards, int):
+            raise TypeError("Flush size and shards must be an integer type.")
+        if flush_interval < 0:
+            raise ValueError("Flush interval cannot be negative.")
+        elif flush_size < 1 or shards < 1:
+            raise ValueError("Flush size and shards must be greater than 0.")
+
+        self.db = db
+        self.flush_interval = flush_interval
+        self.flush_size = flush_size
+        self._locks = [threading.Lock() for _ in range(shards)]
+        self._counts = [{} for _ in range(shards)] # (id, day) -> clicks
+        self._flush_lock = threading.Lock()
+        self._wake = threading.Event()
+        self._stopped = threading.Event()
+        self._thread = None
+        self.flushed = 0
+        self.flush_errors = 0
+
+        if self.flush_interval > 0:
+            self._thread = threading.Thread(
+                target=self._run, name="click-counter", daemon=True)
+            self._thread.start()
+
+    def record(self, id, day=None, clicks=1):
+        if self._thread is None:
+            return
+        if day is None:
+            day = datetime.date.today()
+        self._add(id, day, clicks)
+
+    def _add(self, id, day, clicks):
+        # Shard on the id only, so counters of different shards never clash
+        shard = hash(id) % len(self._locks)
+        with self._locks[shard]:
+            counts = self._counts[shard]
+            counts[(id, day)] = counts.get((id, day), 0) + clicks
+            pending = len(counts)
+        if pending * len(self._locks) >= self.flush_size:
+            self._wake.set()
+
+    def flush(self):
+        """
+        Add all buffered counts to the database.
+
+        Return
+        int: Number of counters written
+        """
+        with self._flush_lock:
+            batch = {}
+            for shard, lock in enumerate(self._locks):
+                with lock:
+                    counts = self._counts[shard]
+                    self._counts[shard] = {}
+                batch.update(counts)
+            if len(batch) == 0:
+                return 0
+
+            try:
+                self.db.add_clicks(batch)
+            except Exception as e:
+                print(f"WARNING: Failed to write click counts, will retry. {e}")
+                self.flush_errors += 1
+                # Put the batch back, adding to clicks counted since
+                for (id, day), clicks in batch.items():
+                    self._add(id, day, clicks)
+                return 0
+
+            self.flushed += sum(batch.values())
+            return len(batch)
+
+    def _run(self):
+        while not self._stopped.is_set():
+            self._wake.wait(self.flush_interval)
+            self._wake.clear()
+            self.flush()
+
+    def close(self):
+        """Stop the background thread and drain the buffer."""
+        self._stopped.set()
+        self._wake.set()
+        if self._thread is not None:
+            self._thread.join()
+            self._thread = None
+        self.flush()
+
+    def pending(self):
+        """Return the number of buffered counters."""
+        total = 0
+        for shard, lock in enumerate(self._locks):
+            with lock:
+                total += len(self._counts[shard])
+        return total
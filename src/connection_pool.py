@@ -0,0 +1,163 @@
+# This Source Code Form is subject to the terms of the Mozilla Public
+# License, v. 2.0. If a copy of the MPL was not distributed with this
+# file, You can obtain one at http://mozilla.org/MPL/2.0/.
+
+from collections import deque
+from contextlib import contextmanager
+import threading
+import time
+
+class PoolTimeoutError(Exception):
+    """Raised when no connection could be checked out before the timeout."""
+
+class ConnectionPool:
+    """
+    Thread-safe pool of database connections.
+
+    `connect` is a callable returning a new connection. The pool opens
+    `min_size` connections up front and grows on demand up to `max_size`.
+    Idle connections are validated with `validate(connection)` on checkout
+    when they have been idle for at least `validation_interval` seconds,
+    connections failing validation are discarded and replaced.
+    """
+
+    def __init__(self, connect, min_size=1, max_size=10, timeout=5,
+                 validate=None, validation_interval=30, clock=time.monotonic):
+        if not callable(connect):
+            raise TypeError("connect must be callable.")
+        elif not isinstance(min_size, int) or not isinstance(max_size, int):
+            raise TypeError("Pool size must be an integer type.")
+        elif not isinstance(timeout, (int, float)):
+            raise TypeError("Pool timeout must be a number.")
+        if min_size < 0:
+            raise ValueError("Minimum pool size cannot be negative.")
+        elif max_size < 1 or max_size < min_size:
+            raise ValueError("Maximum pool size must be at least 1 and not less than the minimum size.")
+        elif timeout < 0:
+            raise ValueError("Pool timeout cannot be negative.")
+
+        self._connect = connect
+        self._validate = validate
+        self.min_size = min_size
+        self.max_size = max_size
+        self.timeout = timeout
+        self.validation_interval = validation_interval
+        self._clock = clock
+        self._idle = deque() # (connection, time returned to pool)
+        self._size = 0 # Connections currently open, idle or checked out
+        self._cond = threading.Condition()
+        self._closed = False
+
+        for _ in range(min_size):
+            self._idle.append((self._connect(), self._clock()))
+            self._size += 1
+
+    def acquire(self, timeout=None):
+        """
+        Check out a connection, waiting up to `timeout` seconds
+        (pool default if None) for one to become available.
+        """
+        if timeout is None:
+            timeout = self.timeout
+        deadline = self._clock() + timeout
+
+        while True:
+            with self._cond:
+                while True:
+                    if self._closed:
+                        raise PoolTimeoutError("Connection pool is closed.")
+                    if len(self._idle) > 0:
+                        connection, idle_since = self._idle.pop()
+                        break
+                    if self._size < self.max_size:
+                        # Reserve a slot, connect outside of the lock
+                        self._size += 1
+                        connection, idle_since = None, None
+                        break
+                    remaining = deadline - self._clock()
+                    if remaining <= 0:
+                        raise PoolTimeoutError(
+                            f"No database connection available after {timeout} seconds.")
+                    self._cond.wait(remaining)
+
+            if connection is None:
+                try:
+                    return self._connect()
+                except Exception:
+                    self._discard(None)
+                    raise
+
+            if self._is_healthy(connection, idle_since):
+                return connection
+            print("WARNING: Discarding unhealthy database connection.")
+            self._discard(connection)
+
+    def release(self, connection, broken=False):
+        """Return a connection to the pool, closing it instead if `broken`."""
+        if broken or self._closed:
+            self._discard(connection)
+            return
+        with self._cond:
+            self._idle.append((connection, self._clock()))
+            self._cond.notify()
+
+    @contextmanager
+    def connection(self, timeout=None):
+        """
+        Borrow a connection for the duration of a `with` block.
+        The connection is rolled back if the block raises, and discarded
+        if the rollback fails as well.
+        """
+        connection = self.acquire(timeout)
+        try:
+            yield connection
+        except Exception:
+            broken = False
+            try:
+                connection.rollback()
+            except Exception:
+                broken = True
+            self.release(connection, broken)
+            raise
+        self.release(connection)
+
+    def close(self):
+        with self._cond:
+            self._closed = True
+            idle = list(self._idle)
+            self._idle.clear()
+            self._cond.notify_all()
+        for connection, _ in idle:
+            self._discard(connection)
+
+    def stats(self):
+        with self._cond:
+            return {
+                "size": self._size,
+                "idle": len(self._idle),
+                "in_use": self._size - len(self._idle),
+                "min_size": self.min_size,
+                "max_size": self.max_size,
+            }
+
+    def _is_healthy(self, connection, idle_since):
+        if self._validate is None:
+            return True
+        if self._clock() - idle_since < self.validation_interval:
+            return True
+        try:
+            self._validate(connection)
+        except Exception as e:
+            print(f"WARNING: {e}")
+            return False
+        return True
+
+    def _discard(self, connection):
+        if connection is not None:
+            try:
+                connection.close()
+            except Exception:
+                pass
+        with self._cond:
+            self._size -= 1
+            self._cond.notify()
@@ -0,0 +1,214 @@
+# This Source Code Form is subject to the terms of the Mozilla Public
+# License, v. 2.0. If a copy of the MPL was not distributed with this
+# file, You can obtain one at http://mozilla.org/MPL/2.0/.
+
+"""
+Schema migrations for existing `uri` tables.
+
+Every migration checks whether it was already applied, so running this
+module again is safe:
+
+    python db_migration.py
+
+Enable `maintenance_mode` while migrating a live database.
+"""
+
+import mariadb
+from mariadb_client import DBClient, DATABASE_NAME
+from entry import Entry
+
+def has_unique_digest(db):
+    with db.pool.connection() as connection:
+        cursor = connection.cursor()
+        cursor.execute(
+            "SELECT NON_UNIQUE FROM information_schema.STATISTICS \
+            WHERE TABLE_SCHEMA=? AND TABLE_NAME='uri' AND INDEX_NAME='sha256'",
+            (DATABASE_NAME,))
+        query = cursor.fetchall()
+        cursor.close()
+    return len(query) > 0 and int(query[0][0]) == 0
+
+def clear_duplicate_digests(db, chunk_size=1000):
+    """
+    Keep the digest on the oldest row of every URI and set it to NULL on
+    the newer duplicates, so that a unique key can be added. Duplicate
+    rows keep their id and URI, existing short links stay valid.
+
+    Return
+    int: Number of rows cleared
+    """
+    cleared = 0
+    while True:
+        with db.pool.connection() as connection:
+            cursor = connection.cursor()
+            cursor.execute(
+                "SELECT sha256 FROM uri WHERE sha256 IS NOT NULL \
+                GROUP BY sha256 HAVING COUNT(*) > 1 LIMIT ?",
+                (chunk_size,))
+            digests = [row[0] for row in cursor.fetchall()]
+            for digest in digests:
+                cursor.execute(
+                    "SELECT id FROM uri WHERE sha256=? ORDER BY created_on, id",
+                    (digest,))
+                duplicate_ids = [row[0] for row in cursor.fetchall()][1:]
+                placeholders = ", ".join("?" * len(duplicate_ids))
+                cursor.execute(
+                    f"UPDATE uri SET sha256=NULL WHERE id IN ({placeholders})",
+                    tuple(duplicate_ids))
+                cleared += len(duplicate_ids)
+            connection.commit()
+            cursor.close()
+        if len(digests) < chunk_size:
+            return cleared
+
+def migrate_unique_digest(db, chunk_size=1000):
+    """Replace the non-unique sha256 index with a unique one."""
+    if has_unique_digest(db):
+        print("sha256 is already unique, skipping.")
+        return
+
+    with db.pool.connection() as connection:
+        cursor = connection.cursor()
+        cursor.execute(
+            f"ALTER TABLE uri MODIFY sha256 BINARY({Entry.SHA256_BYTE_LEN}) NULL")
+        connection.commit()
+        cursor.close()
+
+    # Retry in case new duplicates were inserted while clearing
+    for attempt in range(3):
+        cleared = clear_duplicate_digests(db, chunk_size)
+        print(f"Cleared digest of {cleared} duplicate rows.")
+        try:
+            with db.pool.connection() as connection:
+                cursor = connection.cursor()
+                cursor.execute(
+                    "ALTER TABLE uri DROP INDEX sha256, ADD UNIQUE INDEX sha256 (sha256)")
+                connection.commit()
+                cursor.close()
+        except mariadb.IntegrityError as e:
+            print(f"WARNING: {e}")
+            continue
+        print("sha256 is now unique.")
+        return
+    raise RuntimeError("Could not add unique key on sha256, enable maintenance mode and try again.")
+
+def migrate_stored_uri_forms(db, chunk_size=1000):
+    """
+    Add the html_safe_uri and encoded_uri columns and backfill them in
+    chunks, so reads no longer need to run the URI through `Entry`.
+    """
+    if not db.has_column("uri", "encoded_uri"):
+        with db.pool.connection() as connection:
+            cursor = connection.cursor()
+            cursor.execute(
+                "ALTER TABLE uri \
+                ADD COLUMN html_safe_uri TEXT NULL AFTER original_uri, \
+                ADD COLUMN encoded_uri TEXT NULL AFTER html_safe_uri")
+            connection.commit()
+            cursor.close()
+
+    backfilled = 0
+    last_id = ""
+    while True:
+        with db.pool.connection() as connection:
+            cursor = connection.cursor()
+            cursor.execute(
+                "SELECT id, original_uri FROM uri \
+                WHERE id > ? AND (html_safe_uri IS NULL OR encoded_uri IS NULL) \
+                ORDER BY id LIMIT ?",
+                (last_id, chunk_size,))
+            rows = cursor.fetchall()
+            params = []
+            for id, uri in rows:
+                # Same values a read would have computed for this row
+                entry = Entry(id, uri)
+                params.append((entry.html_safe_uri, entry.encoded_uri, id,))
+            if len(params) > 0:
+                cursor.executemany(
+                    "UPDATE uri SET html_safe_uri=?, encoded_uri=? WHERE id=?",
+                    params)
+            connection.commit()
+            cursor.close()
+        backfilled += len(rows)
+        if len(rows) < chunk_size:
+            break
+        last_id = rows[-1][0]
+        print(f"Backfilled {backfilled} rows...")
+    print(f"Backfilled stored URI forms of {backfilled} rows.")
+
+def migrate_created_on_index(db):
+    """Index created_on, the id filter reads recently created ids with it."""
+    with db.pool.connection() as connection:
+        cursor = connection.cursor()
+        cursor.execute(
+            "SELECT 1 FROM information_schema.STATISTICS \
+            WHERE TABLE_SCHEMA=? AND TABLE_NAME='uri' AND INDEX_NAME='created_on'",
+            (DATABASE_NAME,))
+        exists = len(cursor.fetchall()) > 0
+        if not exists:
+            cursor.execute("ALTER TABLE uri ADD INDEX created_on (created_on)")
+            connection.commit()
+        cursor.close()
+    if exists:
+        print("created_on is already indexed, skipping.")
+    else:
+        print("created_on is now indexed.")
+
+def migrate_expiry(db):
+    """
+    Add the expires_at column, and index it and last_accessed for the
+    purger, see `purger.py`.
+    """
+    if db.has_column("uri", "expires_at"):
+        print("expires_at already exists, skipping.")
+        return
+    with db.pool.connection() as connection:
+        cursor = connection.cursor()
+        cursor.execute(
+            "ALTER TABLE uri \
+            ADD COLUMN expires_at DATETIME NULL AFTER last_accessed, \
+            ADD INDEX last_accessed (last_accessed), \
+            ADD INDEX expires_at (expires_at)")
+        connection.commit()
+        cursor.close()
+    print("expires_at added.")
+
+def migrate_archive_digest_index(db):
+    """Index the digests of uri_archive, checked before every insert."""
+    if not db.has_table("uri_archive"):
+        print("No uri_archive, skipping.")
+        return
+    with db.pool.connection() as connection:
+        cursor = connection.cursor()
+        cursor.execute(
+            "SELECT 1 FROM information_schema.STATISTICS \
+            WHERE TABLE_SCHEMA=? AND TABLE_NAME='uri_archive' AND INDEX_NAME='sha256'",
+            (DATABASE_NAME,))
+        exists = len(cursor.fetchall()) > 0
+        if not exists:
+            cursor.execute("ALTER TABLE uri_archive ADD INDEX sha256 (sha256)")
+            connection.commit()
+        cursor.close()
+    if exists:
+        print("uri_archive sha256 is already indexed, skipping.")
+    else:
+        print("uri_archive sha256 is now indexed.")
+
+MIGRATIONS = [
+    migrate_unique_digest,
+    migrate_stored_uri_forms,
+    migrate_created_on_index,
+    migrate_expiry,
+    migrate_archive_digest_index,
+]
+
+if "__main__" == __name__:
+    from config_parser import ConfigParser
+    ConfigParser()
+    config = ConfigParser.get_config()["database"]
+    db = DBClient(config["user"], config["password"], config["host"], config["port"],
+                  check_schema=False)
+    for migration in MIGRATIONS:
+        print(f"Running {migration.__name__}...")
+        migration(db)
+    db.close_connection()
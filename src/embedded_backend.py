@@ -0,0 +1,332 @@
+# This Source Code Form is subject to the terms of the Mozilla Public
+# License, v. 2.0. If a copy of the MPL was not distributed with this
+# file, You can obtain one at http://mozilla.org/MPL/2.0/.
+
+import datetime
+import os
+import sqlite3
+import threading
+import time
+from entry import Entry
+from storage_backend import StorageBackend, ReadOnlyBackendError
+
+COLUMNS = "id, original_uri, html_safe_uri, encoded_uri, sha256, created_on, last_accessed, expires_at"
+INSERT = f"INSERT OR REPLACE INTO uri ({COLUMNS}) VALUES (?, ?, ?, ?, ?, ?, ?, ?)"
+
+class EmbeddedBackend(StorageBackend):
+    """
+    Read-only replica of the `uri` table in a local SQLite file, read
+    through memory-mapped I/O, so retrieve-only nodes serve lookups
+    without a network hop.
+
+    `connect_source()` must return the primary backend, which needs a
+    `load_entries(since)` streaming rows of `COLUMNS` the same way
+    `DBClient.load_ids` does. A background thread writes a full snapshot
+    to a new file and swaps it in every `snapshot_interval` seconds, and
+    between snapshots copies rows created since the last seen
+    `created_on` every `sync_interval` seconds. Deleted rows disappear
+    with the next snapshot. The replica survives restarts, only the
+    incremental sync runs on start if the file already exists.
+
+    Access dates are forwarded to the primary, shortening is refused.
+    """
+
+    read_only = True
+    SYNC_OVERLAP = datetime.timedelta(seconds=60)
+
+    def __init__(self, path, connect_source=None, sync_interval=5,
+                 snapshot_interval=3600, mmap_size=256 * 2 ** 20, clock=time.monotonic):
+        if not isinstance(path, str):
+            raise TypeError("Path must be a string type.")
+        elif not connect_source is None and not callable(connect_source):
+            raise TypeError("connect_source must be callable.")
+        elif not isinstance(sync_interval, (int, float)) or not isinstance(snapshot_interval, (int, float)):
+            raise TypeError("Sync intervals must be an integer or float type.")
+        elif not isinstance(mmap_size, int):
+            raise TypeError("mmap size must be an integer type.")
+        if sync_interval <= 0 or snapshot_interval <= 0:
+            raise ValueError("Sync intervals must be greater than 0.")
+        elif mmap_size < 0:
+            raise ValueError("mmap size cannot be negative.")
+
+        self.path = os.path.abspath(path)
+        self._connect_source = connect_source
+        self._source = None
+        self.sync_interval = sync_interval
+        self.snapshot_interval = snapshot_interval
+        self.mmap_size = mmap_size
+        self._clock = clock
+        self._generation = 0 # Bumped whenever a snapshot replaces the file
+        self._local = threading.local()
+        self._lock = threading.Lock()
+        self._stopped = threading.Event()
+        self._thread = None
+        self._next_snapshot = clock() if not os.path.exists(self.path) else clock() + snapshot_interval
+        self.snapshots = 0
+        self.syncs = 0
+        self.sync_errors = 0
+        self.last_snapshot_duration = 0.0
+
+    def start(self):
+        if self._connect_source is None or self._thread is not None:
+            return
+        self._stopped.clear()
+        self._thread = threading.Thread(
+            target=self._run, name="embedded-sync", daemon=True)
+        self._thread.start()
+
+    def stop(self):
+        self._stopped.set()
+        if self._thread is not None:
+            self._thread.join()
+            self._thread = None
+
+    def _reader(self):
+        """Connection of the calling thread, reopened after a snapshot swap."""
+        generation = self._generation
+        if getattr(self._local, "generation", None) != generation:
+            if getattr(self._local, "connection", None) is not None:
+                self._local.connection.close()
+            self._local.connection = None
+            if not os.path.exists(self.path):
+                return None
+            connection = sqlite3.connect(f"file:{self.path}?mode=ro", uri=True, timeout=5)
+            connection.execute(f"PRAGMA mmap_size={self.mmap_size}")
+            self._local.connection = connection
+            self._local.generation = generation
+        return self._local.connection
+
+    def _select(self, column, values):
+        values = list(values)
+        connection = self._reader()
+        if connection is None or len(values) == 0:
+            return []
+        placeholders = ", ".join("?" * len(values))
+        rows = connection.execute(
+            f"SELECT {COLUMNS} FROM uri WHERE {column} IN ({placeholders})", values).fetchall()
+        return [EmbeddedBackend.to_entry(row) for row in rows]
+
+    @staticmethod
+    def to_entry(row):
+        id, uri, html_safe_uri, encoded_uri, sha256, created_on, last_accessed, expires_at = row
+        return Entry.from_row(
+            id, uri, html_safe_uri, encoded_uri, sha256,
+            *(datetime.datetime.fromisoformat(value) if not value is None else None
+              for value in (created_on, last_accessed, expires_at)))
+
+    @staticmethod
+    def to_row(row):
+        return tuple(value.isoformat(" ") if isinstance(value, datetime.datetime)
+                     else bytes(value) if isinstance(value, bytearray) else value
+                     for value in row)
+
+    def get_entry_from_id(self, id):
+        Entry.is_valid_id(id)
+        return self._select("id", [id])
+
+    def get_entry_from_digest(self, digest):
+        return self._select("sha256", [Entry.is_valid_digest(digest)])
+
+    def get_entries_from_ids(self, ids):
+        ids = list(ids)
+        for id in ids:
+            Entry.is_valid_id(id)
+        return self._select("id", ids)
+
+    def get_entries_from_digests(self, digests):
+        return self._select("sha256", [Entry.is_valid_digest(digest) for digest in digests])
+
+    def create_new_entry(self, entry):
+        raise ReadOnlyBackendError("Embedded backend only serves retrieves.")
+
+    def create_new_entries(self, entries):
+        raise ReadOnlyBackendError("Embedded backend only serves retrieves.")
+
+    def update_access_dates(self, accessed):
+        """Forward to the primary, dropped if there is none."""
+        if self._connect_source is None or len(accessed) == 0:
+            return
+        self._get_source().update_access_dates(accessed)
+
+    def add_clicks(self, clicks):
+        """Forward to the primary, dropped if there is none."""
+        if self._connect_source is None or len(clicks) == 0:
+            return
+        self._get_source().add_clicks(clicks)
+
+    def get_clicks(self, id, since=None):
+        """Counts are not replicated, read from the primary."""
+        if self._connect_source is None:
+            return 0, []
+        return self._get_source().get_clicks(id, since)
+
+    def ping(self):
+        connection = self._reader()
+        if connection is None:
+            raise RuntimeError("No snapshot of the primary loaded yet.")
+        connection.execute("SELECT 1 FROM uri LIMIT 1")
+
+    def load_ids(self, since=None, chunk_size=10000):
+        connection = self._reader()
+        if connection is None:
+            return []
+        if since is None:
+            rows = connection.execute("SELECT id, created_on FROM uri")
+        else:
+            rows = connection.execute(
+                "SELECT id, created_on FROM uri WHERE created_on >= ?",
+                (since.isoformat(" "),))
+        return [(id, datetime.datetime.fromisoformat(created_on)) for id, created_on in rows]
+
+    def _get_source(self):
+        with self._lock:
+            if self._source is None:
+                self._source = self._connect_source()
+            return self._source
+
+    def _write(self, path):
+        connection = sqlite3.connect(path, timeout=5)
+        connection.execute(
+            "CREATE TABLE IF NOT EXISTS uri (\
+            id TEXT NOT NULL PRIMARY KEY,\
+            original_uri TEXT NOT NULL,\
+            html_safe_uri TEXT NULL,\
+            encoded_uri TEXT NULL,\
+            sha256 BLOB NULL,\
+            created_on TEXT NULL,\
+            last_accessed TEXT NULL,\
+            expires_at TEXT NULL) WITHOUT ROWID")
+        columns = [row[1] for row in connection.execute("PRAGMA table_info(uri)")]
+        if not "expires_at" in columns:
+            # Replica written before links could expire
+            connection.execute("ALTER TABLE uri ADD COLUMN expires_at TEXT NULL")
+        connection.execute("CREATE INDEX IF NOT EXISTS sha256 ON uri (sha256)")
+        connection.execute("CREATE INDEX IF NOT EXISTS created_on ON uri (created_on)")
+        connection.execute(
+            "CREATE TABLE IF NOT EXISTS sync_state (name TEXT NOT NULL PRIMARY KEY, value TEXT)")
+        return connection
+
+    def _store(self, connection, rows, chunk_size=10000):
+        """
+        Upsert rows in chunks.
+
+        Return
+        (int, datetime): Rows stored and latest created_on, None if no rows
+        """
+        stored = 0
+        synced_until = None
+        chunk = []
+        for row in rows:
+            chunk.append(EmbeddedBackend.to_row(row))
+            if not row[5] is None and (synced_until is None or row[5] > synced_until):
+                synced_until = row[5]
+            if len(chunk) >= chunk_size:
+                connection.executemany(INSERT, chunk)
+                connection.commit()
+                stored += len(chunk)
+                chunk = []
+        if len(chunk) > 0:
+            connection.executemany(INSERT, chunk)
+            stored += len(chunk)
+        return stored, synced_until
+
+    def _set_synced_until(self, connection, synced_until):
+        if synced_until is None:
+            return
+        connection.execute(
+            "INSERT OR REPLACE INTO sync_state (name, value) VALUES ('synced_until', ?)",
+            (synced_until.isoformat(" "),))
+
+    def _get_synced_until(self, connection):
+        row = connection.execute("SELECT value FROM sync_state WHERE name='synced_until'").fetchone()
+        return datetime.datetime.fromisoformat(row[0]) if not row is None else None
+
+    def snapshot(self):
+        """
+        Copy every row of the primary to a new file and swap it in.
+
+        Return
+        int: Number of rows copied
+        """
+        start = self._clock()
+        tmp_path = f"{self.path}.tmp"
+        if os.path.exists(tmp_path):
+            os.remove(tmp_path)
+        connection = self._write(tmp_path)
+        try:
+            stored, synced_until = self._store(connection, self._get_source().load_entries(None))
+            self._set_synced_until(connection, synced_until)
+            connection.commit()
+        finally:
+            connection.close()
+        # Readers keep the old file open until they notice the new generation
+        os.replace(tmp_path, self.path)
+        duration = self._clock() - start
+        with self._lock:
+            self._generation += 1
+            self.snapshots += 1
+            self.last_snapshot_duration = duration
+        # Rows committed behind the scan while it was running
+        self.sync(datetime.timedelta(seconds=duration))
+        return stored
+
+    def sync(self, extra_overlap=datetime.timedelta()):
+        """
+        Copy rows created since the last snapshot or sync.
+
+        Return
+        int: Number of rows copied
+        """
+        connection = self._write(self.path)
+        try:
+            previous = self._get_synced_until(connection)
+            since = None
+            if not previous is None:
+                since = previous - EmbeddedBackend.SYNC_OVERLAP - extra_overlap
+            stored, synced_until = self._store(connection, self._get_source().load_entries(since))
+            if not synced_until is None and (previous is None or synced_until > previous):
+                self._set_synced_until(connection, synced_until)
+            connection.commit()
+        finally:
+            connection.close()
+        self.syncs += 1
+        return stored
+
+    def _run(self):
+        while not self._stopped.is_set():
+            try:
+                if self._clock() >= self._next_snapshot:
+                    self.snapshot()
+                    self._next_snapshot = self._clock() + self.snapshot_interval
+                else:
+                    self.sync()
+            except Exception as e:
+                print(f"WARNING: Failed to sync embedded backend. {e}")
+                self.sync_errors += 1
+                # Reconnect on the next attempt
+                self._drop_source()
+            self._stopped.wait(self.sync_interval)
+
+    def _drop_source(self):
+        """Close the connection to the primary, if any."""
+        with self._lock:
+            source, self._source = self._source, None
+        if source is None:
+            return
+        try:
+            source.close_connection()
+        except Exception as e:
+            print(f"WARNING: Failed to close connection to the primary. {e}")
+
+    def stats(self):
+        return {
+            "generation": self._generation,
+            "snapshots": self.snapshots,
+            "syncs": self.syncs,
+            "sync_errors": self.sync_errors,
+            "last_snapshot_duration": self.last_snapshot_duration,
+        }
+
+    def close_connection(self):
+        self.stop()
+        self._drop_source()
@@ -6,28 +6,92 @@ import datetime
 from cryptography.hazmat.primitives import hashes
 import bleach
 import urllib.parse as urlparser
+from uri_sanitizer import escape_uri
 
 class Entry:
+
+    __slots__ = ("id", "uri", "_html_safe_uri", "_encoded_uri", "_sha256",
+                 "created_on", "last_accessed", "expires_at")
     
     ID_CHAR_MAXLEN = 12
     SHA256_BYTE_LEN = 32
     DEFAULT_SCHEME = "https"
+    SANITIZER = "fast" # "fast" or "bleach", both produce the same output
 
-    def __init__(self, id, uri, created_on=None, last_accessed=None):
+    def __init__(self, id, uri, created_on=None, last_accessed=None, expires_at=None):
         Entry.is_valid_id(id)
         if not created_on is None:
             Entry.is_valid_datetime(created_on)
         if not last_accessed is None:
             Entry.is_valid_datetime(last_accessed)
+        if not expires_at is None:
+            Entry.is_valid_datetime(expires_at)
 
         self.id = id
         self.uri = None
         self.html_safe_uri = None
         self.encoded_uri = None
-        self.sha256 = None # SHA256 of self.uri
+        self.sha256 = None
         self.update_uri(uri)
         self.created_on = created_on
         self.last_accessed = last_accessed
+        self.expires_at = expires_at
+
+    @classmethod
+    def from_row(cls, id, uri, html_safe_uri, encoded_uri, sha256,
+                 created_on=None, last_accessed=None, expires_at=None):
+        """
+        Build an entry from a trusted row of our own table, no validation
+        is done. Derived URI forms and digest missing from the row are
+        computed from the stored URI on first access.
+        """
+        entry = cls.__new__(cls)
+        entry.id = id
+        entry.uri = uri
+        entry._html_safe_uri = html_safe_uri
+        entry._encoded_uri = encoded_uri
+        entry._sha256 = bytes(sha256) if isinstance(sha256, bytearray) else sha256
+        entry.created_on = created_on
+        entry.last_accessed = last_accessed
+        entry.expires_at = expires_at
+        return entry
+
+    def is_expired(self, now=None):
+        """Links without `expires_at` never expire."""
+        if self.expires_at is None:
+            return False
+        return self.expires_at <= (datetime.datetime.now() if now is None else now)
+
+    @property
+    def html_safe_uri(self):
+        if self._html_safe_uri is None and not self.uri is None:
+            self._html_safe_uri = Entry.sanitize_uri(self.uri)
+        return self._html_safe_uri
+
+    @html_safe_uri.setter
+    def html_safe_uri(self, value):
+        self._html_safe_uri = value
+
+    @property
+    def encoded_uri(self):
+        if self._encoded_uri is None and not self.uri is None:
+            self._encoded_uri = Entry.uri_to_str(Entry.encode_uri(Entry.parse_uri(self.uri)))
+        return self._encoded_uri
+
+    @encoded_uri.setter
+    def encoded_uri(self, value):
+        self._encoded_uri = value
+
+    @property
+    def sha256(self):
+        """SHA256 of self.uri"""
+        if self._sha256 is None and not self.uri is None:
+            self._sha256 = Entry.compute_digest(self.uri)
+        return self._sha256
+
+    @sha256.setter
+    def sha256(self, value):
+        self._sha256 = value
 
     def update_uri(self, uri):
         """Update URI and also recalculate checksum."""
@@ -35,11 +99,16 @@ class Entry:
         self.uri = Entry.uri_to_str(parsed_uri)
         self.html_safe_uri = Entry.sanitize_uri(self.uri)
         self.encoded_uri = Entry.uri_to_str(Entry.encode_uri(parsed_uri))
-        hash = hashes.Hash(hashes.SHA256())
-        hash.update(self.uri.encode())
-        self.sha256 = hash.finalize()
+        self.sha256 = Entry.compute_digest(self.uri)
         return self
 
+    @staticmethod
+    def compute_digest(uri_str):
+        """SHA256 of an already normalised URI string."""
+        hash = hashes.Hash(hashes.SHA256())
+        hash.update(uri_str.encode())
+        return hash.finalize()
+
     def set_digest(self, digest):
         """
         This is only intended to be used when retrieving data from database
@@ -121,6 +190,13 @@ class Entry:
         Entry.is_valid_parsed_uri(parsed_uri)
         return urlparser.urlunsplit(parsed_uri)
 
+    @staticmethod
+    def set_sanitizer(sanitizer):
+        """Select the HTML escaping of the whole process, once at startup."""
+        if not sanitizer in ["fast", "bleach"]:
+            raise ValueError(f"Unknown sanitizer \"{sanitizer}\".")
+        Entry.SANITIZER = sanitizer
+
     @staticmethod
     def sanitize_uri(uri_str):
         if not isinstance(uri_str, str):
@@ -132,7 +208,9 @@ class Entry:
         blacklist = [("<", "&lt;"), (">", "&gt;")]
         for target, replacement in blacklist:
             uri_str = uri_str.replace(target, replacement)
-        return bleach.clean(uri_str)
+        if Entry.SANITIZER == "bleach":
+            return bleach.clean(uri_str)
+        return escape_uri(uri_str)
 
     @staticmethod
     def encode_uri(parsed_uri):
@@ -160,5 +238,6 @@ class Entry:
         display += f"URI\t\t: {self.uri}\n"
         display += f"SHA256\t\t: {self.get_sha256()}\n"
         display += f"Created On\t: {self.created_on}\n"
-        display += f"Last Accessed\t: {self.last_accessed}"
+        display += f"Last Accessed\t: {self.last_accessed}\n"
+        display += f"Expires At\t: {self.expires_at}"
         return display
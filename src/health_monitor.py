@@ -0,0 +1,99 @@
+# This Source Code Form is subject to the terms of the Mozilla Public
+# License, v. 2.0. If a copy of the MPL was not distributed with this
+# file, You can obtain one at http://mozilla.org/MPL/2.0/.
+
+import threading
+
+class HealthMonitor:
+    """
+    Run `check` every `interval` seconds on a background thread and publish
+    a cached health status.
+
+    The status only changes to unhealthy after `failure_threshold`
+    consecutive failed checks, and back to healthy after
+    `recovery_threshold` consecutive successful checks. Listeners added with
+    `add_listener` are called with the new status on every change.
+    """
+
+    def __init__(self, check, interval=5, failure_threshold=3,
+                 recovery_threshold=2, healthy=True, name="Database"):
+        if not callable(check):
+            raise TypeError("check must be callable.")
+        elif not isinstance(interval, (int, float)):
+            raise TypeError("Health check interval must be a number.")
+        elif not isinstance(failure_threshold, int) or not isinstance(recovery_threshold, int):
+            raise TypeError("Health check thresholds must be an integer type.")
+        if interval <= 0:
+            raise ValueError("Health check interval must be greater than 0.")
+        elif failure_threshold < 1 or recovery_threshold < 1:
+            raise ValueError("Health check thresholds must be at least 1.")
+
+        self._check = check
+        self.interval = interval
+        self.failure_threshold = failure_threshold
+        self.recovery_threshold = recovery_threshold
+        self.healthy = healthy
+        self.name = name
+        self._consecutive = 0 # Consecutive results disagreeing with self.healthy
+        self._listeners = []
+        self._stopped = threading.Event()
+        self._thread = None
+
+    def add_listener(self, listener):
+        self._listeners.append(listener)
+        listener(self.healthy)
+
+    def start(self):
+        if self._thread is not None:
+            return
+        self._stopped.clear()
+        self._thread = threading.Thread(
+            target=self._run, name="health-monitor", daemon=True)
+        self._thread.start()
+
+    def stop(self):
+        self._stopped.set()
+        if self._thread is not None:
+            self._thread.join()
+            self._thread = None
+
+    def run_check(self):
+        """
+        Run a single check and update the published status.
+
+        Return
+        bool: Published health status after the check
+        """
+        try:
+            ok = bool(self._check())
+        except Exception as e:
+            print(f"WARNING: Health check failed. {e}")
+            ok = False
+
+        if ok == self.healthy:
+            self._consecutive = 0
+            return self.healthy
+
+        self._consecutive += 1
+        threshold = self.recovery_threshold if ok else self.failure_threshold
+        if self._consecutive >= threshold:
+            self._consecutive = 0
+            self.healthy = ok
+            if not ok:
+                print(f"WARNING: {self.name} marked as down.")
+            for listener in self._listeners:
+                listener(self.healthy)
+        return self.healthy
+
+    def report_failure(self):
+        """Mark unhealthy right away, e.g. after a failed query."""
+        self._consecutive = 0
+        if self.healthy:
+            self.healthy = False
+            print(f"WARNING: {self.name} marked as down.")
+            for listener in self._listeners:
+                listener(self.healthy)
+
+    def _run(self):
+        while not self._stopped.wait(self.interval):
+            self.run_check()
@@ -0,0 +1,238 @@
+# This Source Code Form is subject to the terms of the Mozilla Public
+# License, v. 2.0. If a copy of the MPL was not distributed with this
+# file, You can obtain one at http://mozilla.org/MPL/2.0/.
+
+import datetime
+import hashlib
+import math
+import threading
+import time
+
+class BloomFilter:
+    """
+    Bloom filter over strings, sized for `capacity` items at a false
+    positive rate of `error_rate`. Never gives false negatives.
+    """
+
+    def __init__(self, capacity, error_rate=0.001):
+        if not isinstance(capacity, int):
+            raise TypeError("Capacity must be an integer type.")
+        elif not isinstance(error_rate, float):
+            raise TypeError("Error rate must be a float type.")
+        if capacity < 1:
+            raise ValueError("Capacity must be greater than 0.")
+        elif error_rate <= 0 or error_rate >= 1:
+            raise ValueError("Error rate must be between 0 and 1 exclusive.")
+
+        self.capacity = capacity
+        self.error_rate = error_rate
+        self.bit_count = max(8, math.ceil(-capacity * math.log(error_rate) / math.log(2) ** 2))
+        self.hash_count = max(1, round(self.bit_count / capacity * math.log(2)))
+        self.count = 0 # Distinct items added, approximate
+        self._bits = bytearray((self.bit_count + 7) // 8)
+        self._lock = threading.Lock()
+
+    def _positions(self, item):
+        # Double hashing, k positions from two 64 bit halves of one digest
+        digest = hashlib.blake2b(item.encode(), digest_size=16).digest()
+        h1 = int.from_bytes(digest[:8], "little")
+        h2 = int.from_bytes(digest[8:], "little") | 1
+        return [(h1 + i * h2) % self.bit_count for i in range(self.hash_count)]
+
+    def add(self, item):
+        """
+        Return
+        bool: False if the item already tested positive
+        """
+        positions = self._positions(item)
+        # Setting a bit is a read-modify-write of a whole byte
+        with self._lock:
+            added = False
+            for position in positions:
+                mask = 1 << (position & 7)
+                if not self._bits[position >> 3] & mask:
+                    self._bits[position >> 3] |= mask
+                    added = True
+            if added:
+                self.count += 1
+        return added
+
+    def __contains__(self, item):
+        bits = self._bits
+        for position in self._positions(item):
+            if not bits[position >> 3] & (1 << (position & 7)):
+                return False
+        return True
+
+    def size_bytes(self):
+        return len(self._bits)
+
+class IdFilter:
+    """
+    Bloom filter over every id in the database, used to answer "this id
+    does not exist" without a query.
+
+    `load_ids(since)` must return an iterable of `(id, created_on)` rows,
+    every row when `since` is None, otherwise rows created on or after
+    `since`. A background thread builds the filter from every row on
+    start, then reloads rows created since the last seen `created_on`
+    every `refresh_interval` seconds to pick up ids inserted by other
+    server processes. Rows from the last `SYNC_OVERLAP` seconds are read
+    again so rows committed late are not missed, after a build the
+    overlap also covers the duration of the build. Once more ids than
+    `capacity` are stored the filter is rebuilt with twice the capacity.
+
+    Until the first build completes, and when `capacity` is 0, every id
+    might exist and callers fall back to the database.
+    """
+
+    SYNC_OVERLAP = datetime.timedelta(seconds=60)
+
+    def __init__(self, load_ids, capacity=1000000, error_rate=0.001,
+                 refresh_interval=5, clock=time.monotonic):
+        if not callable(load_ids):
+            raise TypeError("load_ids must be callable.")
+        elif not isinstance(capacity, int):
+            raise TypeError("Capacity must be an integer type.")
+        elif not isinstance(refresh_interval, (int, float)):
+            raise TypeError("Refresh interval must be an integer or float type.")
+        if capacity < 0:
+            raise ValueError("Capacity cannot be negative.")
+        elif refresh_interval <= 0:
+            raise ValueError("Refresh interval must be greater than 0.")
+        if capacity > 0:
+            BloomFilter(1, error_rate) # Validate error rate up front
+
+        self._load_ids = load_ids
+        self.capacity = capacity
+        self.error_rate = error_rate
+        self.refresh_interval = refresh_interval
+        self._clock = clock
+        self._filter = None # Replaced as a whole on (re)build
+        self._synced_until = None # Latest created_on seen
+        self._lock = threading.Lock()
+        self._stopped = threading.Event()
+        self._thread = None
+        self.negatives = 0 # Lookups answered without a query
+        self.builds = 0
+        self.refreshes = 0
+        self.refresh_errors = 0
+        self.last_build_duration = 0.0
+
+    def start(self):
+        if self.capacity == 0 or self._thread is not None:
+            return
+        self._stopped.clear()
+        self._thread = threading.Thread(
+            target=self._run, name="id-filter-refresh", daemon=True)
+        self._thread.start()
+
+    def stop(self):
+        self._stopped.set()
+        if self._thread is not None:
+            self._thread.join()
+            self._thread = None
+
+    def ready(self):
+        return self._filter is not None
+
+    def might_contain(self, id):
+        """
+        Return
+        False: Id is definitely not stored
+        True: Id may be stored, or the filter is not built yet
+        """
+        bloom = self._filter
+        if bloom is None or id in bloom:
+            return True
+        self.negatives += 1
+        return False
+
+    def add(self, id):
+        """Add a newly inserted id, no-op until the filter is built."""
+        bloom = self._filter
+        if not bloom is None:
+            bloom.add(id)
+
+    def build(self):
+        """
+        Build a new filter from every stored id and swap it in.
+
+        Return
+        int: Number of ids loaded
+        """
+        start = self._clock()
+        # Big enough for the last known count to double before the next rebuild
+        capacity = self.capacity
+        bloom = self._filter
+        if not bloom is None:
+            capacity = max(capacity, bloom.count * 2)
+        bloom = BloomFilter(capacity, self.error_rate)
+        synced_until = None
+        for id, created_on in self._load_ids(None):
+            bloom.add(id)
+            if synced_until is None or created_on > synced_until:
+                synced_until = created_on
+        duration = self._clock() - start
+        with self._lock:
+            self._filter = bloom
+            self._synced_until = synced_until
+            self.builds += 1
+            self.last_build_duration = duration
+        # Rows committed behind the scan while it was running
+        self.refresh(datetime.timedelta(seconds=duration))
+        return bloom.count
+
+    def refresh(self, extra_overlap=datetime.timedelta()):
+        """
+        Add ids created since the last build or refresh.
+
+        Return
+        int: Number of ids loaded
+        """
+        with self._lock:
+            bloom = self._filter
+            since = self._synced_until
+        if bloom is None:
+            return 0
+        if not since is None:
+            since -= IdFilter.SYNC_OVERLAP + extra_overlap
+        loaded = 0
+        synced_until = self._synced_until
+        for id, created_on in self._load_ids(since):
+            bloom.add(id)
+            loaded += 1
+            if synced_until is None or created_on > synced_until:
+                synced_until = created_on
+        with self._lock:
+            if self._filter is bloom:
+                self._synced_until = synced_until
+            self.refreshes += 1
+        return loaded
+
+    def _run(self):
+        while not self._stopped.is_set():
+            try:
+                bloom = self._filter
+                if bloom is None or bloom.count > bloom.capacity:
+                    self.build()
+                else:
+                    self.refresh()
+            except Exception as e:
+                print(f"WARNING: Failed to refresh id filter. {e}")
+                self.refresh_errors += 1
+            self._stopped.wait(self.refresh_interval)
+
+    def stats(self):
+        bloom = self._filter
+        return {
+            "ready": not bloom is None,
+            "count": bloom.count if not bloom is None else 0,
+            "capacity": bloom.capacity if not bloom is None else self.capacity,
+            "size_bytes": bloom.size_bytes() if not bloom is None else 0,
+            "negatives": self.negatives,
+            "builds": self.builds,
+            "refreshes": self.refreshes,
+            "refresh_errors": self.refresh_errors,
+            "last_build_duration": self.last_build_duration,
+        }
@@ -0,0 +1,162 @@
+# This Source Code Form is subject to the terms of the Mozilla Public
+# License, v. 2.0. If a copy of the MPL was not distributed with this
+# file, You can obtain one at http://mozilla.org/MPL/2.0/.
+
+from collections import deque
+import threading
+import time
+
+class IdPool:
+    """
+    Pool of pre-generated ids that are known to be free.
+
+    A background thread tops the pool up to `size` ids whenever it drops
+    below `low_watermark`. Candidates are produced by `generate()` in
+    batches of at most `batch_size` and `find_taken(candidates)` must
+    return the subset that is already in use, checked with a single query.
+    A `size` of 0 disables the pool, `pop` then always returns None.
+    """
+
+    def __init__(self, generate, find_taken, size=1000, low_watermark=250,
+                 batch_size=500, clock=time.monotonic):
+        if not callable(generate) or not callable(find_taken):
+            raise TypeError("generate and find_taken must be callable.")
+        elif not isinstance(size, int) or not isinstance(low_watermark, int) \
+                or not isinstance(batch_size, int):
+            raise TypeError("Id pool sizes must be an integer type.")
+        if size < 0:
+            raise ValueError("Id pool size cannot be negative.")
+        elif low_watermark < 0 or low_watermark > size:
+            raise ValueError("Id pool low watermark must be between 0 and the pool size.")
+        elif batch_size < 1:
+            raise ValueError("Id pool batch size must be greater than 0.")
+
+        self._generate = generate
+        self._find_taken = find_taken
+        self.size = size
+        self.low_watermark = low_watermark
+        self.batch_size = batch_size
+        self._clock = clock
+        self._ids = deque()
+        self._members = set()
+        self._lock = threading.Lock()
+        self._wake = threading.Event()
+        self._stopped = threading.Event()
+        self._thread = None
+        self.pops = 0
+        self.empty_pops = 0
+        self.refills = 0
+        self.refill_errors = 0
+        self.rejected = 0 # Candidates found to be taken
+        self.last_refill_latency = 0.0
+        self.total_refill_latency = 0.0
+
+    def start(self):
+        if self.size == 0 or self._thread is not None:
+            return
+        self._stopped.clear()
+        self._thread = threading.Thread(
+            target=self._run, name="id-pool-refill", daemon=True)
+        self._thread.start()
+
+    def stop(self):
+        self._stopped.set()
+        self._wake.set()
+        if self._thread is not None:
+            self._thread.join()
+            self._thread = None
+
+    def pop(self):
+        """
+        Return:
+        None: Pool is empty
+        str: Free id
+        """
+        ids = self.pop_many(1)
+        return ids[0] if len(ids) > 0 else None
+
+    def pop_many(self, count):
+        """Return up to `count` free ids, fewer if the pool runs dry."""
+        with self._lock:
+            ids = []
+            while len(ids) < count and len(self._ids) > 0:
+                id = self._ids.popleft()
+                self._members.discard(id)
+                ids.append(id)
+            self.pops += len(ids)
+            if len(ids) < count:
+                self.empty_pops += 1
+            depth = len(self._ids)
+        if depth < self.low_watermark:
+            self._wake.set()
+        return ids
+
+    def refill(self):
+        """
+        Run a single refill round.
+
+        Return
+        int: Number of ids added to the pool
+        """
+        with self._lock:
+            wanted = min(self.size - len(self._ids), self.batch_size)
+            exclude = set(self._members)
+        if wanted <= 0:
+            return 0
+
+        start = self._clock()
+        candidates = set()
+        while len(candidates) < wanted:
+            candidate = self._generate()
+            if not candidate in exclude:
+                candidates.add(candidate)
+        taken = self._find_taken(candidates)
+        latency = self._clock() - start
+
+        added = 0
+        with self._lock:
+            for candidate in candidates:
+                if candidate in taken or candidate in self._members:
+                    continue
+                self._ids.append(candidate)
+                self._members.add(candidate)
+                added += 1
+            self.rejected += len(candidates) - added
+            self.refills += 1
+            self.last_refill_latency = latency
+            self.total_refill_latency += latency
+        return added
+
+    def _run(self):
+        while not self._stopped.is_set():
+            try:
+                while not self._stopped.is_set() and self.depth() < self.size:
+                    if self.refill() == 0:
+                        # Every candidate was taken, wait for the next pop
+                        break
+            except Exception as e:
+                print(f"WARNING: Failed to refill id pool. {e}")
+                self.refill_errors += 1
+                # Back off before retrying instead of spinning
+                self._stopped.wait(1)
+                continue
+            self._wake.wait()
+            self._wake.clear()
+
+    def depth(self):
+        with self._lock:
+            return len(self._ids)
+
+    def stats(self):
+        with self._lock:
+            return {
+                "depth": len(self._ids),
+                "size": self.size,
+                "pops": self.pops,
+                "empty_pops": self.empty_pops,
+                "refills": self.refills,
+                "refill_errors": self.refill_errors,
+                "rejected": self.rejected,
+                "last_refill_latency": self.last_refill_latency,
+                "avg_refill_latency": self.total_refill_latency / self.refills if self.refills > 0 else 0.0,
+            }
@@ -2,18 +2,33 @@
 # License, v. 2.0. If a copy of the MPL was not distributed with this
 # file, You can obtain one at http://mozilla.org/MPL/2.0/.
 
+import atexit
+import datetime
+import math
 import secrets
 import string
-from mariadb_client import DBClient
+from mariadb_client import DBClient, DuplicateDigestError
 import mariadb
 from config_parser import ConfigParser as Config
 from entry import Entry
+from cache import LRUCache
+from connection_pool import PoolTimeoutError
+from access_writer import AccessDateWriter
+from click_counter import ClickCounter
+from health_monitor import HealthMonitor
+from id_pool import IdPool
+from id_filter import IdFilter
+from metrics import ID_ATTEMPTS
+from purger import Purger
+from sequence_id import SequenceIdGenerator
+from sharded_client import ShardedDBClient
+from embedded_backend import EmbeddedBackend
 
 class Logic:
     
     CONFUSING_CHARS = ['1', 'l', 'L', 'I', 'i', '0', 'O', 'o']
 
-    def __init__(self):
+    def __init__(self, db=None):
         self.init_ok = False
         self.maintenance_mode = False
         Config() # Initialise and parse configuration
@@ -27,21 +42,139 @@ class Logic:
 
         self.reserved_path = config["preference"]["reserved_path"]
 
-        # Connect to DB
-        user = config["database"]["user"]
-        password = config["database"]["password"]
-        host = config["database"]["host"]
-        port = config["database"]["port"]
-        
-        # mariadb.OperationalError raised if connection fail
-        self.db = DBClient(user, password, host, port)
+        # Read-through cache for id lookups
+        self.cache = LRUCache(
+            config["preference"].get("cache_size", 4096),
+            config["preference"].get("cache_ttl", 300))
+
+        # Connect to DB, unless a backend (e.g. `MemoryDBClient`) is given
+        self.db = db
+        if self.db is None:
+            storage = config.get("storage", {})
+            backend = storage.get("backend", "mariadb")
+            if backend == "mariadb":
+                # mariadb.OperationalError raised if connection fail
+                self.db = Logic.connect_db(config)
+            elif backend == "embedded":
+                # Serves from the local replica even if the primary is unreachable
+                self.db = EmbeddedBackend(
+                    storage["embedded_path"],
+                    lambda: Logic.connect_db(config),
+                    storage.get("sync_interval", 5),
+                    storage.get("snapshot_interval", 3600),
+                    storage.get("mmap_size", 256 * 2 ** 20))
+                self.db.start()
+            else:
+                raise ValueError(f"Unknown storage backend \"{backend}\".")
+        self.read_only = self.db.read_only
+
+        # Buffered last_accessed updates, drained on interpreter exit
+        self.access_writer = AccessDateWriter(
+            self.db,
+            config["preference"].get("access_flush_interval", 5),
+            config["preference"].get("access_flush_size", 1000))
+        # Click counts per day, added to the rollup table in bulk
+        self.click_counter = ClickCounter(
+            self.db,
+            config["preference"].get("click_flush_interval", 5),
+            config["preference"].get("click_flush_size", 10000))
+        atexit.register(self.close)
+
+        # Deletes expired entries and archives cold ones, off by default
+        self.purger = None
+        if not self.read_only:
+            self.purger = Purger.from_config(self.db, config.get("expiry", {}))
+        if not self.purger is None:
+            self.purger.start()
         
         if config["preference"]["maintenance_mode"]:
             self.maintenance_mode = True
         self.init_ok = True
 
-    def gen_new_id(self, long_uri):
+        # Background database health check, read by the request path
+        self.health_monitor = HealthMonitor(
+            self.is_db_up,
+            config["preference"].get("health_check_interval", 5),
+            config["preference"].get("health_failure_threshold", 3),
+            config["preference"].get("health_recovery_threshold", 2),
+            healthy=self.init_ok)
+        self.health_monitor.start()
+
+        # Every stored id, lets lookups of unknown ids skip the query.
+        # Read-only backends are local replicas, lookups are already cheap.
+        self.id_filter = IdFilter(
+            self.db.load_ids,
+            0 if self.read_only else config["preference"].get("id_filter_capacity", 1000000),
+            config["preference"].get("id_filter_error_rate", 0.001),
+            config["preference"].get("id_filter_refresh_interval", 5))
+        self.id_filter.start()
+
+        # Ids pre-checked in bulk by a background thread
+        self.id_pool = IdPool(
+            lambda: Logic.no_check_gen_id(self.charset, self.id_chars),
+            self.find_taken_ids,
+            config["preference"].get("id_pool_size", 1000),
+            config["preference"].get("id_pool_low_watermark", 250),
+            config["preference"].get("id_pool_batch_size", 500))
+
+        # "random" ids are checked for collision, "sequence" ids cannot collide
+        self.id_strategy = config["preference"].get("id_strategy", "random")
+        self.sequence_ids = None
+        if self.read_only:
+            pass # Read-only backends never generate ids
+        elif self.id_strategy == "sequence":
+            self.sequence_ids = SequenceIdGenerator(
+                self.db.allocate_id_block,
+                self.charset,
+                self.id_chars,
+                config["preference"]["id_secret"].encode(),
+                config["preference"].get("id_block_size", 1000))
+        elif self.id_strategy == "random":
+            self.id_pool.start()
+        else:
+            raise ValueError(f"Unknown id_strategy \"{self.id_strategy}\".")
+
+    @staticmethod
+    def connect_db(config):
+        """
+        Return DBClient connected to the database in config, or
+        ShardedDBClient if `shards` or `new_shards` are configured.
+        """
+        database = config["database"]
+        check_interval = config["preference"].get("health_check_interval", 5)
+        archive = config.get("expiry", {}).get("archive_after_days", 0) > 0
+        shards = database.get("shards", [])
+        new_shards = database.get("new_shards", [])
+        if len(shards) + len(new_shards) == 0:
+            return Logic.connect_shard(database, database, check_interval, archive=archive)
+        # The database above is the first shard
+        return ShardedDBClient(
+            [Logic.connect_shard(database, shard, check_interval, True, archive) for shard in [database] + shards],
+            [Logic.connect_shard(database, shard, check_interval, True, archive) for shard in new_shards])
+
+    @staticmethod
+    def connect_shard(database, shard, check_interval=5, digest_index=False, archive=False):
+        """`shard` overrides the host, credentials and replicas of `database`."""
+        return DBClient(
+            shard.get("user", database["user"]),
+            shard.get("password", database["password"]),
+            shard["host"],
+            shard.get("port", 3306),
+            pool_min_size=database.get("pool_min_size", 1),
+            pool_max_size=database.get("pool_max_size", 10),
+            pool_timeout=database.get("pool_timeout", 5),
+            pool_validation_interval=database.get("pool_validation_interval", 30),
+            replicas=shard.get("replicas", []),
+            replica_check_interval=check_interval,
+            digest_index=digest_index,
+            statement_cache_size=database.get("statement_cache_size", 64),
+            archive=archive)
+
+    def gen_new_id(self, long_uri, expires_at=None):
         """
+        Shorten a URI, links that expire at `expires_at` always get a new
+        id, other links are deduplicated.
+
         Returns:
         None: Some error has occurred (Pool of available id running low etc..)
         Entry: Entry instance containing the id
@@ -49,37 +182,241 @@ class Logic:
         if not isinstance(long_uri, str):
             raise TypeError(f"\"{long_uri}\" not a string.")
         
-        new_entry = Entry("", long_uri, None, None)
-        
-        # Check for existing entry
-        existing_entry = self.db.get_entry_from_digest(new_entry.sha256)
-        if len(existing_entry) > 0:
-            return existing_entry[0]
-        
+        new_entry = Entry("", long_uri, None, None, expires_at)
+        if not expires_at is None:
+            return self.insert_entry(new_entry)
+        return self.insert_or_get_entry(new_entry)
+
+    def insert_or_get_entry(self, new_entry):
+        """
+        Insert entry, or return the stored entry with the same URI.
+        A new URI costs a single INSERT, the unique digest key makes
+        deduplication race free.
+
+        Returns:
+        None: Id could not be generated
+        Entry: New or existing entry
+        """
+        for _ in range(2):
+            try:
+                return self.insert_entry(new_entry)
+            except DuplicateDigestError:
+                existing_entry = self.db.get_entry_from_digest(new_entry.sha256)
+                if len(existing_entry) > 0:
+                    # May have been inserted by another process since the last refresh
+                    self.id_filter.add(existing_entry[0].id)
+                    return existing_entry[0]
+            # Existing entry was removed in the mean time, try inserting again
+        return None
+
+    def next_id(self):
+        """
+        Next id to try for a new entry.
+
+        Returns:
+        None: Max attempt reached
+        str: Id not known to be taken
+
+        Raises:
+        IdSpaceExhausted: No sequence id left
+        """
+        if not self.sequence_ids is None:
+            new_id = self.sequence_ids.next_id()
+            while new_id in self.reserved_path:
+                new_id = self.sequence_ids.next_id()
+            return new_id
+
+        new_id = self.id_pool.pop()
+        if new_id is None:
+            new_id = self.gen_checked_id()
+        return new_id
+
+    def insert_entry(self, new_entry):
+        """
+        Insert entry with a new id, retrying with the next id if the id
+        turns out to be taken. Pooled ids can be taken by another worker
+        after they were checked, and sequence ids can clash with existing
+        randomly generated ids.
+
+        Returns:
+        None: Id could not be generated
+        Entry: Inserted entry
+
+        Raises:
+        DuplicateDigestError: URI is already stored
+        """
+        for attempt in range(1, 51): # Max attempt
+            new_id = self.next_id()
+            if new_id is None:
+                new_entry.id = ""
+                return None
+            new_entry.id = new_id
+            try:
+                self.db.create_new_entry(new_entry)
+            except mariadb.IntegrityError:
+                continue
+            self.id_filter.add(new_id)
+            ID_ATTEMPTS.observe(attempt, stage="insert")
+            return new_entry
+        print("WARNING: Cannot insert entry, max attempt reached.")
+        ID_ATTEMPTS.observe(math.inf, stage="insert")
+        new_entry.id = ""
+        return None
+
+    def gen_checked_id(self):
+        """
+        Generate an id and check it is free, one query per attempt.
+
+        Returns:
+        None: Max attempt reached
+        str: Free id
+        """
         new_id = Logic.no_check_gen_id(self.charset, self.id_chars)
 
         # Check generated id does not exist
-        existing_entry = self.db.get_entry_from_id(new_id)
+        existing_entry = self.get_stored_entry(new_id)
         # Generate new entry until a new one was found, max 50 attempt
         i = 0
         while (len(existing_entry)) > 0 or (new_id in self.reserved_path):
             if i == 50: # Max attempt
                 print("WARNING: Cannot generate ID, max attempt reached.")
+                ID_ATTEMPTS.observe(math.inf, stage="check")
                 return None
             new_id = Logic.no_check_gen_id(self.charset, self.id_chars)
-            existing_entry = self.db.get_entry_from_id(new_id)
+            existing_entry = self.get_stored_entry(new_id)
             i += 1
+        ID_ATTEMPTS.observe(i + 1, stage="check")
+        return new_id
+
+    def get_stored_entry(self, id):
+        """Like `DBClient.get_entry_from_id`, without a query for ids the id filter rules out."""
+        if not self.id_filter.might_contain(id):
+            return []
+        return self.db.get_entry_from_id(id)
+
+    def find_taken_ids(self, candidates):
+        """Return the subset of candidates that are reserved or already in use."""
+        taken = {id for id in candidates if id in self.reserved_path}
+        candidates = [id for id in candidates if self.id_filter.might_contain(id)]
+        for entry in self.db.get_entries_from_ids(candidates):
+            taken.add(entry.id)
+        return taken
 
-        new_entry.id = new_id
-        self.db.create_new_entry(new_entry)
-        return new_entry
+    def gen_new_ids(self, long_uris):
+        """
+        Shorten many URIs with one digest lookup, one id collision check per
+        round of generated ids and a single bulk insert. If the bulk insert
+        hits a unique key, entries are inserted one by one instead.
+
+        Returns:
+        list: One item per input, in order, where each item is either
+              Entry: Entry instance containing the id
+              None: Id could not be generated
+              ValueError / TypeError: The URI is invalid
+
+        Raises:
+        IdSpaceExhausted: No sequence id left
+        """
+        results = []
+        pending = {} # digest -> Entry without id
+        for long_uri in long_uris:
+            try:
+                if not isinstance(long_uri, str):
+                    raise TypeError(f"\"{long_uri}\" not a string.")
+                entry = Entry("", long_uri.strip(), None, None)
+            except (TypeError, ValueError) as e:
+                results.append(e)
+                continue
+            # Same URI more than once in a batch resolves to a single entry
+            entry = pending.setdefault(entry.sha256, entry)
+            results.append(entry)
+
+        # Check for existing entries
+        existing = {}
+        for entry in self.db.get_entries_from_digests(list(pending.keys())):
+            existing.setdefault(entry.sha256, entry)
+            self.id_filter.add(entry.id)
+        new_entries = [entry for digest, entry in pending.items() if not digest in existing]
+
+        if self.sequence_ids is None:
+            self.assign_checked_ids(new_entries)
+        else:
+            for entry in new_entries:
+                entry.id = self.next_id()
+
+        new_entries = [entry for entry in new_entries if entry.id != ""]
+        clashing = []
+        with self.db.transaction() as tx:
+            try:
+                tx.create_new_entries(new_entries)
+            except (DuplicateDigestError, mariadb.IntegrityError):
+                # Some id or URI got taken, nothing was inserted, insert one
+                # by one instead and commit the others together
+                for entry in new_entries:
+                    try:
+                        tx.create_new_entry(entry)
+                    except (DuplicateDigestError, mariadb.IntegrityError):
+                        clashing.append(entry)
+        for entry in new_entries:
+            if not entry in clashing:
+                self.id_filter.add(entry.id)
+        # Retried outside of the transaction, with new ids or by digest
+        for entry in clashing:
+            stored = self.insert_or_get_entry(entry)
+            if stored is None:
+                entry.id = ""
+            elif not stored is entry:
+                existing[entry.sha256] = stored
+
+        for i, result in enumerate(results):
+            if isinstance(result, Entry):
+                if result.sha256 in existing:
+                    results[i] = existing[result.sha256]
+                elif result.id == "":
+                    results[i] = None
+        return results
+
+    def assign_checked_ids(self, entries):
+        """
+        Assign random ids to entries, one collision check per round of
+        generated ids, max 50 rounds. Entries that could not be assigned an
+        id keep an empty id.
+        """
+        # Use pre-checked ids first
+        unassigned = []
+        pooled_ids = self.id_pool.pop_many(len(entries))
+        for i, entry in enumerate(entries):
+            if i < len(pooled_ids):
+                entry.id = pooled_ids[i]
+            else:
+                unassigned.append(entry)
+
+        taken = set(self.reserved_path)
+        i = 0
+        while len(unassigned) > 0 and i <= 50:
+            candidates = {}
+            for entry in unassigned:
+                new_id = Logic.no_check_gen_id(self.charset, self.id_chars)
+                while new_id in taken or new_id in candidates:
+                    new_id = Logic.no_check_gen_id(self.charset, self.id_chars)
+                candidates[new_id] = entry
+            taken.update(self.find_taken_ids(candidates.keys()))
+            unassigned = []
+            for new_id, entry in candidates.items():
+                if new_id in taken:
+                    unassigned.append(entry)
+                else:
+                    entry.id = new_id
+            i += 1
+        if len(unassigned) > 0:
+            print("WARNING: Cannot generate ID, max attempt reached.")
 
     def is_db_up(self):
         if self.db is None:
             return False
         try:
             self.db.ping()
-        except mariadb.InterfaceError as e:
+        except (mariadb.Error, PoolTimeoutError) as e:
             print(f"WARNING: {e}")
             return False
         return True
@@ -89,8 +426,98 @@ class Logic:
         return "".join(secrets.choice(charset) for _ in range(id_len))
 
     def get_uri(self, id):
-        result = self.db.get_entry_from_id(id)
-        if len(result) < 1:
+        entry = self.cache.get(id)
+        if entry is None:
+            result = self.get_stored_entry(id)
+            if len(result) < 1:
+                return None
+            entry = result[0]
+            self.cache.put(id, entry)
+        if not entry.is_expired():
+            self.access_writer.record(id)
+            self.click_counter.record(id)
+        return entry
+
+    def get_uris(self, ids):
+        """
+        Resolve many ids, ids not in cache are looked up with a single query.
+
+        Returns:
+        dict: id -> Entry, or None if the id does not exist
+        """
+        results = {}
+        missing = []
+        for id in ids:
+            if id in results:
+                continue
+            results[id] = self.cache.get(id)
+            if results[id] is None and self.id_filter.might_contain(id):
+                missing.append(id)
+
+        for entry in self.db.get_entries_from_ids(missing):
+            results[entry.id] = entry
+            self.cache.put(entry.id, entry)
+
+        for id, entry in results.items():
+            if not entry is None and not entry.is_expired():
+                self.access_writer.record(id)
+                self.click_counter.record(id)
+        return results
+
+    def get_clicks(self, id, days=30):
+        """
+        Clicks of an id as stored in the rollup table, up to the last
+        flush of the click counters.
+
+        Returns:
+        None: id does not exist
+        tuple: (total clicks, list of (date, clicks) of the last `days` days, oldest first)
+        """
+        if not isinstance(days, int):
+            raise TypeError("Days must be an integer type.")
+        if days < 1:
+            raise ValueError("Days must be greater than 0.")
+        if self.cache.get(id) is None and len(self.get_stored_entry(id)) == 0:
             return None
-        self.db.update_access_date(id)
-        return result[0]
+
+        today = datetime.date.today()
+        since = today - datetime.timedelta(days=days - 1)
+        total, stored = self.db.get_clicks(id, since)
+        stored = dict(stored)
+        daily = [since + datetime.timedelta(days=i) for i in range(days)]
+        return total, [(day, stored.get(day, 0)) for day in daily]
+
+    def stats(self):
+        """
+        Return
+        dict: Counters of the in-process cache, id pool, id filter and connection pool
+        """
+        stats = {
+            "cache": self.cache.stats(),
+            "id_pool": self.id_pool.stats(),
+            "id_filter": self.id_filter.stats(),
+            "connection_pool": self.db.stats(),
+            "access_writer": {
+                "pending": self.access_writer.pending(),
+                "flushed": self.access_writer.flushed,
+                "flush_errors": self.access_writer.flush_errors,
+            },
+            "click_counter": {
+                "pending": self.click_counter.pending(),
+                "flushed": self.click_counter.flushed,
+                "flush_errors": self.click_counter.flush_errors,
+            },
+        }
+        if not self.purger is None:
+            stats["purger"] = self.purger.stats()
+        return stats
+
+    def close(self):
+        if not self.purger is None:
+            self.purger.stop()
+        self.id_pool.stop()
+        self.id_filter.stop()
+        self.health_monitor.stop()
+        self.access_writer.close()
+        self.click_counter.close()
+        self.db.close_connection()
@@ -6,6 +6,9 @@
 
 import app_info
 import api_server
+from config_parser import ConfigParser as Config
+from entry import Entry
+from tracing import SamplingPolicy
 import os
 import sentry_sdk
 
@@ -24,23 +27,47 @@ import sys
 #     return main()
 
 
-def main():
+def init_sentry():
     if "SENTRY_DSN" in os.environ:
+        Config() # Initialise and parse configuration
+        config = Config.get_config()
+        policy = SamplingPolicy.from_config(config)
         sentry_sdk.init(
             dsn=os.getenv("SENTRY_DSN").strip(),
             send_default_pii=False,
-            traces_sample_rate=1.0,
-            profile_session_sample_rate=1.0,
+            traces_sampler=policy.traces_sampler,
+            before_send_transaction=policy.before_send_transaction,
+            # Profiles only run within sampled traces
+            profile_session_sample_rate=config.get("tracing", {}).get("profile_session_sample_rate", 0.0),
             profile_lifecycle="trace",
         )
         print("Sentry SDK initialised")
 
+
+def init_sanitizer():
+    Config() # Initialise and parse configuration
+    Entry.set_sanitizer(Config.get_config()["preference"].get("sanitizer", "fast"))
+
+
+def main():
+    init_sentry()
+    init_sanitizer()
     print(f"Starting API server v{app_info.VERSION}...")
 
-    application = api_server.app
+    application = api_server.create_app()
     return application
 
 
+def main_asgi():
+    """ASGI entry point, `uvicorn --factory main:main_asgi`."""
+    import asgi_server
+    init_sentry()
+    init_sanitizer()
+    print(f"Starting API server v{app_info.VERSION} (ASGI)...")
+
+    return asgi_server.create_asgi_app()
+
+
 if "__main__" == __name__:
     from cheroot.wsgi import Server as CherryPyServer
     host = '127.0.0.1'
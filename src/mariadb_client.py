@@ -2,15 +2,390 @@
 # License, v. 2.0. If a copy of the MPL was not distributed with this
 # file, You can obtain one at http://mozilla.org/MPL/2.0/.
 
+from collections import OrderedDict
+from contextlib import contextmanager
+import datetime
+import itertools
 import mariadb
+import re
+import threading
+from connection_pool import ConnectionPool, PoolTimeoutError
 from entry import Entry
+from health_monitor import HealthMonitor
+from metrics import instrument_query
+from storage_backend import StorageBackend
 
 HIGHEST_PORT = pow(2, 16) - 1
 DATABASE_NAME = "uri_shortener"
+ER_DUP_ENTRY = 1062
+ENTRY_COLUMNS = "id, original_uri, html_safe_uri, encoded_uri, sha256, created_on, last_accessed, expires_at"
+INSERT_ENTRY = "INSERT INTO uri (id, original_uri, html_safe_uri, encoded_uri, sha256, expires_at) \
+    VALUES (?, ?, ?, ?, ?, ?)"
+# Same shape as ENTRY_COLUMNS, derived URI forms are computed again on read
+ARCHIVE_COLUMNS = "id, original_uri, NULL, NULL, sha256, created_on, last_accessed, NULL"
 
-class DBClient:
-    
-    def __init__(self, user, password, host="::1", port=3306):
+class DuplicateDigestError(Exception):
+    """Raised when inserting an entry whose digest is already stored."""
+
+class Replica:
+    """Read replica of the primary, with its own pool and health monitor."""
+
+    def __init__(self, name, pool, check_interval=5, failure_threshold=3, recovery_threshold=2):
+        self.name = name
+        self.pool = pool
+        self.monitor = HealthMonitor(
+            self.ping, check_interval, failure_threshold, recovery_threshold,
+            name=f"Replica {name}")
+        self.reads = 0
+        self.errors = 0
+
+    def ping(self):
+        with self.pool.connection() as connection:
+            return connection.ping()
+
+    def stats(self):
+        return {
+            "healthy": self.monitor.healthy,
+            "reads": self.reads,
+            "errors": self.errors,
+        }
+
+class PreparedConnection:
+    """
+    Connection keeping one prepared cursor per statement, so that the
+    server parses a statement once per connection and later executions
+    only send the parameters. Beyond `max_statements` the least recently
+    used statement is closed, 0 disables the cache and runs every
+    statement on a new text protocol cursor.
+
+    Other attributes are those of the wrapped connection.
+    """
+
+    def __init__(self, connection, max_statements=64, on_execute=None):
+        if not isinstance(max_statements, int):
+            raise TypeError("Statement cache size must be an integer type.")
+        elif max_statements < 0:
+            raise ValueError("Statement cache size cannot be negative.")
+        self.connection = connection
+        self.max_statements = max_statements
+        self._cursors = OrderedDict() # statement -> prepared cursor
+        self._on_execute = on_execute # Called with True if the statement was already prepared
+
+    def __getattr__(self, name):
+        return getattr(self.connection, name)
+
+    def query(self, cmd, params=()):
+        """Execute a statement and return its rows."""
+        return self._run(cmd, lambda cursor: cursor.execute(cmd, params), True)
+
+    def execute(self, cmd, params=()):
+        """Execute a statement and return the number of affected rows."""
+        return self._run(cmd, lambda cursor: cursor.execute(cmd, params), False)
+
+    def executemany(self, cmd, params):
+        return self._run(cmd, lambda cursor: cursor.executemany(cmd, params), False)
+
+    def _run(self, cmd, run, fetch):
+        if self.max_statements == 0:
+            cursor = self.connection.cursor()
+            try:
+                run(cursor)
+                return cursor.fetchall() if fetch else cursor.rowcount
+            finally:
+                cursor.close()
+
+        cursor = self._cursors.pop(cmd, None)
+        if not self._on_execute is None:
+            self._on_execute(not cursor is None)
+        if cursor is None:
+            cursor = self.connection.cursor(prepared=True)
+        try:
+            run(cursor)
+            return cursor.fetchall() if fetch else cursor.rowcount
+        except (mariadb.InterfaceError, mariadb.OperationalError):
+            # Statement handles do not survive a reconnect, prepare again
+            cursor.close()
+            cursor = None
+            raise
+        finally:
+            if not cursor is None:
+                self._keep(cmd, cursor)
+
+    def _keep(self, cmd, cursor):
+        self._cursors[cmd] = cursor
+        if len(self._cursors) > self.max_statements:
+            _, evicted = self._cursors.popitem(last=False)
+            evicted.close()
+
+    def close(self):
+        for cursor in self._cursors.values():
+            try:
+                cursor.close()
+            except mariadb.Error:
+                pass
+        self._cursors.clear()
+        self.connection.close()
+
+class UnitOfWork:
+    """
+    Statements run on a single connection to the primary and committed
+    together, see `DBClient.transaction`. A statement failing on a
+    unique key only undoes itself, the unit of work can go on.
+
+    With `archive`, inserts first check `uri_archive` for the ids and
+    digests, which left the unique keys of `uri` when archived.
+    """
+
+    def __init__(self, connection, archive=False):
+        self.connection = connection
+        self.archive = archive
+        self.statements = 0
+        self._savepoints = itertools.count()
+
+    def execute(self, cmd, params=()):
+        self.statements += 1
+        return self.connection.execute(cmd, params)
+
+    def query(self, cmd, params=()):
+        self.statements += 1
+        return self.connection.query(cmd, params)
+
+    def executemany(self, cmd, params):
+        self.statements += 1
+        return self.connection.executemany(cmd, params)
+
+    @contextmanager
+    def savepoint(self):
+        """Undo the statements of the block, and only those, if it raises."""
+        name = f"uow_{next(self._savepoints)}"
+        # Savepoints cannot be prepared, use the text protocol
+        cursor = self.connection.cursor()
+        try:
+            cursor.execute(f"SAVEPOINT {name}")
+            try:
+                yield self
+            except Exception:
+                cursor.execute(f"ROLLBACK TO SAVEPOINT {name}")
+                raise
+            cursor.execute(f"RELEASE SAVEPOINT {name}")
+        finally:
+            cursor.close()
+
+    @instrument_query
+    def insert_digest(self, digest, id):
+        """
+        Raises:
+        DuplicateDigestError: Digest is already indexed
+        """
+        digest = Entry.is_valid_digest(digest)
+        Entry.is_valid_id(id)
+        try:
+            self.execute("INSERT INTO uri_digest (sha256, id) VALUES (?, ?)", (digest, id,))
+        except mariadb.IntegrityError as e:
+            raise DuplicateDigestError(str(e)) from e
+
+    @instrument_query
+    def delete_digest(self, digest, id):
+        """Remove the index entry of `digest` if it still points to `id`."""
+        self.execute("DELETE FROM uri_digest WHERE sha256=? AND id=?", (digest, id,))
+
+    @instrument_query
+    def allocate_id_block(self, size, name="uri"):
+        """
+        Atomically reserve `size` values of a counter.
+
+        Return
+        int: First value of the reserved block
+        """
+        if not isinstance(size, int):
+            raise TypeError("Block size must be an integer type.")
+        self.execute("INSERT IGNORE INTO id_sequence (name, next_value) VALUES (?, 0)", (name,))
+        self.execute(
+            "UPDATE id_sequence SET next_value=LAST_INSERT_ID(next_value + ?) WHERE name=?",
+            (size, name,))
+        end = self.query("SELECT LAST_INSERT_ID()")[0][0]
+        return end - size
+
+    @instrument_query
+    def create_new_entry(self, entry):
+        """
+        Insert entry, relying on the unique keys for deduplication.
+
+        Raises:
+        DuplicateDigestError: URI is already stored
+        mariadb.IntegrityError: Id is already taken
+        """
+        if not isinstance(entry, Entry):
+            raise TypeError("Not an Entry type.")
+        self.check_archived([entry])
+        try:
+            self.execute(INSERT_ENTRY, DBClient.to_row(entry))
+        except mariadb.IntegrityError as e:
+            if DBClient.duplicate_key(e) == "sha256":
+                raise DuplicateDigestError(str(e)) from e
+            raise
+
+    def check_archived(self, entries):
+        """
+        Raise like the unique keys of `uri` if an id or digest of `entries`
+        is archived. The rows read stay share locked until the unit of
+        work ends, so they cannot be archived in between.
+
+        Raises:
+        DuplicateDigestError: URI is archived
+        mariadb.IntegrityError: Id is archived
+        """
+        if not self.archive:
+            return
+        cmd, params = DBClient.archived_query(entries)
+        DBClient.raise_archived(self.query(f"{cmd} LOCK IN SHARE MODE", params), entries)
+
+    @instrument_query
+    def create_new_entries(self, entries):
+        """
+        Insert many entries with a single statement.
+        Nothing is inserted if any id or digest is already stored.
+        """
+        params = []
+        for entry in entries:
+            if not isinstance(entry, Entry):
+                raise TypeError("Not an Entry type.")
+            params.append(DBClient.to_row(entry))
+        if len(params) == 0:
+            return
+        first = self.statements == 0
+        self.check_archived(entries)
+        if first:
+            # Nothing to keep, rolling back the whole unit of work is enough
+            try:
+                self.executemany(INSERT_ENTRY, params)
+            except mariadb.Error:
+                self.connection.rollback()
+                self.statements = 0
+                raise
+        else:
+            with self.savepoint():
+                self.executemany(INSERT_ENTRY, params)
+
+    @instrument_query
+    def update_access_dates(self, accessed):
+        """
+        Bulk update last accessed time.
+
+        accessed: dict mapping id to datetime of the last access
+        """
+        params = []
+        for id, accessed_on in accessed.items():
+            Entry.is_valid_id(id)
+            Entry.is_valid_datetime(accessed_on)
+            params.append((accessed_on, id))
+        if len(params) == 0:
+            return
+        self.executemany("UPDATE uri SET last_accessed=? WHERE id=?", params)
+
+    @instrument_query
+    def add_clicks(self, clicks):
+        """
+        Add to the daily click counts.
+
+        clicks: dict mapping (id, date) to a number of clicks
+        """
+        params = []
+        # Sorted so that concurrent flushes lock rows in the same order
+        for (id, day), count in sorted(clicks.items()):
+            Entry.is_valid_id(id)
+            if not isinstance(day, datetime.date):
+                raise TypeError("Not a date type.")
+            params.append((id, day, count))
+        if len(params) == 0:
+            return
+        self.executemany(
+            "INSERT INTO uri_clicks (id, day, count) VALUES (?, ?, ?) \
+            ON DUPLICATE KEY UPDATE count=count + VALUES(count)", params)
+
+    @instrument_query
+    def purge_expired(self, now, limit):
+        """
+        Delete up to `limit` entries expired at `now`, oldest first, and
+        their click counts.
+
+        Return
+        int: Number of entries deleted
+        """
+        ids = [row[0] for row in self.query(
+            "SELECT id FROM uri WHERE expires_at <= ? ORDER BY expires_at LIMIT ? FOR UPDATE",
+            (now, limit,))]
+        if len(ids) == 0:
+            return 0
+        placeholders, params = DBClient.padded(ids)
+        self.execute(f"DELETE FROM uri_clicks WHERE id IN ({placeholders})", params)
+        self.execute(f"DELETE FROM uri WHERE id IN ({placeholders})", params)
+        return len(ids)
+
+    @instrument_query
+    def archive_cold(self, before, limit):
+        """
+        Move up to `limit` entries without expiry, last accessed before
+        `before`, to the archive table.
+
+        Return
+        int: Number of entries moved
+        """
+        ids = [row[0] for row in self.query(
+            "SELECT id FROM uri WHERE last_accessed < ? AND expires_at IS NULL \
+            ORDER BY last_accessed LIMIT ? FOR UPDATE",
+            (before, limit,))]
+        if len(ids) == 0:
+            return 0
+        placeholders, params = DBClient.padded(ids)
+        self.execute(
+            f"INSERT INTO uri_archive (id, original_uri, sha256, created_on, last_accessed) \
+            SELECT id, original_uri, sha256, created_on, last_accessed FROM uri WHERE id IN ({placeholders})",
+            params)
+        self.execute(f"DELETE FROM uri WHERE id IN ({placeholders})", params)
+        return len(ids)
+
+    @instrument_query
+    def get_entries_from_ids(self, ids):
+        """Look up ids on the primary, seeing the writes of this unit of work."""
+        ids = list(ids)
+        for id in ids:
+            Entry.is_valid_id(id)
+        return DBClient.to_entries(DBClient.select_entries(self.query, "id", ids))
+
+    @instrument_query
+    def get_entries_from_digests(self, digests):
+        """Look up digests on the primary, seeing the writes of this unit of work."""
+        digests = [Entry.is_valid_digest(digest) for digest in digests]
+        return DBClient.to_entries(DBClient.select_entries(self.query, "sha256", digests))
+
+    def get_entry_from_id(self, id):
+        return self.get_entries_from_ids([id])
+
+    def get_entry_from_digest(self, digest):
+        return self.get_entries_from_digests([digest])
+
+class DBClient(StorageBackend):
+    """
+    MariaDB client. Writes and full table scans go to the primary,
+    lookups of ids and digests are spread over the healthy `replicas`
+    and fall back to the primary. A replica may not have received rows
+    just inserted on the primary yet, so ids and digests it does not
+    find are looked up again on the primary.
+
+    replicas: list of dict with "host" and "port", and optionally "user"
+              and "password" if they differ from the primary's
+    statement_cache_size: prepared statements kept per connection, see
+                          `PreparedConnection`
+    archive: create the `uri_archive` table if missing. Ids not found in
+             `uri` are looked up there whenever the table exists.
+    """
+
+    def __init__(self, user, password, host="::1", port=3306,
+                 pool_min_size=1, pool_max_size=10, pool_timeout=5,
+                 pool_validation_interval=30, check_schema=True,
+                 replicas=None, replica_check_interval=5, digest_index=False,
+                 statement_cache_size=64, archive=False):
         if not isinstance(user, str):
             raise TypeError("Username must be a string type.")
         elif not isinstance(password, str):
@@ -23,98 +398,533 @@ class DBClient:
         if port < 0 or port > HIGHEST_PORT:
             raise TypeError(
                 f"Port number must be between 0 and {HIGHEST_PORT} inclusive.")
-        
-        self.connection = mariadb.connect(
-            user=user,
-            password=password,
-            host=host,
-            port=port,
-            database=DATABASE_NAME,
-            connect_timeout=5, # TODO Throw this into config
-        )
-        self.connection.auto_reconnect = True # TODO Config?
-
-        cursor = self.get_cursor()
-        # Initialise table if does not exist
-        cursor.execute(
-            "SHOW TABLES WHERE Tables_in_uri_shortener=?",
-            ("uri",))
-        if len(cursor.fetchall()) < 1:
+
+        self._lock = threading.Lock()
+        self.statements_prepared = 0
+        self.statements_reused = 0
+
+        def create_pool(user, password, host, port):
+            def connect():
+                connection = mariadb.connect(
+                    user=user,
+                    password=password,
+                    host=host,
+                    port=port,
+                    database=DATABASE_NAME,
+                    connect_timeout=5, # TODO Throw this into config
+                )
+                connection.auto_reconnect = True # TODO Config?
+                return PreparedConnection(connection, statement_cache_size, self._count_statement)
+
+            return ConnectionPool(
+                connect,
+                min_size=pool_min_size,
+                max_size=pool_max_size,
+                timeout=pool_timeout,
+                validate=lambda connection: connection.ping(),
+                validation_interval=pool_validation_interval,
+            )
+
+        self.pool = create_pool(user, password, host, port)
+
+        self.replicas = []
+        for replica in replicas if not replicas is None else []:
+            if not isinstance(replica, dict) or not "host" in replica:
+                raise TypeError("Replica must be a dict with a host.")
+            replica_port = replica.get("port", 3306)
+            self.replicas.append(Replica(
+                f"{replica['host']}:{replica_port}",
+                create_pool(
+                    replica.get("user", user),
+                    replica.get("password", password),
+                    replica["host"],
+                    replica_port),
+                replica_check_interval))
+        self._next_replica = itertools.count()
+        self.replica_misses = 0 # Lookups repeated on the primary
+        self.archive_hits = 0
+
+        # Initialise tables if does not exist
+        if not self.has_table("uri"):
             self.create_table()
-        cursor.close()
+        elif check_schema and not self.has_column("uri", "expires_at"):
+            raise RuntimeError("Database schema is outdated, run db_migration.py first.")
+        if not self.has_table("id_sequence"):
+            self.create_sequence_table()
+        if not self.has_table("uri_clicks"):
+            self.create_clicks_table()
+        if digest_index and not self.has_table("uri_digest"):
+            self.create_digest_table()
+        if archive and not self.has_table("uri_archive"):
+            self.create_archive_table()
+        self.archive = self.has_table("uri_archive")
+
+        for replica in self.replicas:
+            replica.monitor.start()
 
-    def get_cursor(self):
-        return self.connection.cursor()
+    def has_table(self, name):
+        with self.pool.connection() as connection:
+            cursor = connection.cursor()
+            cursor.execute(
+                "SHOW TABLES WHERE Tables_in_uri_shortener=?",
+                (name,))
+            table_exists = len(cursor.fetchall()) > 0
+            cursor.close()
+        return table_exists
+
+    def has_column(self, table, column):
+        with self.pool.connection() as connection:
+            cursor = connection.cursor()
+            cursor.execute(
+                "SELECT COUNT(*) FROM information_schema.COLUMNS \
+                WHERE TABLE_SCHEMA=? AND TABLE_NAME=? AND COLUMN_NAME=?",
+                (DATABASE_NAME, table, column,))
+            column_exists = cursor.fetchall()[0][0] > 0
+            cursor.close()
+        return column_exists
 
     def create_table(self):
         """
-        | id (Unique) | original_uri | sha256 | created_on | last_accessed |
+        | id (Unique) | original_uri | html_safe_uri | encoded_uri | sha256 (Unique) | created_on | last_accessed | expires_at |
+
+        sha256 is NULL for links that expire, which are never deduplicated,
+        and for duplicate rows created before digests were unique.
+        html_safe_uri and encoded_uri are NULL only for rows created before
+        they were stored, see `db_migration.py`.
         """
         cmd = f"CREATE TABLE uri (\
             id VARCHAR({Entry.ID_CHAR_MAXLEN}) NOT NULL UNIQUE PRIMARY KEY,\
             original_uri TEXT NOT NULL,\
-            sha256 BINARY({Entry.SHA256_BYTE_LEN}) NOT NULL,\
+            html_safe_uri TEXT NULL,\
+            encoded_uri TEXT NULL,\
+            sha256 BINARY({Entry.SHA256_BYTE_LEN}) NULL,\
             created_on DATETIME NOT NULL DEFAULT CURRENT_TIMESTAMP,\
             last_accessed DATETIME NOT NULL DEFAULT CURRENT_TIMESTAMP,\
-            INDEX(sha256))"
-        cursor = self.get_cursor()
-        cursor.execute(cmd)
-        self.connection.commit()
-        cursor.close()
+            expires_at DATETIME NULL,\
+            UNIQUE INDEX sha256 (sha256),\
+            INDEX created_on (created_on),\
+            INDEX last_accessed (last_accessed),\
+            INDEX expires_at (expires_at))"
+        with self.pool.connection() as connection:
+            cursor = connection.cursor()
+            cursor.execute(cmd)
+            connection.commit()
+            cursor.close()
     
+    def create_sequence_table(self):
+        """
+        | name (Unique) | next_value |
+
+        Shared counters for sequence based id generation.
+        """
+        cmd = "CREATE TABLE id_sequence (\
+            name VARCHAR(32) NOT NULL PRIMARY KEY,\
+            next_value BIGINT UNSIGNED NOT NULL DEFAULT 0)"
+        with self.pool.connection() as connection:
+            cursor = connection.cursor()
+            cursor.execute(cmd)
+            connection.commit()
+            cursor.close()
+
+    def create_clicks_table(self):
+        """
+        | id, day (Unique) | count |
+
+        Daily rollup of clicks, added to in bulk by `ClickCounter`.
+        """
+        cmd = f"CREATE TABLE uri_clicks (\
+            id VARCHAR({Entry.ID_CHAR_MAXLEN}) NOT NULL,\
+            day DATE NOT NULL,\
+            count BIGINT UNSIGNED NOT NULL DEFAULT 0,\
+            PRIMARY KEY (id, day))"
+        with self.pool.connection() as connection:
+            cursor = connection.cursor()
+            cursor.execute(cmd)
+            connection.commit()
+            cursor.close()
+
+    def create_digest_table(self):
+        """
+        | sha256 (Unique) | id | created_on |
+
+        Digest to id index of a sharded database, stored on the shard of
+        the digest while the entry is stored on the shard of its id, see
+        `ShardedDBClient`.
+        """
+        cmd = f"CREATE TABLE uri_digest (\
+            sha256 BINARY({Entry.SHA256_BYTE_LEN}) NOT NULL PRIMARY KEY,\
+            id VARCHAR({Entry.ID_CHAR_MAXLEN}) NOT NULL,\
+            created_on DATETIME NOT NULL DEFAULT CURRENT_TIMESTAMP)"
+        with self.pool.connection() as connection:
+            cursor = connection.cursor()
+            cursor.execute(cmd)
+            connection.commit()
+            cursor.close()
+
+    def create_archive_table(self):
+        """
+        | id (Unique) | original_uri | sha256 | created_on | last_accessed | archived_on |
+
+        Entries not accessed for a while, moved out of `uri` to keep its
+        indexes small, see `Purger`. Compressed, rows are only read when
+        an id or digest is not found in `uri`, and before inserts since
+        archived ids and URIs stay taken.
+        """
+        cmd = f"CREATE TABLE uri_archive (\
+            id VARCHAR({Entry.ID_CHAR_MAXLEN}) NOT NULL PRIMARY KEY,\
+            original_uri TEXT NOT NULL,\
+            sha256 BINARY({Entry.SHA256_BYTE_LEN}) NULL,\
+            created_on DATETIME NOT NULL,\
+            last_accessed DATETIME NOT NULL,\
+            archived_on DATETIME NOT NULL DEFAULT CURRENT_TIMESTAMP,\
+            INDEX sha256 (sha256))\
+            ROW_FORMAT=COMPRESSED KEY_BLOCK_SIZE=8"
+        with self.pool.connection() as connection:
+            cursor = connection.cursor()
+            cursor.execute(cmd)
+            connection.commit()
+            cursor.close()
+
+    def insert_digest(self, digest, id):
+        with self.transaction() as tx:
+            tx.insert_digest(digest, id)
+
+    @instrument_query
+    def get_digest_ids(self, digests):
+        """
+        Look up the digest index, always on the primary.
+
+        Return
+        dict: digest -> (id, created_on)
+        """
+        digests = [Entry.is_valid_digest(digest) for digest in digests]
+        if len(digests) == 0:
+            return {}
+        placeholders, params = DBClient.padded(digests)
+        with self.pool.connection() as connection:
+            query = connection.query(
+                f"SELECT sha256, id, created_on FROM uri_digest WHERE sha256 IN ({placeholders})",
+                params)
+        return {bytes(digest): (id, created_on) for digest, id, created_on in query}
+
+    def delete_digest(self, digest, id):
+        with self.transaction() as tx:
+            tx.delete_digest(digest, id)
+
+    def allocate_id_block(self, size, name="uri"):
+        with self.transaction() as tx:
+            return tx.allocate_id_block(size, name)
+
     def create_new_entry(self, entry):
-        if not isinstance(entry, Entry):
-            raise TypeError("Not an Entry type.")
-        cmd = "INSERT INTO uri (id, original_uri, sha256) VALUES (?, ?, ?)"
-        cursor = self.get_cursor()
-        cursor.execute(cmd, (entry.id, entry.uri, entry.sha256,))
-        self.connection.commit()
-        cursor.close()
+        with self.transaction() as tx:
+            tx.create_new_entry(entry)
+
+    @staticmethod
+    def duplicate_key(error):
+        """
+        Return
+        None: Not a duplicate key error
+        str: Name of the violated unique key, e.g. "PRIMARY" or "sha256"
+        """
+        if getattr(error, "errno", ER_DUP_ENTRY) != ER_DUP_ENTRY:
+            return None
+        # Duplicate entry '...' for key 'sha256' (or 'uri.sha256' on newer servers)
+        match = re.search(r"for key '(?:[^'.]+\.)?([^'.]+)'", str(error))
+        if match is None:
+            return None
+        return match.group(1)
 
+    def create_new_entries(self, entries):
+        with self.transaction() as tx:
+            tx.create_new_entries(entries)
+
+    def purge_expired(self, now, limit):
+        with self.transaction() as tx:
+            return tx.purge_expired(now, limit)
+
+    def archive_cold(self, before, limit):
+        if not self.archive:
+            raise RuntimeError("No uri_archive table, set archive_after_days first.")
+        with self.transaction() as tx:
+            return tx.archive_cold(before, limit)
+
+    @instrument_query
     def update_access_date(self, id):
         Entry.is_valid_id(id)
-        cmd = "UPDATE uri SET last_accessed=CURRENT_TIMESTAMP WHERE id=?"
-        cursor = self.get_cursor()
-        cursor.execute(cmd, (id,))
-        self.connection.commit()
-        cursor.close()
+        with self.transaction() as tx:
+            tx.execute("UPDATE uri SET last_accessed=CURRENT_TIMESTAMP WHERE id=?", (id,))
+
+    def update_access_dates(self, accessed):
+        with self.transaction() as tx:
+            tx.update_access_dates(accessed)
+
+    def add_clicks(self, clicks):
+        with self.transaction() as tx:
+            tx.add_clicks(clicks)
+
+    @instrument_query
+    def get_clicks(self, id, since=None):
+        """
+        Read the daily click counts of an id, on a replica if possible.
+
+        Return
+        tuple: (total clicks, list of (date, clicks) on or after `since` by date)
+        """
+        Entry.is_valid_id(id)
+        replica = self._pick_replica()
+        if not replica is None:
+            try:
+                with replica.pool.connection() as connection:
+                    rows = DBClient.select_clicks(connection.query, id)
+                with self._lock:
+                    replica.reads += 1
+                return DBClient.to_clicks(rows, since)
+            except (mariadb.Error, PoolTimeoutError) as e:
+                print(f"WARNING: Replica {replica.name} failed, reading from the primary. {e}")
+                with self._lock:
+                    replica.errors += 1
+                replica.monitor.report_failure()
+        with self.pool.connection() as connection:
+            return DBClient.to_clicks(DBClient.select_clicks(connection.query, id), since)
 
+    @staticmethod
+    def select_clicks(query, id):
+        return query("SELECT day, count FROM uri_clicks WHERE id=? ORDER BY day", (id,))
+
+    @staticmethod
+    def to_clicks(rows, since=None):
+        total = sum(count for _, count in rows)
+        return total, [(day, count) for day, count in rows if since is None or day >= since]
+
+    @contextmanager
+    def transaction(self):
+        """
+        Unit of work on the primary, committed once when the block exits
+        and rolled back if it raises, e.g.
+
+            with db.transaction() as tx:
+                tx.create_new_entries(entries)
+                tx.update_access_dates(accessed)
+        """
+        with self.pool.connection() as connection:
+            tx = UnitOfWork(connection, self.archive)
+            yield tx
+            if tx.statements > 0:
+                connection.commit()
+
+    @instrument_query
     def get_entry_from_digest(self, digest):
-        digest = Entry.is_valid_digest(digest)
-        cmd = "SELECT * FROM uri WHERE sha256=?"
-        cursor = self.get_cursor()
-        cursor.execute(cmd, (digest,))
-        query = cursor.fetchall()
-        cursor.close()
-        result = []
-        for id, uri, digest, created_time, last_accessed_time in query:
-            entry = Entry(id, uri, created_time, last_accessed_time)
-            entry.set_digest(digest)
-            result.append(entry)
-            
-        return result
+        entries = self._read_entries("sha256", [Entry.is_valid_digest(digest)])
+        return entries + self._read_archived("sha256", [digest], entries)
 
+    @instrument_query
     def get_entry_from_id(self, id):
         Entry.is_valid_id(id)
-        cmd = "SELECT * FROM uri WHERE id=?"
-        cursor = self.get_cursor()
-        cursor.execute(cmd, (id,))
-        query = cursor.fetchall()
-        cursor.close()
-        result = []
-        for id, uri, digest, created_time, last_accessed_time in query:
-            entry = Entry(id, uri, created_time, last_accessed_time)
-            entry.set_digest(digest)
-            result.append(entry)
-        
-        return result
+        entries = self._read_entries("id", [id])
+        return entries + self._read_archived("id", [id], entries)
+
+    @instrument_query
+    def get_entries_from_digests(self, digests):
+        """Look up many digests with a single query."""
+        digests = [Entry.is_valid_digest(digest) for digest in digests]
+        entries = self._read_entries("sha256", digests)
+        return entries + self._read_archived("sha256", digests, entries)
+
+    @instrument_query
+    def get_entries_from_ids(self, ids):
+        """Look up many ids with a single query."""
+        ids = list(ids)
+        for id in ids:
+            Entry.is_valid_id(id)
+        entries = self._read_entries("id", ids)
+        return entries + self._read_archived("id", ids, entries)
+
+    def _read_archived(self, column, values, found):
+        """Look up ids or digests missing from `found` in the archive, on the primary."""
+        if not self.archive:
+            return []
+        found = {entry.id if column == "id" else entry.sha256 for entry in found}
+        missing = [value for value in dict.fromkeys(values) if not value in found]
+        if len(missing) == 0:
+            return []
+        with self.pool.connection() as connection:
+            entries = DBClient.to_entries(DBClient.select_entries(
+                connection.query, column, missing, ARCHIVE_COLUMNS, "uri_archive"))
+        if len(entries) > 0:
+            with self._lock:
+                self.archive_hits += len(entries)
+        return entries
+
+    def _select_entries(self, pool, column, values):
+        with pool.connection() as connection:
+            return DBClient.to_entries(DBClient.select_entries(connection.query, column, values))
+
+    @staticmethod
+    def select_entries(query, column, values, columns=ENTRY_COLUMNS, table="uri"):
+        """Rows of `columns` where `column` is one of `values`, run with `query`."""
+        if len(values) == 0:
+            return []
+        elif len(values) == 1:
+            return query(f"SELECT {columns} FROM {table} WHERE {column}=?", tuple(values))
+        placeholders, params = DBClient.padded(values)
+        return query(f"SELECT {columns} FROM {table} WHERE {column} IN ({placeholders})", params)
+
+    @staticmethod
+    def archived_query(entries, placeholder="?"):
+        """
+        Query for the archived rows with an id or digest of `entries`.
+
+        Return
+        tuple: (cmd, params)
+        """
+        ids = [entry.id for entry in entries]
+        digests = [entry.sha256 for entry in entries if entry.expires_at is None]
+        cmd = f"SELECT id, sha256 FROM uri_archive WHERE id IN ({', '.join([placeholder] * len(ids))})"
+        if len(digests) > 0:
+            cmd += f" OR sha256 IN ({', '.join([placeholder] * len(digests))})"
+        return cmd, tuple(ids + digests)
+
+    @staticmethod
+    def raise_archived(rows, entries):
+        """
+        Raise for rows of `archived_query(entries)`, like a duplicate key
+        in `uri` would, an archived URI first.
+        """
+        digests = {entry.sha256 for entry in entries if entry.expires_at is None}
+        for _, sha256 in rows:
+            if not sha256 is None and bytes(sha256) in digests:
+                raise DuplicateDigestError(f"Duplicate entry '{bytes(sha256).hex()}' for key 'sha256' of uri_archive")
+        if len(rows) > 0:
+            raise mariadb.IntegrityError(f"Duplicate entry '{rows[0][0]}' for key 'PRIMARY' of uri_archive")
 
+    @staticmethod
+    def padded(values):
+        """
+        Pad `values` to a power of two length by repeating the last one,
+        so that IN lists of any length share a few prepared statements.
+
+        Return
+        tuple: (placeholders, params)
+        """
+        size = 1 << (len(values) - 1).bit_length()
+        params = tuple(values) + (values[-1],) * (size - len(values))
+        return ", ".join("?" * size), params
+
+    def _pick_replica(self):
+        """Return the next healthy replica, None if there is none."""
+        healthy = [replica for replica in self.replicas if replica.monitor.healthy]
+        if len(healthy) == 0:
+            return None
+        return healthy[next(self._next_replica) % len(healthy)]
+
+    def _read_entries(self, column, values):
+        """Select entries where `column` is one of `values`, on a replica if possible."""
+        if len(values) == 0:
+            return []
+        replica = self._pick_replica()
+        if replica is None:
+            return self._select_entries(self.pool, column, values)
+
+        try:
+            entries = self._select_entries(replica.pool, column, values)
+        except (mariadb.Error, PoolTimeoutError) as e:
+            print(f"WARNING: Replica {replica.name} failed, reading from the primary. {e}")
+            with self._lock:
+                replica.errors += 1
+            replica.monitor.report_failure()
+            return self._select_entries(self.pool, column, values)
+
+        with self._lock:
+            replica.reads += 1
+        found = {entry.id if column == "id" else entry.sha256 for entry in entries}
+        missing = [value for value in dict.fromkeys(values) if not value in found]
+        if len(missing) > 0:
+            # Possibly inserted after the replica's last replicated write
+            with self._lock:
+                self.replica_misses += len(missing)
+            entries += self._select_entries(self.pool, column, missing)
+        return entries
+
+    def load_ids(self, since=None, chunk_size=10000):
+        """
+        Stream `(id, created_on)` of every row, or of rows created on or
+        after `since`, in chunks of `chunk_size` rows. A pooled connection
+        is only held while a chunk is fetched. Archived rows come last.
+        """
+        return self._stream_tables("id, created_on", "id, created_on", since, chunk_size)
+
+    def load_entries(self, since=None, chunk_size=10000):
+        """Like `load_ids`, streaming rows of ENTRY_COLUMNS."""
+        return self._stream_tables(ENTRY_COLUMNS, ARCHIVE_COLUMNS, since, chunk_size)
+
+    def _stream_tables(self, columns, archive_columns, since, chunk_size):
+        rows = self._stream_rows(columns, since, chunk_size)
+        if not self.archive:
+            return rows
+        return itertools.chain(rows, self._stream_rows(archive_columns, since, chunk_size, "uri_archive"))
+
+    def _stream_rows(self, columns, since, chunk_size, table="uri"):
+        last_id = ""
+        while True:
+            if since is None:
+                cmd = f"SELECT {columns} FROM {table} WHERE id > ? ORDER BY id LIMIT ?"
+                params = (last_id, chunk_size,)
+            else:
+                cmd = f"SELECT {columns} FROM {table} \
+                    WHERE created_on >= ? AND id > ? ORDER BY id LIMIT ?"
+                params = (since, last_id, chunk_size,)
+            rows = self.fetch_rows(cmd, params)
+            yield from rows
+            if len(rows) < chunk_size:
+                return
+            last_id = rows[-1][0]
+
+    @instrument_query
+    def fetch_rows(self, cmd, params):
+        """One chunk of `load_ids` / `load_entries`."""
+        with self.pool.connection() as connection:
+            return connection.query(cmd, params)
+
+    @staticmethod
+    def to_row(entry):
+        """Values of INSERT_ENTRY, links that expire are stored without digest."""
+        sha256 = entry.sha256 if entry.expires_at is None else None
+        return (entry.id, entry.uri, entry.html_safe_uri, entry.encoded_uri, sha256, entry.expires_at,)
+
+    @staticmethod
+    def to_entries(query):
+        """Build entries from rows selected with ENTRY_COLUMNS."""
+        return [Entry.from_row(*row) for row in query]
+
+    def _count_statement(self, reused):
+        with self._lock:
+            if reused:
+                self.statements_reused += 1
+            else:
+                self.statements_prepared += 1
+
+    def stats(self):
+        stats = self.pool.stats()
+        stats["statements_prepared"] = self.statements_prepared
+        stats["statements_reused"] = self.statements_reused
+        if len(self.replicas) > 0:
+            stats["replica_misses"] = self.replica_misses
+            stats["replicas"] = {f"replica_{i}": replica.stats() for i, replica in enumerate(self.replicas)}
+        if self.archive:
+            stats["archive_hits"] = self.archive_hits
+        return stats
+
+    @instrument_query
     def ping(self):
-        return self.connection.ping()
+        # Always validate a connection here, regardless of how long it was idle
+        with self.pool.connection() as connection:
+            return connection.ping()
 
     def close_connection(self):
-        self.connection.close()
-        self.connection = None
+        for replica in self.replicas:
+            replica.monitor.stop()
+            replica.pool.close()
+        self.pool.close()
     
 if "__main__" == __name__:
     from config_parser import ConfigParser
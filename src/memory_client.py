@@ -0,0 +1,278 @@
+# This Source Code Form is subject to the terms of the Mozilla Public
+# License, v. 2.0. If a copy of the MPL was not distributed with this
+# file, You can obtain one at http://mozilla.org/MPL/2.0/.
+
+import asyncio
+import datetime
+import threading
+import time
+import mariadb
+from mariadb_client import DuplicateDigestError
+from entry import Entry
+from metrics import instrument_query
+from storage_backend import StorageBackend
+
+class MemoryDBClient(StorageBackend):
+    """
+    In-memory stand-in for `DBClient`, for tests and load tests without a
+    MariaDB server. Rows are stored the way `DBClient` stores them and
+    read back through `Entry.from_row`, duplicate ids and digests raise
+    the same errors as the unique keys of the `uri` table.
+
+    `latency` seconds are slept on every call to simulate a round trip.
+    Calls are counted and timed like those of `DBClient`.
+    """
+
+    def __init__(self, latency=0):
+        if not isinstance(latency, (int, float)):
+            raise TypeError("Latency must be an integer or float type.")
+        if latency < 0:
+            raise ValueError("Latency cannot be negative.")
+
+        self.latency = latency
+        self._rows = {} # id -> [id, original_uri, html_safe_uri, encoded_uri, sha256, created_on, last_accessed, expires_at]
+        self._digests = {} # sha256 -> id
+        self._archive = {} # id -> row as selected with ARCHIVE_COLUMNS
+        self._archived_digests = {} # sha256 -> id, of archived rows
+        self._clicks = {} # (id, date) -> clicks
+        self._sequences = {}
+        self._lock = threading.Lock()
+        self.queries = 0
+
+    def _round_trip(self):
+        self.queries += 1
+        if self.latency > 0:
+            time.sleep(self.latency)
+
+    @staticmethod
+    def _duplicate(value, key):
+        return mariadb.IntegrityError(f"Duplicate entry '{value}' for key '{key}'")
+
+    @instrument_query
+    def allocate_id_block(self, size, name="uri"):
+        if not isinstance(size, int):
+            raise TypeError("Block size must be an integer type.")
+        self._round_trip()
+        with self._lock:
+            start = self._sequences.get(name, 0)
+            self._sequences[name] = start + size
+        return start
+
+    def _insert(self, entries):
+        now = datetime.datetime.now().replace(microsecond=0)
+        ids = set()
+        digests = set()
+        for entry in entries:
+            if not isinstance(entry, Entry):
+                raise TypeError("Not an Entry type.")
+            if entry.expires_at is None and entry.sha256 in self._archived_digests:
+                raise DuplicateDigestError(str(MemoryDBClient._duplicate(entry.sha256.hex(), "sha256")))
+            if entry.id in self._rows or entry.id in self._archive or entry.id in ids:
+                raise MemoryDBClient._duplicate(entry.id, "PRIMARY")
+            if entry.expires_at is None and (entry.sha256 in self._digests or entry.sha256 in digests):
+                raise DuplicateDigestError(str(MemoryDBClient._duplicate(entry.sha256.hex(), "sha256")))
+            ids.add(entry.id)
+            if entry.expires_at is None:
+                digests.add(entry.sha256)
+        for entry in entries:
+            # Links that expire are stored without digest, like DBClient.to_row
+            sha256 = entry.sha256 if entry.expires_at is None else None
+            self._rows[entry.id] = [entry.id, entry.uri, entry.html_safe_uri,
+                                    entry.encoded_uri, sha256, now, now, entry.expires_at]
+            if not sha256 is None:
+                self._digests[sha256] = entry.id
+
+    @instrument_query
+    def create_new_entry(self, entry):
+        self._round_trip()
+        with self._lock:
+            self._insert([entry])
+
+    @instrument_query
+    def create_new_entries(self, entries):
+        """Nothing is inserted if any id or digest is already stored."""
+        entries = list(entries)
+        if len(entries) == 0:
+            return
+        self._round_trip()
+        with self._lock:
+            try:
+                self._insert(entries)
+            except DuplicateDigestError as e:
+                # DBClient.create_new_entries does not tell digests apart
+                raise mariadb.IntegrityError(str(e)) from e
+
+    @instrument_query
+    def update_access_dates(self, accessed):
+        self._round_trip()
+        with self._lock:
+            for id, accessed_on in accessed.items():
+                Entry.is_valid_id(id)
+                Entry.is_valid_datetime(accessed_on)
+                if id in self._rows:
+                    self._rows[id][6] = accessed_on
+
+    @instrument_query
+    def add_clicks(self, clicks):
+        self._round_trip()
+        with self._lock:
+            for (id, day), count in clicks.items():
+                Entry.is_valid_id(id)
+                if not isinstance(day, datetime.date):
+                    raise TypeError("Not a date type.")
+                self._clicks[(id, day)] = self._clicks.get((id, day), 0) + count
+
+    @instrument_query
+    def get_clicks(self, id, since=None):
+        Entry.is_valid_id(id)
+        self._round_trip()
+        with self._lock:
+            rows = sorted((day, count) for (click_id, day), count in self._clicks.items() if click_id == id)
+        return sum(count for _, count in rows), [row for row in rows if since is None or row[0] >= since]
+
+    @instrument_query
+    def purge_expired(self, now, limit):
+        self._round_trip()
+        with self._lock:
+            expired = sorted((row[7], id) for id, row in self._rows.items()
+                             if not row[7] is None and row[7] <= now)[:limit]
+            for _, id in expired:
+                self._remove(id)
+            expired_ids = {id for _, id in expired}
+            for key in [key for key in self._clicks if key[0] in expired_ids]:
+                del self._clicks[key]
+        return len(expired)
+
+    @instrument_query
+    def archive_cold(self, before, limit):
+        self._round_trip()
+        with self._lock:
+            cold = sorted((row[6], id) for id, row in self._rows.items()
+                          if row[6] < before and row[7] is None)[:limit]
+            for _, id in cold:
+                row = self._remove(id)
+                self._archive[id] = (row[0], row[1], None, None, row[4], row[5], row[6], None)
+                if not row[4] is None:
+                    self._archived_digests[row[4]] = id
+        return len(cold)
+
+    def _remove(self, id):
+        row = self._rows.pop(id)
+        if self._digests.get(row[4]) == id:
+            del self._digests[row[4]]
+        return row
+
+    def _select(self, ids):
+        with self._lock:
+            rows = [self._rows[id] if id in self._rows else self._archive[id]
+                    for id in ids if id in self._rows or id in self._archive]
+            return [Entry.from_row(*row) for row in rows]
+
+    def get_entry_from_digest(self, digest):
+        return self.get_entries_from_digests([digest])
+
+    def get_entry_from_id(self, id):
+        return self.get_entries_from_ids([id])
+
+    @instrument_query
+    def get_entries_from_digests(self, digests):
+        digests = [Entry.is_valid_digest(digest) for digest in digests]
+        if len(digests) == 0:
+            return []
+        self._round_trip()
+        with self._lock:
+            ids = [self._digests[digest] if digest in self._digests else self._archived_digests[digest]
+                   for digest in set(digests) if digest in self._digests or digest in self._archived_digests]
+        return self._select(ids)
+
+    @instrument_query
+    def get_entries_from_ids(self, ids):
+        ids = list(ids)
+        for id in ids:
+            Entry.is_valid_id(id)
+        if len(ids) == 0:
+            return []
+        self._round_trip()
+        return self._select(set(ids))
+
+    def load_ids(self, since=None, chunk_size=10000):
+        return [(row[0], row[5]) for row in self.load_entries(since, chunk_size)]
+
+    @instrument_query
+    def load_entries(self, since=None, chunk_size=10000):
+        self._round_trip()
+        with self._lock:
+            rows = [tuple(row) for row in self._rows.values()
+                    if since is None or row[5] >= since]
+            archived = [row for row in self._archive.values()
+                        if since is None or row[5] >= since]
+        return sorted(rows) + sorted(archived)
+
+    def stats(self):
+        with self._lock:
+            return {
+                "rows": len(self._rows),
+                "archived": len(self._archive),
+                "queries": self.queries,
+            }
+
+    @instrument_query
+    def ping(self):
+        self._round_trip()
+        return True
+
+    def close_connection(self):
+        pass
+
+class AsyncMemoryDBClient:
+    """
+    Async facade over a `MemoryDBClient` for the ASGI server, `latency`
+    seconds are awaited on every call instead of blocking the event loop.
+    """
+
+    read_only = False
+
+    def __init__(self, backend, latency=0):
+        if not isinstance(backend, MemoryDBClient):
+            raise TypeError("Not a MemoryDBClient type.")
+        elif not isinstance(latency, (int, float)):
+            raise TypeError("Latency must be an integer or float type.")
+        if latency < 0:
+            raise ValueError("Latency cannot be negative.")
+
+        self.backend = backend
+        self.latency = latency
+
+    async def _round_trip(self):
+        if self.latency > 0:
+            await asyncio.sleep(self.latency)
+
+    async def connect(self):
+        pass
+
+    async def get_entry_from_id(self, id):
+        await self._round_trip()
+        return self.backend.get_entry_from_id(id)
+
+    async def get_entry_from_digest(self, digest):
+        await self._round_trip()
+        return self.backend.get_entry_from_digest(digest)
+
+    async def get_entries_from_ids(self, ids):
+        await self._round_trip()
+        return self.backend.get_entries_from_ids(ids)
+
+    async def get_entries_from_digests(self, digests):
+        await self._round_trip()
+        return self.backend.get_entries_from_digests(digests)
+
+    async def create_new_entry(self, entry):
+        await self._round_trip()
+        self.backend.create_new_entry(entry)
+
+    async def ping(self):
+        await self._round_trip()
+        return self.backend.ping()
+
+    async def close(self):
+        pass
@@ -0,0 +1,278 @@
+# This Source Code Form is subject to the terms of the Mozilla Public
+# License, v. 2.0. If a copy of the MPL was not distributed with this
+# file, You can obtain one at http://mozilla.org/MPL/2.0/.
+
+"""
+Always-on counters, gauges and histograms, exposed at /api/v1/metrics
+in the Prometheus text format.
+
+Metrics live in process memory, each worker process of the server
+exposes its own. Updates take a lock and a few additions, so they are
+cheap enough to stay enabled on every request and query.
+"""
+
+from bisect import bisect_left
+from contextlib import contextmanager
+import falcon
+import functools
+import inspect
+import math
+import threading
+import time
+import tracing
+
+CONTENT_TYPE = "text/plain; version=0.0.4; charset=utf-8"
+PREFIX = "uri_shortener"
+
+# Seconds, from a cache hit to a request stuck waiting for a connection
+LATENCY_BUCKETS = (0.0005, 0.001, 0.0025, 0.005, 0.01, 0.025, 0.05, 0.1, 0.25, 0.5, 1, 2.5, 5, 10)
+ATTEMPT_BUCKETS = (1, 2, 3, 5, 10, 20, 50)
+
+def format_value(value):
+    if value == math.inf:
+        return "+Inf"
+    elif value == -math.inf:
+        return "-Inf"
+    elif isinstance(value, float) and value.is_integer():
+        return str(int(value))
+    return str(value)
+
+def format_labels(names, values, extra=()):
+    pairs = list(zip(names, values)) + list(extra)
+    if len(pairs) == 0:
+        return ""
+    escaped = (str(value).replace("\\", "\\\\").replace("\"", "\\\"").replace("\n", "\\n")
+               for _, value in pairs)
+    return "{" + ",".join(f"{name}=\"{value}\"" for (name, _), value in zip(pairs, escaped)) + "}"
+
+class Metric:
+
+    TYPE = None
+
+    def __init__(self, name, help, labels=()):
+        if not isinstance(name, str):
+            raise TypeError("Metric name must be a string type.")
+        self.name = name
+        self.help = help
+        self.labels = tuple(labels)
+        self._values = {} # label values -> value
+        self._lock = threading.Lock()
+
+    def _key(self, labels):
+        if len(labels) != len(self.labels) or any(not name in labels for name in self.labels):
+            raise ValueError(f"{self.name} takes labels {self.labels}.")
+        return tuple(str(labels[name]) for name in self.labels)
+
+    def render(self):
+        lines = [f"# HELP {self.name} {self.help}", f"# TYPE {self.name} {self.TYPE}"]
+        with self._lock:
+            items = sorted(self._values.items())
+        for key, value in items:
+            lines.extend(self._render_value(key, value))
+        return lines
+
+    def _render_value(self, key, value):
+        return [f"{self.name}{format_labels(self.labels, key)} {format_value(value)}"]
+
+class Counter(Metric):
+
+    TYPE = "counter"
+
+    def inc(self, amount=1, **labels):
+        key = self._key(labels)
+        with self._lock:
+            self._values[key] = self._values.get(key, 0) + amount
+
+    def get(self, **labels):
+        with self._lock:
+            return self._values.get(self._key(labels), 0)
+
+class Gauge(Counter):
+
+    TYPE = "gauge"
+
+    def dec(self, amount=1, **labels):
+        self.inc(-amount, **labels)
+
+    def set(self, value, **labels):
+        key = self._key(labels)
+        with self._lock:
+            self._values[key] = value
+
+class Histogram(Metric):
+
+    TYPE = "histogram"
+
+    def __init__(self, name, help, labels=(), buckets=LATENCY_BUCKETS):
+        super().__init__(name, help, labels)
+        self.buckets = tuple(sorted(buckets)) + (math.inf,)
+
+    def observe(self, value, **labels):
+        key = self._key(labels)
+        index = bisect_left(self.buckets, value)
+        with self._lock:
+            counts = self._values.get(key)
+            if counts is None:
+                # One count per bucket, not cumulative, then the sum
+                counts = self._values[key] = [0] * len(self.buckets) + [0.0]
+            counts[index] += 1
+            counts[-1] += value
+
+    @contextmanager
+    def time(self, **labels):
+        start = time.perf_counter()
+        try:
+            yield
+        finally:
+            self.observe(time.perf_counter() - start, **labels)
+
+    def get(self, **labels):
+        """
+        Return
+        (int, float): Number and sum of observations
+        """
+        with self._lock:
+            counts = self._values.get(self._key(labels))
+            if counts is None:
+                return 0, 0.0
+            return sum(counts[:-1]), counts[-1]
+
+    def _render_value(self, key, counts):
+        lines = []
+        total = 0
+        for bound, count in zip(self.buckets, counts):
+            total += count
+            lines.append(f"{self.name}_bucket{format_labels(self.labels, key, [('le', format_value(bound))])} {total}")
+        lines.append(f"{self.name}_sum{format_labels(self.labels, key)} {format_value(counts[-1])}")
+        lines.append(f"{self.name}_count{format_labels(self.labels, key)} {total}")
+        return lines
+
+class Registry:
+
+    def __init__(self):
+        self._metrics = {}
+        self._lock = threading.Lock()
+
+    def register(self, metric):
+        with self._lock:
+            if metric.name in self._metrics:
+                raise ValueError(f"Metric {metric.name} is already registered.")
+            self._metrics[metric.name] = metric
+        return metric
+
+    def counter(self, name, help, labels=()):
+        return self.register(Counter(f"{PREFIX}_{name}", help, labels))
+
+    def gauge(self, name, help, labels=()):
+        return self.register(Gauge(f"{PREFIX}_{name}", help, labels))
+
+    def histogram(self, name, help, labels=(), buckets=LATENCY_BUCKETS):
+        return self.register(Histogram(f"{PREFIX}_{name}", help, labels, buckets))
+
+    def render(self, stats=None):
+        """
+        Return
+        str: Every metric in the Prometheus text format, followed by the
+             numbers of `stats` (e.g. `Logic.stats()`) as gauges
+        """
+        with self._lock:
+            metrics = list(self._metrics.values())
+        lines = []
+        for metric in metrics:
+            lines.extend(metric.render())
+        if not stats is None:
+            lines.extend(Registry.render_stats(stats))
+        return "\n".join(lines) + "\n"
+
+    @staticmethod
+    def render_stats(stats, prefix=PREFIX):
+        lines = []
+        for key, value in stats.items():
+            name = f"{prefix}_{key}"
+            if isinstance(value, dict):
+                lines.extend(Registry.render_stats(value, name))
+            elif isinstance(value, (bool, int, float)):
+                lines.append(f"# TYPE {name} gauge")
+                lines.append(f"{name} {format_value(float(value) if isinstance(value, bool) else value)}")
+        return lines
+
+REGISTRY = Registry()
+
+HTTP_REQUESTS = REGISTRY.counter(
+    "http_requests_total", "Requests served, by route and status code.", ("route", "method", "status"))
+HTTP_LATENCY = REGISTRY.histogram(
+    "http_request_duration_seconds", "Time to serve a request, by route and status code.", ("route", "method", "status"))
+HTTP_IN_FLIGHT = REGISTRY.gauge(
+    "http_requests_in_flight", "Requests being served.")
+DB_QUERIES = REGISTRY.counter(
+    "db_queries_total", "Database calls, by client method and outcome.", ("method", "outcome"))
+DB_LATENCY = REGISTRY.histogram(
+    "db_query_duration_seconds", "Time spent in database calls, by client method.", ("method",))
+ID_ATTEMPTS = REGISTRY.histogram(
+    "id_generation_attempts", "Attempts to find a free id (check) and to insert with it (insert).",
+    ("stage",), ATTEMPT_BUCKETS)
+
+def instrument_query(method):
+    """
+    Decorator counting and timing calls of a database client method,
+    works with coroutine methods too.
+    """
+    name = method.__name__
+
+    def record(start, outcome):
+        elapsed = time.perf_counter() - start
+        DB_LATENCY.observe(elapsed, method=name)
+        DB_QUERIES.inc(method=name, outcome=outcome)
+        tracing.record("db", elapsed)
+
+    if inspect.iscoroutinefunction(method):
+        @functools.wraps(method)
+        async def async_wrapper(*args, **kwargs):
+            start = time.perf_counter()
+            try:
+                result = await method(*args, **kwargs)
+            except Exception:
+                record(start, "error")
+                raise
+            record(start, "ok")
+            return result
+        return async_wrapper
+
+    @functools.wraps(method)
+    def wrapper(*args, **kwargs):
+        start = time.perf_counter()
+        try:
+            result = method(*args, **kwargs)
+        except Exception:
+            record(start, "error")
+            raise
+        record(start, "ok")
+        return result
+    return wrapper
+
+class MetricsMiddleware:
+    """
+    Count and time every request by route template, method and status
+    code, and track requests in flight. Works for both the WSGI and the
+    ASGI app.
+    """
+
+    def process_request(self, req, resp):
+        req.context.metrics_start = time.perf_counter()
+        HTTP_IN_FLIGHT.inc()
+
+    def process_response(self, req, resp, resource, req_succeeded):
+        start = getattr(req.context, "metrics_start", None)
+        if start is None:
+            return
+        HTTP_IN_FLIGHT.dec()
+        route = req.uri_template if not req.uri_template is None else "unmatched"
+        status = str(falcon.http_status_to_code(resp.status))
+        HTTP_REQUESTS.inc(route=route, method=req.method, status=status)
+        HTTP_LATENCY.observe(time.perf_counter() - start, route=route, method=req.method, status=status)
+
+    async def process_request_async(self, req, resp):
+        self.process_request(req, resp)
+
+    async def process_response_async(self, req, resp, resource, req_succeeded):
+        self.process_response(req, resp, resource, req_succeeded)
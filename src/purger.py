@@ -0,0 +1,143 @@
+# This Source Code Form is subject to the terms of the Mozilla Public
+# License, v. 2.0. If a copy of the MPL was not distributed with this
+# file, You can obtain one at http://mozilla.org/MPL/2.0/.
+
+"""
+Deletion of expired links and archival of cold ones.
+
+Runs in the API server when `purge_interval` of the `[expiry]` section is
+set, enable it on one server only, or once from cron:
+
+    python purger.py
+"""
+
+import datetime
+import threading
+import time
+
+class Purger:
+    """
+    Every `interval` seconds, delete expired entries and then, if
+    `archive_after` is set, move entries not accessed for that long to
+    the archive. Rows are handled in chunks of `chunk_size`, each in its
+    own short transaction, and at most `rows_per_second` rows are handled
+    per second, so that locks are never held for long and replicas keep
+    up. A `rows_per_second` of 0 removes the limit.
+    """
+
+    def __init__(self, db, interval=60, chunk_size=500, rows_per_second=1000,
+                 archive_after=None, clock=datetime.datetime.now):
+        if not isinstance(interval, (int, float)) or not isinstance(rows_per_second, (int, float)):
+            raise TypeError("Purge interval and rate must be an integer or float type.")
+        elif not isinstance(chunk_size, int):
+            raise TypeError("Chunk size must be an integer type.")
+        elif not archive_after is None and not isinstance(archive_after, datetime.timedelta):
+            raise TypeError("archive_after must be a timedelta type.")
+        if interval <= 0:
+            raise ValueError("Purge interval must be greater than 0.")
+        elif chunk_size < 1:
+            raise ValueError("Chunk size must be greater than 0.")
+        elif rows_per_second < 0:
+            raise ValueError("Rows per second cannot be negative.")
+
+        self.db = db
+        self.interval = interval
+        self.chunk_size = chunk_size
+        self.rows_per_second = rows_per_second
+        self.archive_after = archive_after
+        self._clock = clock
+        self._stopped = threading.Event()
+        self._thread = None
+        self.purged = 0
+        self.archived = 0
+        self.runs = 0
+        self.errors = 0
+        self.last_run_duration = 0.0
+
+    def start(self):
+        if self._thread is not None:
+            return
+        self._stopped.clear()
+        self._thread = threading.Thread(target=self._run, name="purger", daemon=True)
+        self._thread.start()
+
+    def stop(self):
+        self._stopped.set()
+        if self._thread is not None:
+            self._thread.join()
+            self._thread = None
+
+    def run_once(self):
+        """
+        Purge, then archive, until nothing is left or the purger is stopped.
+
+        Return
+        (int, int): Entries purged and archived
+        """
+        start = time.monotonic()
+        now = self._clock().replace(microsecond=0)
+        purged = self._drain(self.db.purge_expired, now)
+        self.purged += purged
+        archived = 0
+        if not self.archive_after is None:
+            archived = self._drain(self.db.archive_cold, now - self.archive_after)
+            self.archived += archived
+        self.runs += 1
+        self.last_run_duration = time.monotonic() - start
+        return purged, archived
+
+    def _drain(self, step, bound):
+        total = 0
+        while not self._stopped.is_set():
+            count = step(bound, self.chunk_size)
+            total += count
+            if count < self.chunk_size:
+                break
+            if self.rows_per_second > 0:
+                self._stopped.wait(count / self.rows_per_second)
+        return total
+
+    def _run(self):
+        while not self._stopped.is_set():
+            try:
+                self.run_once()
+            except Exception as e:
+                print(f"WARNING: Failed to purge expired entries. {e}")
+                self.errors += 1
+            self._stopped.wait(self.interval)
+
+    def stats(self):
+        return {
+            "purged": self.purged,
+            "archived": self.archived,
+            "runs": self.runs,
+            "errors": self.errors,
+            "last_run_duration": self.last_run_duration,
+        }
+
+    @staticmethod
+    def from_config(db, expiry):
+        """Purger of the `[expiry]` section, None if `purge_interval` is 0."""
+        interval = expiry.get("purge_interval", 0)
+        if interval == 0:
+            return None
+        archive_after_days = expiry.get("archive_after_days", 0)
+        return Purger(
+            db,
+            interval,
+            expiry.get("purge_chunk_size", 500),
+            expiry.get("purge_rows_per_second", 1000),
+            datetime.timedelta(days=archive_after_days) if archive_after_days > 0 else None)
+
+if "__main__" == __name__:
+    from config_parser import ConfigParser
+    from logic import Logic
+
+    ConfigParser()
+    config = ConfigParser.get_config()
+    db = Logic.connect_db(config)
+    expiry = dict(config.get("expiry", {}))
+    expiry["purge_interval"] = expiry.get("purge_interval") or 60 # Unused, runs once
+    purged, archived = Purger.from_config(db, expiry).run_once()
+    print(f"Purged {purged} expired entries, archived {archived} entries.")
+    db.close_connection()
@@ -0,0 +1,243 @@
+# This Source Code Form is subject to the terms of the Mozilla Public
+# License, v. 2.0. If a copy of the MPL was not distributed with this
+# file, You can obtain one at http://mozilla.org/MPL/2.0/.
+
+"""
+Online resharding, moves rows to the shards added in `new_shards`.
+
+    python reshard.py --chunk-size 1000 --pause 0.1
+
+1. List the shards to add in `new_shards` of the `[database]` section
+   and restart the API servers. They now write to the new map and read
+   from both maps.
+2. Run this module. Every shard is scanned in chunks, rows belonging to
+   another shard under the new map are copied there and then deleted.
+   Copying before deleting keeps every row readable throughout, and
+   running it again resumes where it stopped.
+3. Append `new_shards` to `shards`, empty `new_shards` and restart the
+   API servers.
+
+Going from a single database to shards starts the same way, and also
+builds the digest index of the rows already stored. Shards are only
+ever added, jump hash moves rows from existing shards to new ones only.
+Access dates updated on a row between its copy and its deletion are
+lost.
+"""
+
+import time
+from mariadb_client import ENTRY_COLUMNS
+from sharded_client import ShardedDBClient
+
+def scan(shard, table, key, columns, chunk_size):
+    """
+    Stream chunks of rows of `table`, keyset-paginated on `key`, one or
+    more columns leading `columns`.
+    """
+    width = len(key.split(", "))
+    last = None
+    while True:
+        with shard.pool.connection() as connection:
+            cursor = connection.cursor()
+            if last is None:
+                cursor.execute(
+                    f"SELECT {columns} FROM {table} ORDER BY {key} LIMIT ?", (chunk_size,))
+            else:
+                placeholders = ", ".join("?" * width)
+                cursor.execute(
+                    f"SELECT {columns} FROM {table} WHERE ({key}) > ({placeholders}) ORDER BY {key} LIMIT ?",
+                    last + (chunk_size,))
+            rows = cursor.fetchall()
+            cursor.close()
+        if len(rows) == 0:
+            return
+        yield rows
+        if len(rows) < chunk_size:
+            return
+        last = tuple(rows[-1][:width])
+
+def copy_rows(target, cmd, rows):
+    with target.pool.connection() as connection:
+        cursor = connection.cursor()
+        cursor.executemany(cmd, rows)
+        connection.commit()
+        cursor.close()
+
+def delete_rows(source, table, key, values):
+    """Delete rows where `key` is one of `values`, tuples if `key` has more than one column."""
+    width = len(key.split(", "))
+    if width > 1:
+        placeholders = ", ".join([f"({', '.join('?' * width)})"] * len(values))
+        values = [value for row in values for value in row]
+    else:
+        placeholders = ", ".join("?" * len(values))
+    with source.pool.connection() as connection:
+        cursor = connection.cursor()
+        cursor.execute(f"DELETE FROM {table} WHERE ({key}) IN ({placeholders})", tuple(values))
+        connection.commit()
+        cursor.close()
+
+def move_entries(db, chunk_size=1000, pause=0):
+    """
+    Move `uri` rows to the shard of their id.
+
+    Return
+    int: Number of rows moved
+    """
+    moved = 0
+    placeholders = ", ".join("?" * len(ENTRY_COLUMNS.split(", ")))
+    cmd = f"INSERT IGNORE INTO uri ({ENTRY_COLUMNS}) VALUES ({placeholders})"
+    for index, shard in enumerate(db.shards):
+        for rows in scan(shard, "uri", "id", ENTRY_COLUMNS, chunk_size):
+            targets = {}
+            for row in rows:
+                target = db.id_shard(row[0])
+                if target != index:
+                    targets.setdefault(target, []).append(row)
+            for target, target_rows in targets.items():
+                copy_rows(db.shards[target], cmd, target_rows)
+                copied = {entry.id for entry in db.shards[target].get_entries_from_ids(
+                    [row[0] for row in target_rows])}
+                conflicts = [row[:4] + (None,) + row[5:] for row in target_rows if not row[0] in copied]
+                if len(conflicts) > 0:
+                    # URI shortened again on the target since, keep both ids
+                    # and the digest on the target's entry, like db_migration.py
+                    copy_rows(db.shards[target], cmd, conflicts)
+                delete_rows(shard, "uri", "id", [row[0] for row in target_rows])
+                moved += len(target_rows)
+            time.sleep(pause)
+        print(f"Shard {index}: {moved} entries moved so far.")
+    return moved
+
+def move_archive(db, chunk_size=1000, pause=0):
+    """
+    Move `uri_archive` rows to the shard of their id.
+
+    Return
+    int: Number of rows moved
+    """
+    moved = 0
+    columns = "id, original_uri, sha256, created_on, last_accessed, archived_on"
+    cmd = f"INSERT IGNORE INTO uri_archive ({columns}) VALUES (?, ?, ?, ?, ?, ?)"
+    for index, shard in enumerate(db.shards):
+        if not shard.archive:
+            continue
+        for rows in scan(shard, "uri_archive", "id", columns, chunk_size):
+            targets = {}
+            for row in rows:
+                target = db.id_shard(row[0])
+                if target != index:
+                    targets.setdefault(target, []).append(row)
+            for target, target_rows in targets.items():
+                if not db.shards[target].archive:
+                    db.shards[target].create_archive_table()
+                    db.shards[target].archive = True
+                copy_rows(db.shards[target], cmd, target_rows)
+                delete_rows(shard, "uri_archive", "id", [row[0] for row in target_rows])
+                moved += len(target_rows)
+            time.sleep(pause)
+        print(f"Shard {index}: {moved} archived entries moved so far.")
+    return moved
+
+def move_clicks(db, chunk_size=1000, pause=0):
+    """
+    Move `uri_clicks` rows to the shard of their id, adding to the counts
+    made there since the new shards were configured. Counts of a chunk
+    copied but not deleted when interrupted are counted twice.
+
+    Return
+    int: Number of rows moved
+    """
+    moved = 0
+    cmd = "INSERT INTO uri_clicks (id, day, count) VALUES (?, ?, ?) \
+        ON DUPLICATE KEY UPDATE count=count + VALUES(count)"
+    for index, shard in enumerate(db.shards):
+        for rows in scan(shard, "uri_clicks", "id, day", "id, day, count", chunk_size):
+            targets = {}
+            for row in rows:
+                target = db.id_shard(row[0])
+                if target != index:
+                    targets.setdefault(target, []).append(row)
+            for target, target_rows in targets.items():
+                copy_rows(db.shards[target], cmd, target_rows)
+                delete_rows(shard, "uri_clicks", "id, day", [row[:2] for row in target_rows])
+                moved += len(target_rows)
+            time.sleep(pause)
+        print(f"Shard {index}: {moved} click counts moved so far.")
+    return moved
+
+def move_digests(db, chunk_size=1000, pause=0):
+    """
+    Move `uri_digest` rows to the shard of their digest. Where the new
+    shard already indexes the digest, the older index entry wins.
+
+    Return
+    int: Number of rows moved
+    """
+    moved = 0
+    cmd = "INSERT INTO uri_digest (sha256, id, created_on) VALUES (?, ?, ?) \
+        ON DUPLICATE KEY UPDATE id=IF(VALUES(created_on) < created_on, VALUES(id), id), \
+        created_on=LEAST(created_on, VALUES(created_on))"
+    for index, shard in enumerate(db.shards):
+        for rows in scan(shard, "uri_digest", "sha256", "sha256, id, created_on", chunk_size):
+            targets = {}
+            for row in rows:
+                target = db.digest_shard(bytes(row[0]))
+                if target != index:
+                    targets.setdefault(target, []).append(row)
+            for target, target_rows in targets.items():
+                copy_rows(db.shards[target], cmd, target_rows)
+                delete_rows(shard, "uri_digest", "sha256", [row[0] for row in target_rows])
+                moved += len(target_rows)
+            time.sleep(pause)
+        print(f"Shard {index}: {moved} digest index entries moved so far.")
+    return moved
+
+def index_digests(db, chunk_size=1000, pause=0):
+    """
+    Index the digest of every stored entry on the shard of its digest,
+    entries already indexed are skipped.
+
+    Return
+    int: Number of entries scanned
+    """
+    scanned = 0
+    cmd = "INSERT IGNORE INTO uri_digest (sha256, id, created_on) VALUES (?, ?, ?)"
+    for index, shard in enumerate(db.shards):
+        for rows in scan(shard, "uri", "id", "id, sha256, created_on", chunk_size):
+            targets = {}
+            for id, sha256, created_on in rows:
+                if not sha256 is None:
+                    targets.setdefault(db.digest_shard(bytes(sha256)), []).append((sha256, id, created_on))
+            for target, target_rows in targets.items():
+                copy_rows(db.shards[target], cmd, target_rows)
+            scanned += len(rows)
+            time.sleep(pause)
+        print(f"Shard {index}: {scanned} entries indexed so far.")
+    return scanned
+
+if "__main__" == __name__:
+    import argparse
+    from config_parser import ConfigParser
+    from logic import Logic
+
+    parser = argparse.ArgumentParser(description=__doc__.strip().splitlines()[0])
+    parser.add_argument("--chunk-size", type=int, default=1000, help="Rows read per query")
+    parser.add_argument("--pause", type=float, default=0.1, help="Seconds to sleep between chunks")
+    parser.add_argument("--skip-index", action="store_true",
+                        help="Skip indexing digests, when the digest index is complete")
+    args = parser.parse_args()
+
+    ConfigParser()
+    db = Logic.connect_db(ConfigParser.get_config())
+    if not isinstance(db, ShardedDBClient) or not db.resharding:
+        raise SystemExit("No new_shards configured, nothing to move.")
+
+    print(f"Resharding from {db.size} to {db.next_size} shards...")
+    if not args.skip_index:
+        index_digests(db, args.chunk_size, args.pause)
+    move_digests(db, args.chunk_size, args.pause)
+    move_entries(db, args.chunk_size, args.pause)
+    move_archive(db, args.chunk_size, args.pause)
+    move_clicks(db, args.chunk_size, args.pause)
+    print("Done, move new_shards to shards and restart the API servers.")
+    db.close_connection()
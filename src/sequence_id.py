@@ -0,0 +1,128 @@
+# This Source Code Form is subject to the terms of the Mozilla Public
+# License, v. 2.0. If a copy of the MPL was not distributed with this
+# file, You can obtain one at http://mozilla.org/MPL/2.0/.
+
+import hashlib
+import hmac
+import threading
+
+class IdSpaceExhausted(Exception):
+    """Every id of the configured length has been handed out."""
+
+class FeistelPermutation:
+    """
+    Keyed bijection on the integers [0, domain_size).
+
+    A balanced Feistel network over the smallest even number of bits
+    covering the domain, values falling outside of the domain are fed
+    through the network again (cycle walking) until they land inside it.
+    """
+
+    def __init__(self, domain_size, key, rounds=4):
+        if not isinstance(domain_size, int):
+            raise TypeError("Domain size must be an integer type.")
+        elif not isinstance(key, bytes):
+            raise TypeError("Key must be a bytes type.")
+        if domain_size < 2:
+            raise ValueError("Domain size must be at least 2.")
+        elif len(key) == 0:
+            raise ValueError("Key cannot be empty.")
+        elif rounds < 3:
+            raise ValueError("At least 3 rounds are required.")
+
+        self.domain_size = domain_size
+        self.rounds = rounds
+        self._key = key
+        self._half_bits = ((domain_size - 1).bit_length() + 1) // 2
+        self._mask = (1 << self._half_bits) - 1
+
+    def _round(self, i, value):
+        digest = hmac.new(
+            self._key, i.to_bytes(1, "big") + value.to_bytes(8, "big"),
+            hashlib.sha256).digest()
+        return int.from_bytes(digest[:8], "big") & self._mask
+
+    def _encrypt(self, value):
+        left, right = value >> self._half_bits, value & self._mask
+        for i in range(self.rounds):
+            left, right = right, left ^ self._round(i, right)
+        return (left << self._half_bits) | right
+
+    def _decrypt(self, value):
+        left, right = value >> self._half_bits, value & self._mask
+        for i in reversed(range(self.rounds)):
+            left, right = right ^ self._round(i, left), left
+        return (left << self._half_bits) | right
+
+    def permute(self, value):
+        self._check(value)
+        value = self._encrypt(value)
+        while value >= self.domain_size:
+            value = self._encrypt(value)
+        return value
+
+    def inverse(self, value):
+        self._check(value)
+        value = self._decrypt(value)
+        while value >= self.domain_size:
+            value = self._decrypt(value)
+        return value
+
+    def _check(self, value):
+        if not isinstance(value, int):
+            raise TypeError("Value must be an integer type.")
+        if value < 0 or value >= self.domain_size:
+            raise ValueError(f"Value must be between 0 and {self.domain_size - 1} inclusive.")
+
+class SequenceIdGenerator:
+    """
+    Collision free ids from a monotonically increasing counter.
+
+    Counter values are reserved in blocks of `block_size` through
+    `allocate_block(block_size)`, which must atomically advance a shared
+    counter and return the first value of the reserved block. Every value
+    is passed through a keyed Feistel permutation and encoded as a fixed
+    length string of `charset`, so ids never repeat but are not sequential
+    to outsiders.
+    """
+
+    def __init__(self, allocate_block, charset, id_len, key, block_size=1000):
+        if not callable(allocate_block):
+            raise TypeError("allocate_block must be callable.")
+        elif not isinstance(block_size, int):
+            raise TypeError("Block size must be an integer type.")
+        if block_size < 1:
+            raise ValueError("Block size must be greater than 0.")
+
+        self._allocate_block = allocate_block
+        self.charset = charset
+        self.id_len = id_len
+        self.block_size = block_size
+        self.permutation = FeistelPermutation(len(charset) ** id_len, key)
+        self._next = 0
+        self._end = 0 # Exclusive end of the current block
+        self._lock = threading.Lock()
+
+    def next_id(self):
+        with self._lock:
+            if self._next >= self._end:
+                self._next = self._allocate_block(self.block_size)
+                self._end = self._next + self.block_size
+            value = self._next
+            self._next += 1
+        if value >= self.permutation.domain_size:
+            raise IdSpaceExhausted("Id sequence exhausted, increase id_char_count.")
+        return SequenceIdGenerator.encode(
+            self.permutation.permute(value), self.charset, self.id_len)
+
+    @staticmethod
+    def encode(value, charset, id_len):
+        """Encode a non negative integer as a fixed length string of charset."""
+        base = len(charset)
+        chars = []
+        for _ in range(id_len):
+            value, remainder = divmod(value, base)
+            chars.append(charset[remainder])
+        if value > 0:
+            raise ValueError(f"Value does not fit in {id_len} chars.")
+        return "".join(reversed(chars))
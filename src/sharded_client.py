@@ -0,0 +1,266 @@
+# This Source Code Form is subject to the terms of the Mozilla Public
+# License, v. 2.0. If a copy of the MPL was not distributed with this
+# file, You can obtain one at http://mozilla.org/MPL/2.0/.
+
+import datetime
+import hashlib
+import itertools
+import mariadb
+from mariadb_client import DuplicateDigestError
+from entry import Entry
+from storage_backend import StorageBackend
+
+def jump_hash(key, buckets):
+    """
+    Jump consistent hash (Lamping & Veach). Growing `buckets` from n to
+    n + 1 only moves about 1 / (n + 1) of the keys, all to the new bucket.
+
+    Return
+    int: Bucket of the 64 bit `key`, in [0, buckets)
+    """
+    if buckets < 1:
+        raise ValueError("Number of buckets must be at least 1.")
+    b, j = -1, 0
+    while j < buckets:
+        b = j
+        key = (key * 2862933555777941757 + 1) & 0xFFFFFFFFFFFFFFFF
+        j = int((b + 1) * ((1 << 31) / ((key >> 33) + 1)))
+    return b
+
+def id_key(id):
+    return int.from_bytes(hashlib.blake2b(id.encode(), digest_size=8).digest(), "big")
+
+def digest_key(digest):
+    # Already uniformly distributed
+    return int.from_bytes(digest[:8], "big")
+
+class ShardedDBClient(StorageBackend):
+    """
+    `uri` table split over `DBClient` shards. Entries are stored on the
+    shard of their id, and the digest to id index (`uri_digest`) on the
+    shard of their digest, both chosen by jump hash. The digest index
+    keeps URIs unique across shards: it is written first, so a URI
+    being shortened twice fails with `DuplicateDigestError` like on a
+    single database.
+
+    While resharding, `shards` is the current map and `shards +
+    new_shards` the next one. Writes follow the next map, reads try the
+    next map first and then the current one, see `reshard.py`.
+
+    Batch inserts are not atomic across shards, `Logic` inserts one by
+    one when a batch fails, picking up entries already inserted by
+    their digest.
+    """
+
+    # Index entries without an entry after this long are left over from
+    # an interrupted insert and removed
+    DANGLING_AFTER = datetime.timedelta(seconds=60)
+
+    def __init__(self, shards, new_shards=None):
+        shards = list(shards)
+        new_shards = list(new_shards) if not new_shards is None else []
+        if len(shards) == 0:
+            raise ValueError("At least 1 shard is required.")
+
+        self.shards = shards + new_shards
+        self.size = len(shards)
+        self.next_size = len(self.shards)
+        self.dangling_removed = 0
+
+    @property
+    def resharding(self):
+        return self.next_size != self.size
+
+    def id_shard(self, id, size=None):
+        return jump_hash(id_key(id), self.next_size if size is None else size)
+
+    def digest_shard(self, digest, size=None):
+        return jump_hash(digest_key(digest), self.next_size if size is None else size)
+
+    def _previous(self, shard_of, value):
+        """Shard of `value` in the current map, None if it does not move."""
+        if not self.resharding:
+            return None
+        previous = shard_of(value, self.size)
+        return previous if previous != shard_of(value) else None
+
+    @staticmethod
+    def _group(values, shard_of):
+        groups = {}
+        for value in values:
+            if not shard_of(value) is None:
+                groups.setdefault(shard_of(value), []).append(value)
+        return groups
+
+    def get_entry_from_id(self, id):
+        return self.get_entries_from_ids([id])
+
+    def get_entries_from_ids(self, ids):
+        ids = list(dict.fromkeys(ids))
+        for id in ids:
+            Entry.is_valid_id(id)
+        entries = []
+        for shard, group in ShardedDBClient._group(ids, self.id_shard).items():
+            entries += self.shards[shard].get_entries_from_ids(group)
+
+        found = {entry.id for entry in entries}
+        missing = [id for id in ids if not id in found]
+        previous = lambda id: self._previous(self.id_shard, id)
+        for shard, group in ShardedDBClient._group(missing, previous).items():
+            entries += self.shards[shard].get_entries_from_ids(group)
+        return entries
+
+    def get_entry_from_digest(self, digest):
+        return self.get_entries_from_digests([digest])
+
+    def _get_digest_ids(self, digests):
+        """digest -> (id, created_on, shard of the index entry)"""
+        index = {}
+        for shard, group in ShardedDBClient._group(digests, self.digest_shard).items():
+            for digest, (id, created_on) in self.shards[shard].get_digest_ids(group).items():
+                index[digest] = (id, created_on, shard)
+
+        missing = [digest for digest in digests if not digest in index]
+        previous = lambda digest: self._previous(self.digest_shard, digest)
+        for shard, group in ShardedDBClient._group(missing, previous).items():
+            for digest, (id, created_on) in self.shards[shard].get_digest_ids(group).items():
+                index[digest] = (id, created_on, shard)
+        return index
+
+    def get_entries_from_digests(self, digests):
+        digests = list(dict.fromkeys(Entry.is_valid_digest(digest) for digest in digests))
+        index = self._get_digest_ids(digests)
+        entries = self.get_entries_from_ids(id for id, _, _ in index.values())
+
+        found = {entry.id for entry in entries}
+        now = datetime.datetime.now()
+        for digest, (id, created_on, shard) in index.items():
+            if not id in found and now - created_on > ShardedDBClient.DANGLING_AFTER:
+                print(f"WARNING: Removing index of digest {digest.hex()} without entry {id}.")
+                self.shards[shard].delete_digest(digest, id)
+                self.dangling_removed += 1
+        return [entry for entry in entries if entry.sha256 in index]
+
+    def create_new_entry(self, entry):
+        """
+        Index the digest, then insert the entry on the shard of its id.
+
+        Raises:
+        DuplicateDigestError: URI is already stored
+        mariadb.IntegrityError: Id is already taken
+        """
+        if not isinstance(entry, Entry):
+            raise TypeError("Not an Entry type.")
+        if not entry.expires_at is None:
+            # Stored without digest, never deduplicated
+            self._insert_entry(entry)
+            return
+        digest_shard = self.shards[self.digest_shard(entry.sha256)]
+        digest_shard.insert_digest(entry.sha256, entry.id)
+        previous = self._previous(self.digest_shard, entry.sha256)
+        if not previous is None and len(self.shards[previous].get_digest_ids([entry.sha256])) > 0:
+            # Index entry not moved yet
+            digest_shard.delete_digest(entry.sha256, entry.id)
+            raise DuplicateDigestError(f"Digest {entry.sha256.hex()} is indexed on shard {previous}.")
+        try:
+            self._insert_entry(entry)
+        except DuplicateDigestError:
+            digest_shard.delete_digest(entry.sha256, entry.id)
+            self._index_unindexed(entry.sha256)
+            raise
+        except Exception:
+            digest_shard.delete_digest(entry.sha256, entry.id)
+            raise
+
+    def _insert_entry(self, entry):
+        previous = self._previous(self.id_shard, entry.id)
+        if not previous is None and len(self.shards[previous].get_entries_from_ids([entry.id])) > 0:
+            # Not moved yet, the move would then drop the stored entry
+            raise mariadb.IntegrityError(f"Duplicate entry '{entry.id}' for key 'PRIMARY'")
+        self.shards[self.id_shard(entry.id)].create_new_entry(entry)
+
+    def _index_unindexed(self, digest):
+        """
+        A shard already stores the URI without an index entry, e.g. since
+        before the index was built, add one so that the URI is found by
+        its digest.
+        """
+        for shard in self.shards:
+            existing = shard.get_entry_from_digest(digest)
+            if len(existing) > 0:
+                try:
+                    self.shards[self.digest_shard(digest)].insert_digest(digest, existing[0].id)
+                except DuplicateDigestError:
+                    pass
+                return
+
+    def update_access_dates(self, accessed):
+        def shards_of(id):
+            previous = self._previous(self.id_shard, id)
+            return [self.id_shard(id)] if previous is None else [self.id_shard(id), previous]
+        groups = {}
+        for id, accessed_on in accessed.items():
+            for shard in shards_of(id):
+                groups.setdefault(shard, {})[id] = accessed_on
+        for shard, group in groups.items():
+            self.shards[shard].update_access_dates(group)
+
+    def add_clicks(self, clicks):
+        """Counted on the shard of the id under the new map only, never twice."""
+        groups = {}
+        for (id, day), count in clicks.items():
+            groups.setdefault(self.id_shard(id), {})[(id, day)] = count
+        for shard, group in groups.items():
+            self.shards[shard].add_clicks(group)
+
+    def get_clicks(self, id, since=None):
+        """While resharding, counts not moved yet are on the previous shard."""
+        shards = [self.id_shard(id)]
+        previous = self._previous(self.id_shard, id)
+        if not previous is None:
+            shards.append(previous)
+        total = 0
+        daily = {}
+        for shard in shards:
+            shard_total, shard_daily = self.shards[shard].get_clicks(id, since)
+            total += shard_total
+            for day, count in shard_daily:
+                daily[day] = daily.get(day, 0) + count
+        return total, sorted(daily.items())
+
+    def purge_expired(self, now, limit):
+        """Up to `limit` entries per shard."""
+        return sum(shard.purge_expired(now, limit) for shard in self.shards)
+
+    def archive_cold(self, before, limit):
+        """Up to `limit` entries per shard."""
+        return sum(shard.archive_cold(before, limit) for shard in self.shards)
+
+    def allocate_id_block(self, size, name="uri"):
+        # Counters are not sharded
+        return self.shards[0].allocate_id_block(size, name)
+
+    def load_ids(self, since=None, chunk_size=10000):
+        """Ids moving between shards may be listed twice."""
+        return itertools.chain.from_iterable(
+            shard.load_ids(since, chunk_size) for shard in self.shards)
+
+    def load_entries(self, since=None, chunk_size=10000):
+        return itertools.chain.from_iterable(
+            shard.load_entries(since, chunk_size) for shard in self.shards)
+
+    def ping(self):
+        for shard in self.shards:
+            shard.ping()
+        return True
+
+    def stats(self):
+        return {
+            "resharding": self.resharding,
+            "dangling_removed": self.dangling_removed,
+            "shards": {f"shard_{i}": shard.stats() for i, shard in enumerate(self.shards)},
+        }
+
+    def close_connection(self):
+        for shard in self.shards:
+            shard.close_connection()
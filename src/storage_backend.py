@@ -0,0 +1,126 @@
+# This Source Code Form is subject to the terms of the Mozilla Public
+# License, v. 2.0. If a copy of the MPL was not distributed with this
+# file, You can obtain one at http://mozilla.org/MPL/2.0/.
+
+from abc import ABC, abstractmethod
+from contextlib import contextmanager
+import datetime
+
+class ReadOnlyBackendError(Exception):
+    """Raised when writing to a backend that only serves retrieves."""
+
+class StorageBackend(ABC):
+    """
+    Storage used by `Logic`, selected with `backend` in the `[storage]`
+    section of the configuration.
+
+    Backends implement the abstract methods, the batch methods fall back
+    to one call per item and can be overridden with a single query.
+    Entries are returned as lists, empty if nothing matched.
+    """
+
+    # Backends that only serve retrieves, Logic disables shortening
+    read_only = False
+
+    @abstractmethod
+    def get_entry_from_id(self, id):
+        """Return list of Entry with this id."""
+
+    @abstractmethod
+    def get_entry_from_digest(self, digest):
+        """Return list of Entry with this SHA256 digest."""
+
+    @abstractmethod
+    def create_new_entry(self, entry):
+        """
+        Insert entry.
+
+        Raises:
+        DuplicateDigestError: URI is already stored
+        mariadb.IntegrityError: Id is already taken
+        ReadOnlyBackendError: Backend does not accept writes
+        """
+
+    @abstractmethod
+    def update_access_dates(self, accessed):
+        """
+        Set the last accessed time of many entries.
+
+        accessed: dict mapping id to datetime of the last access
+        """
+
+    @abstractmethod
+    def ping(self):
+        """Raise if the backend cannot serve requests."""
+
+    def get_entries_from_ids(self, ids):
+        return [entry for id in ids for entry in self.get_entry_from_id(id)]
+
+    def get_entries_from_digests(self, digests):
+        return [entry for digest in digests for entry in self.get_entry_from_digest(digest)]
+
+    def create_new_entries(self, entries):
+        for entry in entries:
+            self.create_new_entry(entry)
+
+    def update_access_date(self, id):
+        self.update_access_dates({id: datetime.datetime.now()})
+
+    @contextmanager
+    def transaction(self):
+        """
+        Unit of work, offering the write methods of the backend and
+        committing them together. Backends without transactions apply
+        each write on its own.
+        """
+        yield self
+
+    def allocate_id_block(self, size, name="uri"):
+        raise ReadOnlyBackendError(f"{type(self).__name__} cannot allocate ids.")
+
+    def add_clicks(self, clicks):
+        """
+        Add to the daily click counts.
+
+        clicks: dict mapping (id, date) to a number of clicks
+        """
+        raise NotImplementedError(f"{type(self).__name__} cannot count clicks.")
+
+    def get_clicks(self, id, since=None):
+        """
+        Return
+        tuple: (total clicks, list of (date, clicks) on or after `since` by date)
+        """
+        raise NotImplementedError(f"{type(self).__name__} cannot count clicks.")
+
+    def purge_expired(self, now, limit):
+        """
+        Delete up to `limit` entries expired at `now`.
+
+        Return
+        int: Number of entries deleted
+        """
+        raise NotImplementedError(f"{type(self).__name__} cannot purge entries.")
+
+    def archive_cold(self, before, limit):
+        """
+        Move up to `limit` entries last accessed before `before` to the
+        archive, where they are still found by id.
+
+        Return
+        int: Number of entries moved
+        """
+        raise NotImplementedError(f"{type(self).__name__} cannot archive entries.")
+
+    def load_ids(self, since=None, chunk_size=10000):
+        """
+        Stream `(id, created_on)` of every entry, or of entries created on
+        or after `since`.
+        """
+        raise NotImplementedError(f"{type(self).__name__} cannot list ids.")
+
+    def stats(self):
+        return {}
+
+    def close_connection(self):
+        pass
@@ -0,0 +1,118 @@
+# This Source Code Form is subject to the terms of the Mozilla Public
+# License, v. 2.0. If a copy of the MPL was not distributed with this
+# file, You can obtain one at http://mozilla.org/MPL/2.0/.
+
+"""
+Compare per query latency of DBClient with and without prepared statements.
+
+    python tests/bench_db_client.py --config /etc/uri_shortener/config.toml
+
+Needs the MariaDB server configured in `--config`, a local one gives the
+clearest picture since the network round trip is the same either way.
+Every query is run by a client with `statement_cache_size = 0`, sending
+statements as text like before, and by a client keeping prepared
+statements. Inserts are also timed with one commit per entry against a
+single transaction per `--batch` entries. Rows inserted by the benchmark
+are deleted at the end.
+"""
+
+import argparse
+import os, sys
+import random
+import string
+import time
+sys.path.append(os.path.abspath(""))
+from config_parser import ConfigParser
+from entry import Entry
+
+DEFAULT_CONFIG = os.path.join(os.path.dirname(os.path.abspath(__file__)), "..", "..", "sample_config.toml")
+PREFIX = "https://bench.invalid/db_client"
+
+def percentile(sorted_values, fraction):
+    """Nearest rank percentile of an already sorted list."""
+    if len(sorted_values) == 0:
+        return 0.0
+    index = max(0, min(len(sorted_values) - 1, round(fraction * len(sorted_values)) - 1))
+    return sorted_values[index]
+
+def connect(database, statement_cache_size):
+    from mariadb_client import DBClient
+    return DBClient(
+        database["user"],
+        database["password"],
+        database["host"],
+        database.get("port", 3306),
+        pool_min_size=1,
+        pool_max_size=1,
+        statement_cache_size=statement_cache_size)
+
+def new_entries(rand, count):
+    entries = []
+    for _ in range(count):
+        entry = Entry("", f"{PREFIX}/{rand.getrandbits(64):x}", None, None)
+        entry.id = "".join(rand.choices(string.ascii_letters, k=Entry.ID_CHAR_MAXLEN))
+        entries.append(entry)
+    return entries
+
+def timed(operation, iterations):
+    """Return sorted latencies of `iterations` calls of `operation(i)`."""
+    latencies = []
+    for i in range(iterations):
+        start = time.perf_counter()
+        operation(i)
+        latencies.append(time.perf_counter() - start)
+    return sorted(latencies)
+
+def report(name, mode, latencies, per=1):
+    print(f"{name:<22} {mode:<10} "
+          f"mean {sum(latencies) / len(latencies) / per * 1e6:>8,.0f} us "
+          f"p50 {percentile(latencies, 0.50) / per * 1e6:>8,.0f} us "
+          f"p99 {percentile(latencies, 0.99) / per * 1e6:>8,.0f} us")
+
+if "__main__" == __name__:
+    parser = argparse.ArgumentParser(description=__doc__.strip().splitlines()[0])
+    parser.add_argument("--config", default=DEFAULT_CONFIG)
+    parser.add_argument("--iterations", type=int, default=2000)
+    parser.add_argument("--rows", type=int, default=2000, help="Entries inserted to look up")
+    parser.add_argument("--batch", type=int, default=20, help="Entries inserted per transaction")
+    parser.add_argument("--seed", type=int, default=0)
+    args = parser.parse_args()
+
+    ConfigParser(os.path.abspath(args.config))
+    database = ConfigParser.get_config()["database"]
+    rand = random.Random(args.seed)
+    clients = {
+        "text": connect(database, 0),
+        "prepared": connect(database, database.get("statement_cache_size", 64) or 64),
+    }
+
+    stored = new_entries(rand, args.rows)
+    with clients["prepared"].transaction() as tx:
+        tx.create_new_entries(stored)
+    ids = [entry.id for entry in stored]
+
+    try:
+        for mode, db in clients.items():
+            report("get_entry_from_id", mode, timed(
+                lambda i: db.get_entry_from_id(ids[i % len(ids)]), args.iterations))
+            report("get_entries_from_ids", mode, timed(
+                lambda i: db.get_entries_from_ids(rand.sample(ids, 1 + i % 16)), args.iterations))
+
+            entries = new_entries(rand, args.iterations)
+            report("create_new_entry", mode, timed(
+                lambda i: db.create_new_entry(entries[i]), args.iterations))
+
+            batches = args.iterations // args.batch
+            entries = new_entries(rand, batches * args.batch)
+            def insert_batch(i):
+                with db.transaction() as tx:
+                    for entry in entries[i * args.batch:(i + 1) * args.batch]:
+                        tx.create_new_entry(entry)
+            report("transaction per batch", mode, timed(insert_batch, batches), args.batch)
+            print(f"{'':<22} {mode:<10} {db.stats()['statements_reused']:,} statements reused")
+    finally:
+        db = clients["text"]
+        with db.transaction() as tx:
+            tx.execute("DELETE FROM uri WHERE original_uri LIKE ?", (f"{PREFIX}/%",))
+        for db in clients.values():
+            db.close_connection()
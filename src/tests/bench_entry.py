@@ -0,0 +1,170 @@
+# This Source Code Form is subject to the terms of the Mozilla Public
+# License, v. 2.0. If a copy of the MPL was not distributed with this
+# file, You can obtain one at http://mozilla.org/MPL/2.0/.
+
+"""
+Micro benchmarks of the `Entry` normalisation pipeline.
+
+    python tests/bench_entry.py
+    python tests/bench_entry.py --save-baseline
+    python tests/bench_entry.py --threshold 0.1 --output result.json
+
+Every step runs over the same seeded corpus of long query strings, IDN
+hosts, schemeless inputs and percent encoded payloads. Throughput is the
+best of `--repeat` rounds, peak memory per call is measured in a separate
+round, tracemalloc slows allocation heavy code down a lot.
+
+Results are compared against `--baseline` if it exists, the exit code is
+1 if any step got slower, or allocates more, by more than `--threshold`.
+Throughput only compares meaningfully between runs on the same machine.
+"""
+
+import argparse
+import gc
+import json
+import os, sys
+import platform
+import random
+import string
+import time
+import tracemalloc
+sys.path.append(os.path.abspath(""))
+from entry import Entry
+
+DEFAULT_BASELINE = os.path.join(os.path.dirname(os.path.abspath(__file__)), "bench_entry_baseline.json")
+
+IDN_HOSTS = ["münchen.de", "例え.jp", "пример.рф", "bücher.example", "xn--fsqu00a.xn--0zwm56d",
+             "ουτοπία.δπθ.gr", "مثال.إختبار"]
+HOSTS = ["example.com", "www.example.org", "sub.domain.example.co.uk", "localhost:8080",
+         "192.168.0.1", "[::1]:8443"]
+PATH_CHARS = string.ascii_letters + string.digits + "-._~/"
+
+def make_corpus(size=1000, seed=0):
+    """Return `size` raw URIs as a user would submit them, spread over the input shapes."""
+    rand = random.Random(seed)
+    word = lambda n: "".join(rand.choice(string.ascii_lowercase) for _ in range(n))
+    path = lambda: "/" + "/".join(word(rand.randint(2, 10)) for _ in range(rand.randint(0, 5)))
+
+    def long_query():
+        params = "&".join(f"{word(rand.randint(1, 8))}={word(rand.randint(0, 40))}"
+                          for _ in range(rand.randint(10, 40)))
+        return f"https://{rand.choice(HOSTS)}{path()}?{params}"
+
+    def idn_host():
+        return f"https://{rand.choice(IDN_HOSTS)}{path()}?q={word(5)}#{word(4)}"
+
+    def schemeless():
+        return f"{rand.choice(HOSTS)}{path()}" + (f"?ref={word(6)}" if rand.random() < 0.5 else "")
+
+    def percent_encoded():
+        payload = "".join(f"%{rand.randrange(256):02X}" if rand.random() < 0.4
+                          else rand.choice(PATH_CHARS) for _ in range(rand.randint(20, 200)))
+        return f"http://{rand.choice(HOSTS)}/{payload}?next=%2F{word(8)}%3Fa%3D1%26b%3D2"
+
+    def unicode_path():
+        return f"https://{rand.choice(HOSTS)}/wiki/Ünïcødé_{word(6)}?title=日本語&x=<{word(3)}>"
+
+    shapes = [long_query, idn_host, schemeless, percent_encoded, unicode_path]
+    return [shapes[i % len(shapes)]() for i in range(size)]
+
+def make_steps(corpus):
+    """Return {name: (fn, inputs)}, each input is passed to fn as its only argument."""
+    parsed = [Entry.parse_uri(uri) for uri in corpus]
+    normalised = [Entry.uri_to_str(uri) for uri in parsed]
+    return {
+        "parse_uri": (Entry.parse_uri, corpus),
+        "sanitize_uri": (Entry.sanitize_uri, normalised),
+        "encode_uri": (Entry.encode_uri, parsed),
+        "uri_to_str": (Entry.uri_to_str, parsed),
+        "compute_digest": (Entry.compute_digest, normalised),
+        "Entry(...)": (lambda uri: Entry("", uri), corpus),
+    }
+
+def measure(fn, inputs, repeat):
+    for item in inputs: # Warm up
+        fn(item)
+    best = None
+    for _ in range(repeat):
+        gc.collect()
+        start = time.perf_counter()
+        for item in inputs:
+            fn(item)
+        elapsed = time.perf_counter() - start
+        best = elapsed if best is None else min(best, elapsed)
+
+    gc.collect()
+    tracemalloc.start()
+    peak_total = 0
+    for item in inputs:
+        tracemalloc.reset_peak()
+        before = tracemalloc.get_traced_memory()[0]
+        fn(item)
+        peak_total += tracemalloc.get_traced_memory()[1] - before
+    tracemalloc.stop()
+    return {
+        "ops_per_sec": len(inputs) / best,
+        "peak_bytes_per_call": peak_total / len(inputs),
+    }
+
+def compare(results, baseline, threshold):
+    """
+    Return
+    list: Description of every metric that regressed by more than threshold
+    """
+    regressions = []
+    for name, result in results.items():
+        if not name in baseline:
+            continue
+        previous = baseline[name]
+        if result["ops_per_sec"] < previous["ops_per_sec"] * (1 - threshold):
+            regressions.append(f"{name}: {result['ops_per_sec']:,.0f} ops/s, "
+                               f"baseline {previous['ops_per_sec']:,.0f} ops/s")
+        if result["peak_bytes_per_call"] > previous["peak_bytes_per_call"] * (1 + threshold):
+            regressions.append(f"{name}: {result['peak_bytes_per_call']:,.0f} B/call, "
+                               f"baseline {previous['peak_bytes_per_call']:,.0f} B/call")
+    return regressions
+
+if "__main__" == __name__:
+    parser = argparse.ArgumentParser(description=__doc__.strip().splitlines()[0])
+    parser.add_argument("--corpus-size", type=int, default=1000)
+    parser.add_argument("--seed", type=int, default=0)
+    parser.add_argument("--repeat", type=int, default=10)
+    parser.add_argument("--baseline", default=DEFAULT_BASELINE)
+    parser.add_argument("--save-baseline", action="store_true", help="Write results to --baseline")
+    parser.add_argument("--threshold", type=float, default=0.1, help="Allowed regression, 0.1 is 10%%")
+    parser.add_argument("--output", help="Write results as JSON")
+    args = parser.parse_args()
+
+    corpus = make_corpus(args.corpus_size, args.seed)
+    baseline = {}
+    if not args.save_baseline and os.path.exists(args.baseline):
+        with open(args.baseline) as f:
+            baseline = json.load(f)["results"]
+
+    results = {}
+    for name, (fn, inputs) in make_steps(corpus).items():
+        results[name] = measure(fn, inputs, args.repeat)
+        line = f"{name:<16} {results[name]['ops_per_sec']:>12,.0f} ops/s " \
+               f"{results[name]['peak_bytes_per_call']:>9,.0f} B/call peak"
+        if name in baseline:
+            change = results[name]["ops_per_sec"] / baseline[name]["ops_per_sec"] - 1
+            line += f" {change:>+8.1%} vs baseline"
+        print(line)
+
+    report = {
+        "python": platform.python_version(),
+        "machine": platform.machine(),
+        "corpus_size": args.corpus_size,
+        "seed": args.seed,
+        "results": results,
+    }
+    for path in [args.output, args.baseline if args.save_baseline else None]:
+        if not path is None:
+            with open(path, "w") as f:
+                json.dump(report, f, indent=4)
+            print(f"Results written to {path}")
+
+    regressions = compare(results, baseline, args.threshold)
+    for regression in regressions:
+        print(f"REGRESSION: {regression}")
+    sys.exit(1 if len(regressions) > 0 else 0)
@@ -0,0 +1,72 @@
+# This Source Code Form is subject to the terms of the Mozilla Public
+# License, v. 2.0. If a copy of the MPL was not distributed with this
+# file, You can obtain one at http://mozilla.org/MPL/2.0/.
+
+"""
+Compare building entries from database rows through the full `Entry`
+pipeline against the trusted `Entry.from_row` constructor.
+
+    python tests/bench_entry_rows.py --rows 1000000
+
+Throughput and memory held by the resulting list of entries are measured
+in separate runs, tracemalloc slows allocation heavy code down a lot.
+The full pipeline is slow, it is measured on the first `--pipeline-rows`
+rows only and its memory is scaled up to `--rows`.
+"""
+
+import argparse
+import gc
+import os, sys
+import time
+import tracemalloc
+from datetime import datetime
+sys.path.append(os.path.abspath(""))
+from entry import Entry
+
+def make_rows(count, distinct=1000):
+    now = datetime.now()
+    templates = []
+    for i in range(distinct):
+        entry = Entry("", f"https://example.com/path/{i}?q={i}&lang=en#top")
+        templates.append((entry.uri, entry.html_safe_uri, entry.encoded_uri, entry.sha256))
+    return [(f"{i:07d}",) + templates[i % distinct] + (now, now) for i in range(count)]
+
+def full_pipeline(rows):
+    result = []
+    for id, uri, _, _, digest, created_on, last_accessed in rows:
+        entry = Entry(id, uri, created_on, last_accessed)
+        entry.set_digest(digest)
+        result.append(entry)
+    return result
+
+def trusted_row(rows):
+    return [Entry.from_row(*row) for row in rows]
+
+def measure(name, fn, rows, total):
+    gc.collect()
+    start = time.perf_counter()
+    entries = fn(rows)
+    elapsed = time.perf_counter() - start
+    del entries
+
+    gc.collect()
+    tracemalloc.start()
+    entries = fn(rows)
+    held, _ = tracemalloc.get_traced_memory()
+    tracemalloc.stop()
+    del entries
+
+    per_entry = held / len(rows)
+    print(f"{name:<16} {len(rows) / elapsed:>12,.0f} rows/s {per_entry:>8,.0f} B/entry "
+          f"{per_entry * total / 2 ** 20:>9,.1f} MiB for {total:,} rows")
+
+if "__main__" == __name__:
+    parser = argparse.ArgumentParser(description=__doc__.strip().splitlines()[0])
+    parser.add_argument("--rows", type=int, default=1000000)
+    parser.add_argument("--pipeline-rows", type=int, default=20000)
+    args = parser.parse_args()
+
+    rows = make_rows(args.rows)
+    measure("Entry(...)", full_pipeline, rows[:args.pipeline_rows], args.rows)
+    if hasattr(Entry, "from_row"):
+        measure("Entry.from_row", trusted_row, rows, args.rows)
@@ -0,0 +1,147 @@
+# This Source Code Form is subject to the terms of the Mozilla Public
+# License, v. 2.0. If a copy of the MPL was not distributed with this
+# file, You can obtain one at http://mozilla.org/MPL/2.0/.
+
+"""
+Compare the WSGI and ASGI apps under concurrent retrieves with a slow database.
+
+    python tests/bench_wsgi_asgi.py --db-latency 0.005 --concurrency 1,8,32,128
+
+Both apps run in process on a `MemoryDBClient` that waits `--db-latency`
+seconds per query, with the cache disabled so every retrieve queries the
+database. WSGI requests run on one thread per client like a threaded
+server, each blocking while it waits. ASGI requests run as tasks of one
+event loop, waiting with `asyncio.sleep`.
+"""
+
+import argparse
+import asyncio
+import json
+import os, sys
+import random
+import threading
+import time
+sys.path.append(os.path.abspath(""))
+sys.path.append(os.path.dirname(os.path.abspath(__file__)))
+from falcon import testing
+from config_parser import ConfigParser
+from app_info import API_VERSION
+from load_test import percentile, DEFAULT_CONFIG
+
+def summary(latencies, errors, duration):
+    latencies = sorted(latencies)
+    return {
+        "requests": len(latencies),
+        "errors": errors,
+        "requests_per_sec": len(latencies) / duration,
+        "p50_ms": percentile(latencies, 0.50) * 1000,
+        "p99_ms": percentile(latencies, 0.99) * 1000,
+    }
+
+def bench_wsgi(app, ids, concurrency, duration):
+    client = testing.TestClient(app)
+    latencies = []
+    errors = [0]
+    lock = threading.Lock()
+    stop_at = time.perf_counter() + duration
+
+    def worker(worker_id):
+        rand = random.Random(worker_id)
+        local = []
+        local_errors = 0
+        while True:
+            start = time.perf_counter()
+            if start >= stop_at:
+                break
+            result = client.simulate_get(f"/api/{API_VERSION}/retrieve", params={"id": rand.choice(ids)})
+            local.append(time.perf_counter() - start)
+            if result.status_code != 200:
+                local_errors += 1
+        with lock:
+            latencies.extend(local)
+            errors[0] += local_errors
+
+    threads = [threading.Thread(target=worker, args=(i,)) for i in range(concurrency)]
+    for thread in threads:
+        thread.start()
+    for thread in threads:
+        thread.join()
+    return summary(latencies, errors[0], duration)
+
+async def bench_asgi(app, ids, concurrency, duration):
+    latencies = []
+    errors = 0
+    stop_at = time.perf_counter() + duration
+
+    async with testing.ASGIConductor(app) as conductor:
+        async def worker(worker_id):
+            nonlocal errors
+            rand = random.Random(worker_id)
+            while True:
+                start = time.perf_counter()
+                if start >= stop_at:
+                    break
+                result = await conductor.simulate_get(
+                    f"/api/{API_VERSION}/retrieve", params={"id": rand.choice(ids)})
+                latencies.append(time.perf_counter() - start)
+                if result.status_code != 200:
+                    errors += 1
+
+        await asyncio.gather(*[worker(i) for i in range(concurrency)])
+    return summary(latencies, errors, duration)
+
+if "__main__" == __name__:
+    parser = argparse.ArgumentParser(description=__doc__.strip().splitlines()[0])
+    parser.add_argument("--config", default=DEFAULT_CONFIG)
+    parser.add_argument("--db-latency", type=float, default=0.005, help="Seconds added to every query")
+    parser.add_argument("--concurrency", default="1,8,32,128", help="Comma separated levels")
+    parser.add_argument("--duration", type=float, default=5)
+    parser.add_argument("--preload", type=int, default=1000, help="URIs shortened before the test")
+    parser.add_argument("--output", help="Write results as JSON")
+    args = parser.parse_args()
+
+    ConfigParser(os.path.abspath(args.config))
+    import api_server
+    import asgi_server
+    from cache import LRUCache
+    from logic import Logic
+    from memory_client import MemoryDBClient, AsyncMemoryDBClient
+
+    def setup(latency):
+        db = MemoryDBClient()
+        logic = Logic(db)
+        logic.cache = LRUCache(0, 300)
+        ids = [logic.gen_new_id(f"https://preload.example/{i}").id for i in range(args.preload)]
+        db.latency = latency
+        return db, logic, ids
+
+    # The ASGI database waits asynchronously, its backend must not sleep
+    wsgi_db, wsgi_logic, wsgi_ids = setup(args.db_latency)
+    asgi_db, asgi_logic, asgi_ids = setup(0)
+    wsgi_app = api_server.create_app(wsgi_logic)
+    asgi_app = asgi_server.create_asgi_app(asgi_logic, AsyncMemoryDBClient(asgi_db, args.db_latency))
+
+    results = []
+    print(f"{'server':<6} {'clients':>7} {'requests':>9} {'req/s':>9} {'p50 ms':>8} {'p99 ms':>8}")
+    for concurrency in [int(level) for level in args.concurrency.split(",")]:
+        for server in ["wsgi", "asgi"]:
+            if server == "wsgi":
+                result = bench_wsgi(wsgi_app, wsgi_ids, concurrency, args.duration)
+            else:
+                result = asyncio.run(bench_asgi(asgi_app, asgi_ids, concurrency, args.duration))
+            result.update({"server": server, "concurrency": concurrency})
+            results.append(result)
+            print(f"{server:<6} {concurrency:>7} {result['requests']:>9,} "
+                  f"{result['requests_per_sec']:>9,.0f} {result['p50_ms']:>8.2f} {result['p99_ms']:>8.2f}")
+    wsgi_logic.close()
+    asgi_logic.close()
+
+    if not args.output is None:
+        with open(args.output, "w") as f:
+            json.dump({
+                "db_latency": args.db_latency,
+                "duration": args.duration,
+                "results": results,
+            }, f, indent=4)
+        print(f"Results written to {args.output}")
+    sys.exit(1 if any(result["errors"] > 0 for result in results) else 0)
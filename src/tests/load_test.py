@@ -0,0 +1,205 @@
+# This Source Code Form is subject to the terms of the Mozilla Public
+# License, v. 2.0. If a copy of the MPL was not distributed with this
+# file, You can obtain one at http://mozilla.org/MPL/2.0/.
+
+"""
+End to end load test of the API server, in process through the WSGI app.
+
+    python tests/load_test.py --duration 10 --concurrency 8
+    python tests/load_test.py --mix shorten=1,retrieve=8,retrieve_miss=1
+    python tests/load_test.py --db mariadb --config /etc/uri_shortener/config.toml
+
+Requests go through `api_server.create_app` with every middleware and
+resource, only the HTTP server is left out. By default the database is a
+`MemoryDBClient`, `--db-latency` adds a simulated round trip to every
+query. `--db mariadb` uses the database configured in `--config`, every
+shortened URI is stored there.
+
+Operations for `--mix`, as name=weight:
+    shorten        POST /api/v1/shorten with a new URI
+    retrieve       GET /api/v1/retrieve of an existing id
+    retrieve_miss  GET /api/v1/retrieve of an unknown id
+    redirect       GET /{id} of an existing id
+    status         GET /api/v1/status
+"""
+
+import argparse
+import json
+import os, sys
+import random
+import threading
+import time
+sys.path.append(os.path.abspath(""))
+from falcon import testing
+from config_parser import ConfigParser
+from app_info import API_VERSION
+
+DEFAULT_CONFIG = os.path.join(os.path.dirname(os.path.abspath(__file__)), "..", "..", "sample_config.toml")
+EXPECTED_STATUS = {
+    "shorten": 200,
+    "retrieve": 200,
+    "retrieve_miss": 404,
+    "redirect": 302,
+    "status": 200,
+}
+
+def parse_mix(mix):
+    """Parse "name=weight,..." into {name: weight}."""
+    weights = {}
+    for item in mix.split(","):
+        name, _, weight = item.partition("=")
+        name = name.strip()
+        if not name in EXPECTED_STATUS:
+            raise ValueError(f"Unknown operation \"{name}\".")
+        weights[name] = float(weight) if weight != "" else 1.0
+    return weights
+
+def percentile(sorted_values, fraction):
+    """Nearest rank percentile of an already sorted list."""
+    if len(sorted_values) == 0:
+        return 0.0
+    index = max(0, min(len(sorted_values) - 1, round(fraction * len(sorted_values)) - 1))
+    return sorted_values[index]
+
+class LoadTest:
+
+    def __init__(self, client, weights, ids, seed=0):
+        self._client = client
+        self._names = list(weights.keys())
+        self._weights = list(weights.values())
+        self._ids = ids # Known ids, grows with every shorten
+        self._seed = seed
+        self._lock = threading.Lock()
+        self.latencies = {name: [] for name in self._names}
+        self.errors = {name: 0 for name in self._names}
+
+    def request(self, name, rand, n):
+        if name == "shorten":
+            result = self._client.simulate_post(
+                f"/api/{API_VERSION}/shorten",
+                json={"uri": f"https://load.example/{rand.getrandbits(64):x}/{n}?q=test&lang=en"})
+            if result.status_code == 200:
+                self._ids.append(result.json["id"])
+        elif name == "retrieve":
+            result = self._client.simulate_get(
+                f"/api/{API_VERSION}/retrieve", params={"id": rand.choice(self._ids)})
+        elif name == "retrieve_miss":
+            # "~" is not in the id charset, these ids are never stored
+            result = self._client.simulate_get(
+                f"/api/{API_VERSION}/retrieve", params={"id": f"~{rand.getrandbits(32):x}"})
+        elif name == "redirect":
+            result = self._client.simulate_get(f"/{rand.choice(self._ids)}")
+        else:
+            result = self._client.simulate_get(f"/api/{API_VERSION}/status")
+        return result.status_code
+
+    def worker(self, worker_id, start_at, stop_at):
+        rand = random.Random(self._seed * 1000 + worker_id)
+        latencies = {name: [] for name in self._names}
+        errors = {name: 0 for name in self._names}
+        n = 0
+        while True:
+            now = time.perf_counter()
+            if now >= stop_at:
+                break
+            name = rand.choices(self._names, self._weights)[0]
+            status = self.request(name, rand, n)
+            n += 1
+            if now < start_at: # Warm up
+                continue
+            latencies[name].append(time.perf_counter() - now)
+            if status != EXPECTED_STATUS[name]:
+                errors[name] += 1
+        with self._lock:
+            for name in self._names:
+                self.latencies[name].extend(latencies[name])
+                self.errors[name] += errors[name]
+
+    def run(self, concurrency, duration, warmup):
+        start_at = time.perf_counter() + warmup
+        stop_at = start_at + duration
+        threads = [threading.Thread(target=self.worker, args=(i, start_at, stop_at))
+                   for i in range(concurrency)]
+        for thread in threads:
+            thread.start()
+        for thread in threads:
+            thread.join()
+
+    def report(self, duration):
+        report = {}
+        for name in self._names + ["total"]:
+            if name == "total":
+                latencies = sorted(l for values in self.latencies.values() for l in values)
+                errors = sum(self.errors.values())
+            else:
+                latencies = sorted(self.latencies[name])
+                errors = self.errors[name]
+            report[name] = {
+                "requests": len(latencies),
+                "errors": errors,
+                "requests_per_sec": len(latencies) / duration,
+                "p50_ms": percentile(latencies, 0.50) * 1000,
+                "p95_ms": percentile(latencies, 0.95) * 1000,
+                "p99_ms": percentile(latencies, 0.99) * 1000,
+            }
+        return report
+
+if "__main__" == __name__:
+    parser = argparse.ArgumentParser(description=__doc__.strip().splitlines()[0])
+    parser.add_argument("--config", default=DEFAULT_CONFIG)
+    parser.add_argument("--db", choices=["memory", "mariadb"], default="memory")
+    parser.add_argument("--db-latency", type=float, default=0, help="Seconds added to every query, memory only")
+    parser.add_argument("--mix", default="shorten=1,retrieve=8,retrieve_miss=1,status=1")
+    parser.add_argument("--concurrency", type=int, default=4)
+    parser.add_argument("--duration", type=float, default=10)
+    parser.add_argument("--warmup", type=float, default=1)
+    parser.add_argument("--preload", type=int, default=1000, help="URIs shortened before the test")
+    parser.add_argument("--seed", type=int, default=0)
+    parser.add_argument("--output", help="Write results as JSON")
+    args = parser.parse_args()
+
+    ConfigParser(os.path.abspath(args.config))
+    import api_server
+    from logic import Logic
+    db = None
+    if args.db == "memory":
+        from memory_client import MemoryDBClient
+        db = MemoryDBClient(args.db_latency)
+    logic = Logic(db)
+    client = testing.TestClient(api_server.create_app(logic))
+
+    weights = parse_mix(args.mix)
+    ids = []
+    for i in range(args.preload):
+        result = client.simulate_post(
+            f"/api/{API_VERSION}/shorten", json={"uri": f"https://preload.example/{args.seed}/{i}"})
+        if result.status_code != 200:
+            sys.exit(f"Preload failed: {result.status_code} {result.text}")
+        ids.append(result.json["id"])
+    if len(ids) == 0 and ("retrieve" in weights or "redirect" in weights):
+        sys.exit("retrieve and redirect need at least 1 preloaded URI.")
+
+    load_test = LoadTest(client, weights, ids, args.seed)
+    load_test.run(args.concurrency, args.duration, args.warmup)
+    logic.close()
+
+    report = load_test.report(args.duration)
+    print(f"{'operation':<14} {'requests':>9} {'errors':>7} {'req/s':>9} "
+          f"{'p50 ms':>8} {'p95 ms':>8} {'p99 ms':>8}")
+    for name, result in report.items():
+        print(f"{name:<14} {result['requests']:>9,} {result['errors']:>7,} "
+              f"{result['requests_per_sec']:>9,.0f} {result['p50_ms']:>8.2f} "
+              f"{result['p95_ms']:>8.2f} {result['p99_ms']:>8.2f}")
+
+    if not args.output is None:
+        with open(args.output, "w") as f:
+            json.dump({
+                "db": args.db,
+                "db_latency": args.db_latency,
+                "mix": weights,
+                "concurrency": args.concurrency,
+                "duration": args.duration,
+                "results": report,
+            }, f, indent=4)
+        print(f"Results written to {args.output}")
+    sys.exit(1 if report["total"]["errors"] > 0 else 0)
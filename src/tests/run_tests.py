@@ -2,30 +2,30 @@
 # License, v. 2.0. If a copy of the MPL was not distributed with this
 # file, You can obtain one at http://mozilla.org/MPL/2.0/.
 
-from falcon import testing
 import os, sys
 import unittest
 from test_entry import TestEntryClass
+from test_cache import TestLRUCacheClass
+from test_access_writer import TestAccessDateWriterClass
+from test_click_counter import TestClickCounterClass
+from test_connection_pool import TestConnectionPoolClass
+from test_health_monitor import TestHealthMonitorClass
+from test_id_pool import TestIdPoolClass
+from test_sequence_id import TestSequenceIdClass
+from test_uri_sanitizer import TestUriSanitizerClass
+from test_id_filter import TestIdFilterClass
+from test_api_server import TestApiServerClass
+from test_asgi_server import TestAsgiServerClass
+from test_metrics import TestMetricsClass
+from test_tracing import TestTracingClass
+from test_replicas import TestReplicasClass
+from test_sharded_client import TestShardedClientClass
+from test_prepared_statements import TestPreparedStatementsClass
+from test_embedded_backend import TestEmbeddedBackendClass
+from test_expiry import TestExpiryClass
+from test_db_migration import TestDbMigrationClass
 sys.path.append(os.path.abspath(""))
 
-# class InitTest(testing.TestCase):
-    
-#     app = main.main()
-
-#     def setUp(self):
-#         super(InitTest, self).setUp()
-
-#         # Initialize and return a `falcon.App` instance.
-#         self.app = InitTest.app
-
-
-# class TestMyApp(InitTest):
-#     def test_get_status(self):
-#         doc = {'status': 'Ok'}
-
-#         result = self.simulate_get('/api/v1/status')
-#         self.assertEqual(result.json, doc)
-        
 def test_suite():
     suite = unittest.TestSuite()
     suite.addTest(TestEntryClass("test_static_constants"))
@@ -38,6 +38,111 @@ def test_suite():
     suite.addTest(TestEntryClass("test_validate_digest"))
     suite.addTest(TestEntryClass("test_validate_datetime"))
     suite.addTest(TestEntryClass("test_manually_set_digest"))
+    suite.addTest(TestEntryClass("test_entry_from_row"))
+    suite.addTest(TestEntryClass("test_expiry"))
+    suite.addTest(TestLRUCacheClass("test_hit_and_miss"))
+    suite.addTest(TestLRUCacheClass("test_lru_eviction"))
+    suite.addTest(TestLRUCacheClass("test_ttl_expiry"))
+    suite.addTest(TestLRUCacheClass("test_disabled_cache"))
+    suite.addTest(TestLRUCacheClass("test_invalid_arguments"))
+    suite.addTest(TestAccessDateWriterClass("test_coalesce_per_id"))
+    suite.addTest(TestAccessDateWriterClass("test_flush_on_size"))
+    suite.addTest(TestAccessDateWriterClass("test_retry_after_failure"))
+    suite.addTest(TestAccessDateWriterClass("test_write_through"))
+    suite.addTest(TestClickCounterClass("test_aggregate_per_id_and_day"))
+    suite.addTest(TestClickCounterClass("test_flush_on_size"))
+    suite.addTest(TestClickCounterClass("test_retry_after_failure"))
+    suite.addTest(TestClickCounterClass("test_disabled"))
+    suite.addTest(TestClickCounterClass("test_invalid_arguments"))
+    suite.addTest(TestConnectionPoolClass("test_min_size_opened_up_front"))
+    suite.addTest(TestConnectionPoolClass("test_reuse_connection"))
+    suite.addTest(TestConnectionPoolClass("test_checkout_timeout"))
+    suite.addTest(TestConnectionPoolClass("test_waiting_thread_gets_released_connection"))
+    suite.addTest(TestConnectionPoolClass("test_unhealthy_connection_replaced"))
+    suite.addTest(TestConnectionPoolClass("test_broken_connection_discarded_on_error"))
+    suite.addTest(TestConnectionPoolClass("test_invalid_arguments"))
+    suite.addTest(TestHealthMonitorClass("test_failure_threshold"))
+    suite.addTest(TestHealthMonitorClass("test_recovery_threshold"))
+    suite.addTest(TestHealthMonitorClass("test_exception_counts_as_failure"))
+    suite.addTest(TestHealthMonitorClass("test_invalid_arguments"))
+    suite.addTest(TestIdPoolClass("test_refill_skips_taken_ids"))
+    suite.addTest(TestIdPoolClass("test_refill_respects_batch_size"))
+    suite.addTest(TestIdPoolClass("test_pop_empty_pool"))
+    suite.addTest(TestIdPoolClass("test_background_refill"))
+    suite.addTest(TestIdPoolClass("test_invalid_arguments"))
+    suite.addTest(TestSequenceIdClass("test_permutation_is_bijective"))
+    suite.addTest(TestSequenceIdClass("test_permutation_depends_on_key"))
+    suite.addTest(TestSequenceIdClass("test_permutation_not_sequential"))
+    suite.addTest(TestSequenceIdClass("test_encode"))
+    suite.addTest(TestSequenceIdClass("test_unique_ids_with_block_allocation"))
+    suite.addTest(TestSequenceIdClass("test_invalid_arguments"))
+    suite.addTest(TestUriSanitizerClass("test_matches_bleach_on_corpus"))
+    suite.addTest(TestUriSanitizerClass("test_matches_bleach_on_random_input"))
+    suite.addTest(TestUriSanitizerClass("test_plain_uri_returned_unchanged"))
+    suite.addTest(TestUriSanitizerClass("test_set_sanitizer"))
+    suite.addTest(TestUriSanitizerClass("test_logic_keeps_sanitizer"))
+    suite.addTest(TestIdFilterClass("test_bloom_no_false_negative"))
+    suite.addTest(TestIdFilterClass("test_unknown_ids_might_exist_before_build"))
+    suite.addTest(TestIdFilterClass("test_build_and_refresh"))
+    suite.addTest(TestIdFilterClass("test_rebuild_grows_capacity"))
+    suite.addTest(TestIdFilterClass("test_disabled_filter"))
+    suite.addTest(TestIdFilterClass("test_invalid_arguments"))
+    suite.addTest(TestApiServerClass("test_get_status"))
+    suite.addTest(TestApiServerClass("test_shorten_and_retrieve"))
+    suite.addTest(TestApiServerClass("test_shorten_uri_of_other_process"))
+    suite.addTest(TestApiServerClass("test_redirect"))
+    suite.addTest(TestApiServerClass("test_shorten_batch"))
+    suite.addTest(TestApiServerClass("test_shorten_batch_errors"))
+    suite.addTest(TestApiServerClass("test_id_space_exhausted"))
+    suite.addTest(TestApiServerClass("test_shorten_batch_clash"))
+    suite.addTest(TestApiServerClass("test_retrieve_batch_errors"))
+    suite.addTest(TestApiServerClass("test_retrieve_batch_non_string_ids"))
+    suite.addTest(TestApiServerClass("test_link_stats"))
+    suite.addTest(TestApiServerClass("test_invalid_requests"))
+    suite.addTest(TestApiServerClass("test_read_only_backend"))
+    suite.addTest(TestApiServerClass("test_metrics"))
+    suite.addTest(TestAsgiServerClass("test_get_status"))
+    suite.addTest(TestAsgiServerClass("test_shorten_and_retrieve"))
+    suite.addTest(TestAsgiServerClass("test_unbuffered_access_off_loop"))
+    suite.addTest(TestAsgiServerClass("test_replicas_warned"))
+    suite.addTest(TestAsgiServerClass("test_id_space_exhausted"))
+    suite.addTest(TestMetricsClass("test_counter_and_gauge"))
+    suite.addTest(TestMetricsClass("test_histogram"))
+    suite.addTest(TestMetricsClass("test_render_stats"))
+    suite.addTest(TestMetricsClass("test_instrument_query"))
+    suite.addTest(TestTracingClass("test_timing_header"))
+    suite.addTest(TestTracingClass("test_server_timing_header"))
+    suite.addTest(TestTracingClass("test_route_rates"))
+    suite.addTest(TestTracingClass("test_slow_requests"))
+    suite.addTest(TestTracingClass("test_invalid_arguments"))
+    suite.addTest(TestReplicasClass("test_reads_spread_over_replicas"))
+    suite.addTest(TestReplicasClass("test_miss_falls_back_to_primary"))
+    suite.addTest(TestReplicasClass("test_failed_replica_skipped"))
+    suite.addTest(TestReplicasClass("test_invalid_replica"))
+    suite.addTest(TestShardedClientClass("test_jump_hash"))
+    suite.addTest(TestShardedClientClass("test_routing_and_dedupe"))
+    suite.addTest(TestShardedClientClass("test_resharding"))
+    suite.addTest(TestShardedClientClass("test_failed_insert_removes_index"))
+    suite.addTest(TestShardedClientClass("test_dangling_index_removed"))
+    suite.addTest(TestPreparedStatementsClass("test_statement_cache"))
+    suite.addTest(TestPreparedStatementsClass("test_padded_in_list"))
+    suite.addTest(TestPreparedStatementsClass("test_transaction_commits_once"))
+    suite.addTest(TestPreparedStatementsClass("test_failed_batch_undone"))
+    suite.addTest(TestPreparedStatementsClass("test_archived_ids_and_uris_taken"))
+    suite.addTest(TestEmbeddedBackendClass("test_snapshot_and_lookup"))
+    suite.addTest(TestEmbeddedBackendClass("test_incremental_sync"))
+    suite.addTest(TestEmbeddedBackendClass("test_snapshot_drops_deleted_rows"))
+    suite.addTest(TestEmbeddedBackendClass("test_source_closed_after_failure"))
+    suite.addTest(TestEmbeddedBackendClass("test_read_only"))
+    suite.addTest(TestEmbeddedBackendClass("test_invalid_arguments"))
+    suite.addTest(TestExpiryClass("test_expiring_links_not_deduplicated"))
+    suite.addTest(TestExpiryClass("test_expired_link_gone"))
+    suite.addTest(TestExpiryClass("test_purge_and_archive"))
+    suite.addTest(TestExpiryClass("test_archived_ids_and_uris_taken"))
+    suite.addTest(TestExpiryClass("test_invalid_purger"))
+    suite.addTest(TestDbMigrationClass("test_duplicates_merged"))
+    suite.addTest(TestDbMigrationClass("test_migration_rerun"))
+    suite.addTest(TestDbMigrationClass("test_duplicate_inserted_while_migrating"))
     return suite
 
 if "__main__" == __name__:
@@ -0,0 +1,69 @@
+# This Source Code Form is subject to the terms of the Mozilla Public
+# License, v. 2.0. If a copy of the MPL was not distributed with this
+# file, You can obtain one at http://mozilla.org/MPL/2.0/.
+
+import unittest
+import os, sys
+sys.path.append(os.path.abspath(""))
+from access_writer import AccessDateWriter
+from datetime import datetime
+import time
+
+
+class FakeDB:
+
+    def __init__(self):
+        self.batches = []
+        self.fail = False
+
+    def update_access_dates(self, accessed):
+        if self.fail:
+            raise RuntimeError("DB down")
+        self.batches.append(dict(accessed))
+
+
+class TestAccessDateWriterClass(unittest.TestCase):
+
+    def test_coalesce_per_id(self):
+        db = FakeDB()
+        writer = AccessDateWriter(db, 60, 100)
+        first = datetime(2021, 8, 6, 1, 0, 0)
+        last = datetime(2021, 8, 6, 1, 0, 5)
+        writer.record("abc", first)
+        writer.record("abc", last)
+        writer.record("def", first)
+        self.assertEqual(2, writer.pending())
+        writer.close()
+        self.assertEqual([{"abc": last, "def": first}], db.batches)
+        self.assertEqual(0, writer.pending())
+
+    def test_flush_on_size(self):
+        db = FakeDB()
+        writer = AccessDateWriter(db, 60, 2)
+        writer.record("abc")
+        writer.record("def")
+        # Background thread should flush without waiting for the interval
+        deadline = time.monotonic() + 2
+        while len(db.batches) == 0 and time.monotonic() < deadline:
+            time.sleep(0.01)
+        writer.close()
+        self.assertEqual(1, len(db.batches))
+        self.assertEqual({"abc", "def"}, set(db.batches[0].keys()))
+
+    def test_retry_after_failure(self):
+        db = FakeDB()
+        writer = AccessDateWriter(db, 60, 100)
+        writer.record("abc")
+        db.fail = True
+        self.assertEqual(0, writer.flush())
+        self.assertEqual(1, writer.pending())
+        db.fail = False
+        self.assertEqual(1, writer.flush())
+        writer.close()
+
+    def test_write_through(self):
+        db = FakeDB()
+        writer = AccessDateWriter(db, 0, 100)
+        writer.record("abc")
+        self.assertEqual(1, len(db.batches))
+        self.assertEqual(0, writer.pending())
@@ -0,0 +1,251 @@
+# This Source Code Form is subject to the terms of the Mozilla Public
+# License, v. 2.0. If a copy of the MPL was not distributed with this
+# file, You can obtain one at http://mozilla.org/MPL/2.0/.
+
+import unittest
+import os, sys
+import tempfile
+from unittest import mock
+from datetime import date
+sys.path.append(os.path.abspath(""))
+from falcon import testing
+from config_parser import ConfigParser
+try:
+    import api_server
+    from logic import Logic
+    from memory_client import MemoryDBClient
+    from embedded_backend import EmbeddedBackend
+    from sequence_id import IdSpaceExhausted
+except ImportError: # mariadb connector not installed
+    api_server = None
+
+
+@unittest.skipIf(api_server is None, "mariadb connector not installed.")
+class TestApiServerClass(testing.TestCase):
+
+    @classmethod
+    def setUpClass(cls):
+        ConfigParser(os.path.abspath("../sample_config.toml"))
+        cls.logic = Logic(MemoryDBClient())
+        cls.app = api_server.create_app(cls.logic)
+
+    @classmethod
+    def tearDownClass(cls):
+        cls.logic.close()
+
+    def setUp(self):
+        super().setUp()
+        self.app = TestApiServerClass.app
+
+    def test_get_status(self):
+        result = self.simulate_get("/api/v1/status")
+        self.assertEqual({"status": "Ok"}, result.json)
+
+    def test_shorten_and_retrieve(self):
+        result = self.simulate_post("/api/v1/shorten", json={"uri": "example.com/<a>"})
+        self.assertEqual(200, result.status_code)
+        self.assertEqual("https://example.com/&lt;a&gt;", result.json["html_safe_uri"])
+        id = result.json["id"]
+
+        again = self.simulate_post("/api/v1/shorten", json={"uri": " example.com/<a> "})
+        self.assertEqual(id, again.json["id"], "Same URI must map to the same id.")
+
+        result = self.simulate_get("/api/v1/retrieve", params={"id": id})
+        self.assertEqual(200, result.status_code)
+        self.assertEqual("https://example.com/<a>", result.json["raw_uri"])
+        self.assertEqual("https://example.com/%3Ca%3E", result.json["encoded_uri"])
+
+        result = self.simulate_get(f"/{id}")
+        self.assertEqual(302, result.status_code)
+        self.assertEqual("https://example.com/%3Ca%3E", result.headers["location"])
+
+    def test_shorten_uri_of_other_process(self):
+        other = Logic(TestApiServerClass.logic.db)
+        other.id_filter.stop()
+        other.id_filter.build()
+        self.app = api_server.create_app(other)
+        try:
+            first = TestApiServerClass.logic.gen_new_id("other-process.example/single")
+            result = self.simulate_post("/api/v1/shorten", json={"uri": "other-process.example/single"})
+            self.assertEqual(first.id, result.json["id"])
+            self.assertEqual(302, self.simulate_get(f"/{first.id}").status_code)
+
+            first = TestApiServerClass.logic.gen_new_id("other-process.example/batch")
+            result = self.simulate_post("/api/v1/shorten/batch", json={"uris": ["other-process.example/batch"]})
+            self.assertEqual(first.id, result.json["results"][0]["id"])
+            self.assertEqual(302, self.simulate_get(f"/{first.id}").status_code)
+        finally:
+            other.close()
+
+    def test_redirect(self):
+        id = self.simulate_post("/api/v1/shorten", json={"uri": "redirect.example/a"}).json["id"]
+        result = self.simulate_get(f"/{id}")
+        self.assertEqual(302, result.status_code)
+        self.assertEqual("public, max-age=300", result.headers["cache-control"])
+
+        with tempfile.TemporaryDirectory() as dir:
+            for name in ["features", "robots-and-crawlers.txt"]:
+                with open(os.path.join(dir, name), "w") as doc:
+                    doc.write(name)
+            preference = ConfigParser.get_config()["preference"]
+            with mock.patch.dict(preference, {"redirect_status": 301, "redirect_cache_control": ""}):
+                self.app = api_server.create_app(TestApiServerClass.logic, dir)
+            result = self.simulate_get(f"/{id}")
+            self.assertEqual(301, result.status_code)
+            self.assertEqual("https://redirect.example/a", result.headers["location"])
+            self.assertNotIn("cache-control", result.headers)
+
+            # Reserved paths and ids too long to be one are documentation
+            self.assertIn("features", preference["reserved_path"])
+            self.assertEqual("features", self.simulate_get("/features").text)
+            self.assertEqual("robots-and-crawlers.txt", self.simulate_get("/robots-and-crawlers.txt").text)
+            for path in ["/unknown", "/privacy", "/not-a-doc-nor-an-id"]:
+                with self.subTest(path=path):
+                    result = self.simulate_get(path)
+                    self.assertEqual(404, result.status_code)
+                    self.assertEqual({"msg": "ID not found."}, result.json)
+
+        self.assertRaises(ValueError, api_server.Redirect, TestApiServerClass.logic, None, 303)
+
+    def test_shorten_batch(self):
+        result = self.simulate_post("/api/v1/shorten/batch", json={"uris": ["a.example", "", "a.example"]})
+        results = result.json["results"]
+        self.assertEqual({"msg": "Invalid URI."}, results[1])
+        self.assertEqual(results[0]["id"], results[2]["id"])
+
+        result = self.simulate_get("/api/v1/retrieve/batch", params={"id": [results[0]["id"], "unknown"]})
+        self.assertEqual([True, False], [item["found"] for item in result.json["results"]])
+
+    def test_link_stats(self):
+        id = self.simulate_post("/api/v1/shorten", json={"uri": "stats.example"}).json["id"]
+        for _ in range(3):
+            self.simulate_get(f"/{id}")
+        self.simulate_get("/api/v1/retrieve/batch", params={"id": [id]})
+        TestApiServerClass.logic.click_counter.flush()
+
+        result = self.simulate_get("/api/v1/stats", params={"id": id, "days": "7"})
+        self.assertEqual(200, result.status_code)
+        self.assertEqual(4, result.json["total"])
+        self.assertEqual(7, len(result.json["days"]))
+        self.assertEqual({"date": date.today().isoformat(), "clicks": 4}, result.json["days"][-1])
+        self.assertEqual(0, sum(day["clicks"] for day in result.json["days"][:-1]))
+
+        args = [({}, 400), ({"id": id, "days": "0"}, 400), ({"id": id, "days": "367"}, 400),
+                ({"id": id, "days": "x"}, 400), ({"id": "unknown"}, 404)]
+        for params, status in args:
+            with self.subTest(params=params):
+                self.assertEqual(status, self.simulate_get("/api/v1/stats", params=params).status_code)
+
+    def test_shorten_batch_errors(self):
+        result = self.simulate_post("/api/v1/shorten/batch", json={"uris": ["b.example", "", 5, "b.example"]})
+        self.assertEqual(200, result.status_code)
+        results = result.json["results"]
+        self.assertEqual(4, len(results))
+        self.assertEqual({"msg": "Invalid URI."}, results[1])
+        self.assertEqual({"msg": "Invalid URI."}, results[2])
+        self.assertEqual(results[0]["id"], results[3]["id"])
+
+        uris = [f"c.example/{i}" for i in range(101)]
+        result = self.simulate_post("/api/v1/shorten/batch", json={"uris": uris})
+        self.assertEqual(400, result.status_code)
+        self.assertEqual({"msg": "Too many URIs, maximum is 100."}, result.json)
+
+        for body in [["b.example"], "b.example", 5, {"uris": "b.example"}]:
+            with self.subTest(body=body):
+                result = self.simulate_post("/api/v1/shorten/batch", json=body)
+                self.assertEqual(400, result.status_code)
+                self.assertEqual({"msg": "Invalid request."}, result.json)
+                self.assertEqual(400, self.simulate_post("/api/v1/shorten", json=body).status_code)
+
+    def test_id_space_exhausted(self):
+        sequence_ids = mock.Mock(next_id=mock.Mock(side_effect=IdSpaceExhausted("Id sequence exhausted.")))
+        with mock.patch.object(TestApiServerClass.logic, "sequence_ids", sequence_ids), \
+                mock.patch("builtins.print"):
+            result = self.simulate_post("/api/v1/shorten", json={"uri": "exhausted.example"})
+            self.assertEqual(503, result.status_code)
+            self.assertEqual({"msg": "Please try again later."}, result.json)
+            result = self.simulate_post("/api/v1/shorten/batch", json={"uris": ["exhausted.example"]})
+            self.assertEqual(503, result.status_code)
+
+    def test_shorten_batch_clash(self):
+        logic = TestApiServerClass.logic
+        stored = logic.gen_new_id("clash.example/stored")
+        # The stored URI is not seen by the first digest lookup, as if it
+        # was shortened by another worker in the mean time
+        lookups = [[]]
+        lookup = logic.db.get_entries_from_digests
+        side_effect = lambda digests: lookups.pop() if len(lookups) > 0 else lookup(digests)
+        with mock.patch.object(logic.db, "get_entries_from_digests", side_effect=side_effect), \
+                mock.patch.object(logic.db, "create_new_entry", wraps=logic.db.create_new_entry) as one_by_one:
+            result = self.simulate_post("/api/v1/shorten/batch", json={"uris": [
+                "clash.example/new", "clash.example/stored", "clash.example/other"]})
+        self.assertGreaterEqual(one_by_one.call_count, 3, "Bulk insert falls back to one by one.")
+        results = result.json["results"]
+        self.assertEqual(stored.id, results[1]["id"])
+        self.assertEqual(3, len({item["id"] for item in results}))
+        for item in results:
+            self.assertEqual(item["raw_uri"], logic.get_uri(item["id"]).uri)
+
+    def test_retrieve_batch_errors(self):
+        id = self.simulate_post("/api/v1/shorten", json={"uri": "d.example"}).json["id"]
+        result = self.simulate_post("/api/v1/retrieve/batch", json={"ids": [f" {id} ", "unknown", 5, "x" * 13, ""]})
+        self.assertEqual(200, result.status_code)
+        results = result.json["results"]
+        self.assertEqual([True, False, False, False, False], [item["found"] for item in results])
+        self.assertEqual("https://d.example", results[0]["raw_uri"])
+        self.assertEqual(id, results[0]["id"])
+        self.assertEqual(["ID not found.", "Invalid id.", "Invalid id.", "Invalid id."],
+                         [item["msg"] for item in results[1:]])
+
+        result = self.simulate_post("/api/v1/retrieve/batch", json={"ids": [id] * 101})
+        self.assertEqual(400, result.status_code)
+        self.assertEqual({"msg": "Too many ids, maximum is 100."}, result.json)
+        self.assertEqual(400, self.simulate_get("/api/v1/retrieve/batch").status_code)
+
+        for body in [[id], id, 5, {"ids": id}]:
+            with self.subTest(body=body):
+                result = self.simulate_post("/api/v1/retrieve/batch", json=body)
+                self.assertEqual(400, result.status_code)
+                self.assertEqual({"msg": "Invalid request."}, result.json)
+
+    def test_retrieve_batch_non_string_ids(self):
+        id = self.simulate_post("/api/v1/shorten", json={"uri": "e.example"}).json["id"]
+        ids = [{"a": 1}, id, ["x"], 5, "unknown"]
+        result = self.simulate_post("/api/v1/retrieve/batch", json={"ids": ids})
+        self.assertEqual(200, result.status_code)
+        results = result.json["results"]
+        self.assertEqual(ids, [item["id"] for item in results])
+        self.assertEqual([False, True, False, False, False], [item["found"] for item in results])
+        self.assertEqual("https://e.example", results[1]["raw_uri"])
+        self.assertEqual(["Invalid id.", "Invalid id.", "Invalid id.", "ID not found."],
+                         [item["msg"] for item in results[:1] + results[2:]])
+
+    def test_invalid_requests(self):
+        args = [("/api/v1/retrieve", {}, 400),
+                ("/api/v1/retrieve", {"id": "unknown"}, 404),
+                ("/unknown", {}, 404)]
+        for path, params, status in args:
+            with self.subTest(path=path, params=params):
+                self.assertEqual(status, self.simulate_get(path, params=params).status_code)
+        self.assertEqual(400, self.simulate_post("/api/v1/shorten", json={}).status_code)
+
+    def test_read_only_backend(self):
+        with tempfile.TemporaryDirectory() as dir:
+            logic = Logic(EmbeddedBackend(os.path.join(dir, "replica.sqlite3")))
+            self.app = api_server.create_app(logic)
+            result = self.simulate_post("/api/v1/shorten", json={"uri": "example.com"})
+            self.assertEqual(405, result.status_code)
+            result = self.simulate_get("/api/v1/retrieve", params={"id": "abc"})
+            self.assertEqual(404, result.status_code)
+            logic.close()
+
+    def test_metrics(self):
+        self.simulate_get("/api/v1/retrieve", params={"id": "unknown"})
+        result = self.simulate_get("/api/v1/metrics")
+        self.assertEqual(200, result.status_code)
+        self.assertTrue(result.headers["content-type"].startswith("text/plain; version=0.0.4"))
+        self.assertIn(
+            "uri_shortener_http_requests_total{route=\"/api/v1/retrieve\",method=\"GET\",status=\"404\"}",
+            result.text)
+        self.assertIn("uri_shortener_http_requests_in_flight 1", result.text)
+        self.assertIn("uri_shortener_cache_hits ", result.text)
@@ -0,0 +1,100 @@
+# This Source Code Form is subject to the terms of the Mozilla Public
+# License, v. 2.0. If a copy of the MPL was not distributed with this
+# file, You can obtain one at http://mozilla.org/MPL/2.0/.
+
+import asyncio
+import threading
+import unittest
+import os, sys
+from unittest import mock
+sys.path.append(os.path.abspath(""))
+from falcon import testing
+from config_parser import ConfigParser
+try:
+    import asgi_server
+    from access_writer import AccessDateWriter
+    from logic import Logic
+    from mariadb_client import DBClient
+    from sequence_id import IdSpaceExhausted
+    from memory_client import MemoryDBClient, AsyncMemoryDBClient
+except ImportError: # mariadb connector not installed
+    asgi_server = None
+
+
+@unittest.skipIf(asgi_server is None, "mariadb connector not installed.")
+class TestAsgiServerClass(unittest.TestCase):
+
+    @classmethod
+    def setUpClass(cls):
+        ConfigParser(os.path.abspath("../sample_config.toml"))
+        cls.db = MemoryDBClient()
+        cls.logic = Logic(cls.db)
+        cls.app = asgi_server.create_asgi_app(cls.logic, AsyncMemoryDBClient(cls.db))
+
+    @classmethod
+    def tearDownClass(cls):
+        cls.logic.close()
+
+    def test_get_status(self):
+        result = testing.simulate_get(TestAsgiServerClass.app, "/api/v1/status")
+        self.assertEqual({"status": "Ok"}, result.json)
+
+    def test_shorten_and_retrieve(self):
+        client = testing.TestClient(TestAsgiServerClass.app)
+        result = client.simulate_post("/api/v1/shorten", json={"uri": "example.org/<b>"})
+        self.assertEqual(200, result.status_code)
+        id = result.json["id"]
+
+        again = client.simulate_post("/api/v1/shorten", json={"uri": "example.org/<b>"})
+        self.assertEqual(id, again.json["id"], "Same URI must map to the same id.")
+
+        result = client.simulate_get("/api/v1/retrieve", params={"id": id})
+        self.assertEqual("https://example.org/<b>", result.json["raw_uri"])
+
+        result = client.simulate_get(f"/{id}")
+        self.assertEqual(302, result.status_code)
+        self.assertEqual("https://example.org/%3Cb%3E", result.headers["location"])
+
+        self.assertEqual(404, client.simulate_get("/api/v1/retrieve", params={"id": "unknown"}).status_code)
+        self.assertEqual(400, client.simulate_post("/api/v1/shorten", json={}).status_code)
+        self.assertEqual(1, len(TestAsgiServerClass.db.get_entry_from_id(id)))
+
+    def test_unbuffered_access_off_loop(self):
+        client = testing.TestClient(TestAsgiServerClass.app)
+        id = client.simulate_post("/api/v1/shorten", json={"uri": "example.org/unbuffered"}).json["id"]
+        writer = TestAsgiServerClass.logic.access_writer
+        threads = []
+        def update_access_dates(accessed):
+            threads.append(threading.current_thread())
+            self.assertRaises(RuntimeError, asyncio.get_running_loop)
+
+        TestAsgiServerClass.logic.access_writer = AccessDateWriter(TestAsgiServerClass.db, 0)
+        try:
+            with mock.patch.object(TestAsgiServerClass.db, "update_access_dates", side_effect=update_access_dates):
+                self.assertEqual(302, client.simulate_get(f"/{id}").status_code)
+        finally:
+            TestAsgiServerClass.logic.access_writer = writer
+        self.assertEqual(1, len(threads))
+        self.assertIsNot(threading.main_thread(), threads[0])
+
+    def test_replicas_warned(self):
+        logic = Logic(MemoryDBClient())
+        db = logic.db
+        for replicas, warned in [([], False), ([object()], True)]:
+            with self.subTest(replicas=replicas):
+                logic.db = mock.Mock(spec=DBClient, replicas=replicas, archive=False)
+                with mock.patch("builtins.print") as output:
+                    asgi_server.create_asgi_app(logic)
+                self.assertEqual(warned, mock.call(
+                    "WARNING: ASGI requests are served by the primary only, read replicas are not used.")
+                    in output.call_args_list)
+        logic.db = db
+        logic.close()
+
+    def test_id_space_exhausted(self):
+        sequence_ids = mock.Mock(next_id=mock.Mock(side_effect=IdSpaceExhausted("Id sequence exhausted.")))
+        with mock.patch.object(TestAsgiServerClass.logic, "sequence_ids", sequence_ids), \
+                mock.patch("builtins.print"):
+            result = testing.simulate_post(TestAsgiServerClass.app, "/api/v1/shorten", json={"uri": "exhausted.example"})
+        self.assertEqual(503, result.status_code)
+        self.assertEqual({"msg": "Please try again later."}, result.json)
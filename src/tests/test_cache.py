@@ -0,0 +1,70 @@
+# This Source Code Form is subject to the terms of the Mozilla Public
+# License, v. 2.0. If a copy of the MPL was not distributed with this
+# file, You can obtain one at http://mozilla.org/MPL/2.0/.
+
+import unittest
+import os, sys
+sys.path.append(os.path.abspath(""))
+from cache import LRUCache
+
+
+class FakeClock:
+
+    def __init__(self):
+        self.now = 0.0
+
+    def __call__(self):
+        return self.now
+
+
+class TestLRUCacheClass(unittest.TestCase):
+
+    def setUp(self):
+        self.clock = FakeClock()
+
+    def test_hit_and_miss(self):
+        cache = LRUCache(2, 10, clock=self.clock)
+        self.assertIsNone(cache.get("abc"))
+        cache.put("abc", "value")
+        self.assertEqual("value", cache.get("abc"))
+        stats = cache.stats()
+        self.assertEqual(1, stats["hits"])
+        self.assertEqual(1, stats["misses"])
+
+    def test_lru_eviction(self):
+        cache = LRUCache(2, 10, clock=self.clock)
+        cache.put("a", 1)
+        cache.put("b", 2)
+        cache.get("a") # "b" is now the least recently used
+        cache.put("c", 3)
+        self.assertIsNone(cache.get("b"))
+        self.assertEqual(1, cache.get("a"))
+        self.assertEqual(3, cache.get("c"))
+        self.assertEqual(1, cache.stats()["evictions"])
+        self.assertEqual(2, len(cache))
+
+    def test_ttl_expiry(self):
+        cache = LRUCache(2, 10, clock=self.clock)
+        cache.put("a", 1)
+        self.clock.now = 9.9
+        self.assertEqual(1, cache.get("a"))
+        self.clock.now = 10
+        self.assertIsNone(cache.get("a"))
+        self.assertEqual(1, cache.stats()["expirations"])
+        self.assertEqual(0, len(cache))
+
+    def test_disabled_cache(self):
+        cache = LRUCache(0, 10, clock=self.clock)
+        cache.put("a", 1)
+        self.assertIsNone(cache.get("a"))
+        self.assertEqual(0, len(cache))
+
+    def test_invalid_arguments(self):
+        args = [(("1", 10), TypeError),
+                ((1, "10"), TypeError),
+                ((-1, 10), ValueError),
+                ((1, 0), ValueError)]
+        for item in args:
+            with self.subTest():
+                with self.assertRaises(item[1]):
+                    LRUCache(*item[0])
@@ -0,0 +1,89 @@
+# This Source Code Form is subject to the terms of the Mozilla Public
+# License, v. 2.0. If a copy of the MPL was not distributed with this
+# file, You can obtain one at http://mozilla.org/MPL/2.0/.
+
+import unittest
+import os, sys
+sys.path.append(os.path.abspath(""))
+from click_counter import ClickCounter
+from datetime import date
+import threading
+import time
+
+
+class FakeDB:
+
+    def __init__(self):
+        self.batches = []
+        self.fail = False
+
+    def add_clicks(self, clicks):
+        if self.fail:
+            raise RuntimeError("DB down")
+        self.batches.append(dict(clicks))
+
+
+class TestClickCounterClass(unittest.TestCase):
+
+    def test_aggregate_per_id_and_day(self):
+        db = FakeDB()
+        counter = ClickCounter(db, 60, 100, shards=4)
+        first = date(2021, 8, 6)
+        second = date(2021, 8, 7)
+        def click(id, day, times):
+            for _ in range(times):
+                counter.record(id, day)
+        threads = [threading.Thread(target=click, args=(id, day, 500))
+                   for id in ["abc", "def"] for day in [first, second, second]]
+        for thread in threads:
+            thread.start()
+        for thread in threads:
+            thread.join()
+        self.assertEqual(4, counter.pending())
+        counter.close()
+        self.assertEqual([{("abc", first): 500, ("abc", second): 1000,
+                           ("def", first): 500, ("def", second): 1000}], db.batches)
+        self.assertEqual(3000, counter.flushed)
+        self.assertEqual(0, counter.pending())
+
+    def test_flush_on_size(self):
+        db = FakeDB()
+        counter = ClickCounter(db, 60, 2, shards=1)
+        counter.record("abc")
+        counter.record("def")
+        # Background thread should flush without waiting for the interval
+        deadline = time.monotonic() + 2
+        while len(db.batches) == 0 and time.monotonic() < deadline:
+            time.sleep(0.01)
+        counter.close()
+        self.assertEqual(1, len(db.batches))
+        self.assertEqual({"abc", "def"}, {id for id, _ in db.batches[0]})
+
+    def test_retry_after_failure(self):
+        db = FakeDB()
+        counter = ClickCounter(db, 60, 100)
+        today = date.today()
+        counter.record("abc", today)
+        db.fail = True
+        self.assertEqual(0, counter.flush())
+        self.assertEqual(1, counter.flush_errors)
+        counter.record("abc", today)
+        db.fail = False
+        self.assertEqual(1, counter.flush())
+        self.assertEqual([{("abc", today): 2}], db.batches, "Counts kept and added to.")
+        counter.close()
+
+    def test_disabled(self):
+        db = FakeDB()
+        counter = ClickCounter(db, 0)
+        counter.record("abc")
+        counter.close()
+        self.assertEqual([], db.batches)
+        self.assertEqual(0, counter.pending())
+
+    def test_invalid_arguments(self):
+        args = [(("5",), TypeError), ((5, 1.5), TypeError), ((5, 10, "4"), TypeError),
+                ((-1,), ValueError), ((5, 0), ValueError), ((5, 10, 0), ValueError)]
+        for counter_args, error in args:
+            with self.subTest(args=counter_args):
+                self.assertRaises(error, ClickCounter, FakeDB(), *counter_args)
@@ -0,0 +1,108 @@
+# This Source Code Form is subject to the terms of the Mozilla Public
+# License, v. 2.0. If a copy of the MPL was not distributed with this
+# file, You can obtain one at http://mozilla.org/MPL/2.0/.
+
+import unittest
+import os, sys
+sys.path.append(os.path.abspath(""))
+from connection_pool import ConnectionPool, PoolTimeoutError
+import threading
+
+
+class FakeConnection:
+
+    def __init__(self):
+        self.healthy = True
+        self.closed = False
+        self.rolled_back = False
+
+    def ping(self):
+        if not self.healthy:
+            raise RuntimeError("Connection lost")
+
+    def rollback(self):
+        if not self.healthy:
+            raise RuntimeError("Connection lost")
+        self.rolled_back = True
+
+    def close(self):
+        self.closed = True
+
+
+class TestConnectionPoolClass(unittest.TestCase):
+
+    def setUp(self):
+        self.created = []
+
+    def connect(self):
+        connection = FakeConnection()
+        self.created.append(connection)
+        return connection
+
+    def new_pool(self, min_size=1, max_size=2, timeout=0.05):
+        return ConnectionPool(self.connect, min_size, max_size, timeout,
+                              validate=FakeConnection.ping, validation_interval=0)
+
+    def test_min_size_opened_up_front(self):
+        pool = self.new_pool(2, 4)
+        self.assertEqual(2, len(self.created))
+        self.assertEqual(2, pool.stats()["idle"])
+
+    def test_reuse_connection(self):
+        pool = self.new_pool()
+        with pool.connection() as first:
+            pass
+        with pool.connection() as second:
+            pass
+        self.assertIs(first, second)
+        self.assertEqual(1, len(self.created))
+
+    def test_checkout_timeout(self):
+        pool = self.new_pool(0, 2)
+        first = pool.acquire()
+        second = pool.acquire()
+        self.assertIsNot(first, second)
+        with self.assertRaises(PoolTimeoutError):
+            pool.acquire()
+        pool.release(first)
+        self.assertIs(first, pool.acquire())
+
+    def test_waiting_thread_gets_released_connection(self):
+        pool = self.new_pool(0, 1, timeout=2)
+        held = pool.acquire()
+        result = []
+        waiter = threading.Thread(target=lambda: result.append(pool.acquire()))
+        waiter.start()
+        pool.release(held)
+        waiter.join()
+        self.assertEqual([held], result)
+
+    def test_unhealthy_connection_replaced(self):
+        pool = self.new_pool()
+        stale = self.created[0]
+        stale.healthy = False
+        with pool.connection() as connection:
+            self.assertIsNot(stale, connection)
+        self.assertTrue(stale.closed)
+        self.assertEqual(1, pool.stats()["size"])
+
+    def test_broken_connection_discarded_on_error(self):
+        pool = self.new_pool()
+        with self.assertRaises(RuntimeError):
+            with pool.connection() as connection:
+                connection.healthy = False
+                raise RuntimeError("Query failed")
+        self.assertTrue(connection.closed)
+        self.assertEqual(0, pool.stats()["size"])
+
+    def test_invalid_arguments(self):
+        args = [((None,), TypeError),
+                ((self.connect, "1"), TypeError),
+                ((self.connect, -1), ValueError),
+                ((self.connect, 2, 1), ValueError),
+                ((self.connect, 0, 0), ValueError),
+                ((self.connect, 0, 1, -1), ValueError)]
+        for item in args:
+            with self.subTest():
+                with self.assertRaises(item[1]):
+                    ConnectionPool(*item[0])
@@ -0,0 +1,130 @@
+# This Source Code Form is subject to the terms of the Mozilla Public
+# License, v. 2.0. If a copy of the MPL was not distributed with this
+# file, You can obtain one at http://mozilla.org/MPL/2.0/.
+
+from contextlib import contextmanager
+from datetime import datetime, timedelta
+import sqlite3
+import unittest
+from unittest import mock
+import os, sys
+sys.path.append(os.path.abspath(""))
+from entry import Entry
+try:
+    import mariadb
+    from db_migration import clear_duplicate_digests, migrate_unique_digest
+except ImportError: # mariadb connector not installed
+    mariadb = None
+
+
+class SqliteCursor:
+    """Runs the statements of the digest migration on SQLite."""
+
+    def __init__(self, db):
+        self._db = db
+        self._cursor = db.connection.cursor()
+        self._rows = None
+
+    def execute(self, cmd, params=()):
+        cmd = " ".join(cmd.split())
+        self._rows = None
+        if cmd.startswith("ALTER TABLE uri MODIFY"):
+            return
+        elif cmd.startswith("ALTER TABLE uri DROP INDEX sha256"):
+            self._db.before_unique_index()
+            try:
+                self._cursor.execute("CREATE UNIQUE INDEX sha256 ON uri (sha256)")
+            except sqlite3.IntegrityError as e:
+                raise mariadb.IntegrityError(str(e))
+        elif "information_schema.STATISTICS" in cmd:
+            self._rows = [(0 if unique else 1,) for _, name, unique, *_ in
+                          self._cursor.execute("PRAGMA index_list(uri)") if name == "sha256"]
+        else:
+            self._cursor.execute(cmd, params)
+
+    def fetchall(self):
+        return self._rows if not self._rows is None else self._cursor.fetchall()
+
+    def close(self):
+        self._cursor.close()
+
+
+class SqliteDB:
+
+    def __init__(self):
+        self.connection = sqlite3.connect(":memory:", check_same_thread=False)
+        self.connection.execute(
+            "CREATE TABLE uri (id TEXT PRIMARY KEY, original_uri TEXT, sha256 BLOB, created_on TEXT)")
+        self.before_unique_index = lambda: None
+        # pool.connection() yields the object offering cursor() and commit()
+        self.pool = mock.Mock(connection=self.pool_connection)
+
+    @contextmanager
+    def pool_connection(self):
+        yield self
+
+    def insert(self, id, uri, created_on):
+        self.connection.execute("INSERT INTO uri VALUES (?, ?, ?, ?)",
+                                (id, uri, Entry(id, uri).sha256, created_on.isoformat(" ")))
+        self.connection.commit()
+
+    def rows(self):
+        return {id: (uri, sha256) for id, uri, sha256 in
+                self.connection.execute("SELECT id, original_uri, sha256 FROM uri")}
+
+    def cursor(self):
+        return SqliteCursor(self)
+
+    def commit(self):
+        self.connection.commit()
+
+
+@unittest.skipIf(mariadb is None, "mariadb connector not installed.")
+class TestDbMigrationClass(unittest.TestCase):
+
+    def setUp(self):
+        self.db = SqliteDB()
+        self.now = datetime(2021, 8, 6)
+        for i, id in enumerate(["newest", "oldest", "newer"]):
+            self.db.insert(id, "https://example.com/dup", self.now - timedelta(days=i % 2 * 10 + i))
+        self.db.insert("single", "https://example.com/single", self.now)
+        self.db.insert("other", "https://example.com/other", self.now)
+        self.db.insert("other2", "https://example.com/other", self.now)
+
+    def test_duplicates_merged(self):
+        before = self.db.rows()
+        self.assertEqual(3, clear_duplicate_digests(self.db, chunk_size=1))
+        after = self.db.rows()
+        self.assertEqual({id: uri for id, (uri, _) in before.items()},
+                         {id: uri for id, (uri, _) in after.items()}, "Every short link is kept.")
+        self.assertEqual(before["oldest"], after["oldest"])
+        self.assertEqual(before["other"], after["other"], "Same creation time, lowest id kept.")
+        self.assertEqual(["newer", "newest", "other2"],
+                         sorted(id for id, (_, sha256) in after.items() if sha256 is None))
+        self.assertEqual(0, clear_duplicate_digests(self.db))
+
+    def test_migration_rerun(self):
+        with mock.patch("builtins.print"):
+            migrate_unique_digest(self.db)
+        self.assertEqual(3, sum(sha256 is None for _, sha256 in self.db.rows().values()))
+        with self.assertRaises(sqlite3.IntegrityError):
+            self.db.insert("again", "https://example.com/dup", self.now)
+
+        rows = self.db.rows()
+        with mock.patch("builtins.print") as output:
+            migrate_unique_digest(self.db)
+        output.assert_called_once_with("sha256 is already unique, skipping.")
+        self.assertEqual(rows, self.db.rows())
+
+    def test_duplicate_inserted_while_migrating(self):
+        inserted = []
+        def insert_duplicate():
+            if len(inserted) == 0:
+                self.db.connection.execute("DROP INDEX IF EXISTS sha256")
+                self.db.insert("late", "https://example.com/single", self.now + timedelta(days=1))
+                inserted.append("late")
+        self.db.before_unique_index = insert_duplicate
+        with mock.patch("builtins.print"):
+            migrate_unique_digest(self.db)
+        self.assertIsNone(self.db.rows()["late"][1], "Cleared on the next attempt.")
+        self.assertIsNotNone(self.db.rows()["single"][1])
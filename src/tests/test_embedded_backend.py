@@ -0,0 +1,137 @@
+# This Source Code Form is subject to the terms of the Mozilla Public
+# License, v. 2.0. If a copy of the MPL was not distributed with this
+# file, You can obtain one at http://mozilla.org/MPL/2.0/.
+
+import unittest
+import os, sys
+sys.path.append(os.path.abspath(""))
+from embedded_backend import EmbeddedBackend
+from storage_backend import ReadOnlyBackendError
+from entry import Entry
+from datetime import datetime, timedelta
+import tempfile
+import time
+from unittest import mock
+
+
+class Primary:
+
+    def __init__(self):
+        self.rows = {}
+        self.accessed = {}
+        self.fail = False
+        self.closed = 0
+
+    def insert(self, id, uri, created_on):
+        entry = Entry(id, uri)
+        self.rows[id] = (id, entry.uri, entry.html_safe_uri, entry.encoded_uri,
+                         entry.sha256, created_on, created_on, None)
+        return entry
+
+    def load_entries(self, since=None):
+        if self.fail:
+            raise RuntimeError("Primary down")
+        return [row for row in self.rows.values() if since is None or row[5] >= since]
+
+    def update_access_dates(self, accessed):
+        self.accessed.update(accessed)
+
+    def close_connection(self):
+        self.closed += 1
+
+
+class TestEmbeddedBackendClass(unittest.TestCase):
+
+    def setUp(self):
+        self.dir = tempfile.TemporaryDirectory()
+        self.path = os.path.join(self.dir.name, "replica.sqlite3")
+        self.primary = Primary()
+        self.now = datetime(2024, 1, 1, 12, 0, 0)
+
+    def tearDown(self):
+        self.dir.cleanup()
+
+    def test_snapshot_and_lookup(self):
+        entry = self.primary.insert("abc", "example.com/<a>", self.now)
+        backend = EmbeddedBackend(self.path, lambda: self.primary)
+        with self.assertRaises(RuntimeError):
+            backend.ping()
+        self.assertEqual([], backend.get_entry_from_id("abc"))
+
+        self.assertEqual(1, backend.snapshot())
+        backend.ping()
+        result = backend.get_entry_from_id("abc")[0]
+        self.assertEqual(entry.uri, result.uri)
+        self.assertEqual(entry.html_safe_uri, result.html_safe_uri)
+        self.assertEqual(entry.encoded_uri, result.encoded_uri)
+        self.assertEqual(entry.sha256, result.sha256)
+        self.assertEqual(self.now, result.created_on)
+        self.assertEqual("abc", backend.get_entry_from_digest(entry.sha256)[0].id)
+        self.assertEqual([], backend.get_entry_from_id("missing"))
+        self.assertEqual([("abc", self.now)], backend.load_ids())
+
+    def test_incremental_sync(self):
+        self.primary.insert("old", "old.example", self.now - timedelta(hours=1))
+        backend = EmbeddedBackend(self.path, lambda: self.primary)
+        backend.snapshot()
+        self.primary.insert("new", "new.example", self.now)
+        # Committed late, created before the last row already copied
+        self.primary.insert("late", "late.example", self.now - timedelta(hours=1, seconds=30))
+        self.assertEqual(3, backend.sync())
+        self.assertEqual(["late", "new", "old"],
+                         sorted(entry.id for entry in backend.get_entries_from_ids(["old", "new", "late"])))
+        self.assertEqual(1, backend.sync(), "Only rows within the overlap are copied again.")
+
+        # Replica survives restarts
+        restarted = EmbeddedBackend(self.path, lambda: self.primary)
+        self.assertEqual(1, len(restarted.get_entry_from_id("late")))
+
+    def test_snapshot_drops_deleted_rows(self):
+        self.primary.insert("abc", "example.com", self.now)
+        backend = EmbeddedBackend(self.path, lambda: self.primary)
+        backend.snapshot()
+        self.assertEqual(1, len(backend.get_entry_from_id("abc")))
+        del self.primary.rows["abc"]
+        backend.snapshot()
+        self.assertEqual([], backend.get_entry_from_id("abc"))
+        self.assertEqual(2, backend.stats()["generation"])
+
+    def test_source_closed_after_failure(self):
+        self.primary.fail = True
+        connected = []
+        def connect():
+            connected.append(self.primary)
+            return self.primary
+        backend = EmbeddedBackend(self.path, connect, sync_interval=0.01)
+        with mock.patch("builtins.print"):
+            backend.start()
+            deadline = time.monotonic() + 2
+            while backend.sync_errors < 2 and time.monotonic() < deadline:
+                time.sleep(0.01)
+            backend.stop()
+        self.assertGreaterEqual(backend.sync_errors, 2)
+        self.assertEqual(len(connected), self.primary.closed, "Every dropped source is closed.")
+        backend.close_connection()
+        self.assertEqual(len(connected), self.primary.closed)
+
+    def test_read_only(self):
+        backend = EmbeddedBackend(self.path, lambda: self.primary)
+        self.assertTrue(backend.read_only)
+        with self.assertRaises(ReadOnlyBackendError):
+            backend.create_new_entry(Entry("abc", "example.com"))
+        with self.assertRaises(ReadOnlyBackendError):
+            backend.allocate_id_block(10)
+        backend.update_access_dates({"abc": self.now})
+        self.assertEqual({"abc": self.now}, self.primary.accessed)
+
+    def test_invalid_arguments(self):
+        args = [((None,), TypeError),
+                ((self.path, "source"), TypeError),
+                ((self.path, None, "1"), TypeError),
+                ((self.path, None, 0), ValueError),
+                ((self.path, None, 1, 0), ValueError),
+                ((self.path, None, 1, 1, -1), ValueError)]
+        for item in args:
+            with self.subTest():
+                with self.assertRaises(item[1]):
+                    EmbeddedBackend(*item[0])
@@ -6,7 +6,7 @@ import unittest
 import os, sys
 sys.path.append(os.path.abspath(""))
 from entry import Entry
-from datetime import datetime
+from datetime import datetime, timedelta
 from urllib.parse import SplitResult
 import secrets
 
@@ -398,3 +398,39 @@ class TestEntryClass(unittest.TestCase):
         self.assertNotEqual(old_digest, new_digest)
         expected_new = "951e655969a5fa76644ad5c207bca282b7873108821eca55fc3bd1f559d20971"
         self.assertEqual(expected_new, new_digest)
+
+    def test_entry_from_row(self):
+        digest = bytes.fromhex("951e655969a5fa76644ad5c207bca282b7873108821eca55fc3bd1f559d20971")
+        created_time = datetime.now()
+        # Stored derived forms are used as is
+        result = Entry.from_row("abc", "https://example.com/?a=1&b=2", "stored safe", "stored encoded",
+                                digest, created_time, None)
+        self.assertEqual("abc", result.id)
+        self.assertEqual("https://example.com/?a=1&b=2", result.uri)
+        self.assertEqual("stored safe", result.html_safe_uri)
+        self.assertEqual("stored encoded", result.encoded_uri)
+        self.assertEqual(digest.hex(), result.get_sha256())
+        self.assertEqual(created_time, result.created_on)
+        self.assertIsNone(result.last_accessed)
+
+        # Rows stored without derived forms are computed on first access
+        result = Entry.from_row("abc", "https://example.com/?a=1&b=2", None, None, None)
+        self.assertFalse(hasattr(result, "__dict__"), "Entry should be slotted.")
+        expected = Entry("abc", "https://example.com/?a=1&b=2")
+        self.assertEqual(expected.html_safe_uri, result.html_safe_uri)
+        self.assertEqual(expected.encoded_uri, result.encoded_uri)
+        self.assertEqual(expected.get_sha256(), result.get_sha256())
+
+        # Missing digest is computed from the URI
+        result = Entry.from_row("abc", "https://example.com/?a=1&b=2", "safe", "encoded", None)
+        self.assertEqual(expected.get_sha256(), result.get_sha256())
+
+    def test_expiry(self):
+        now = datetime.now()
+        self.assertFalse(Entry("abc", "https://example.com/").is_expired())
+        entry = Entry("abc", "https://example.com/", None, None, now + timedelta(hours=1))
+        self.assertFalse(entry.is_expired())
+        self.assertTrue(entry.is_expired(now + timedelta(hours=1)))
+        self.assertRaises(TypeError, Entry, "abc", "https://example.com/", None, None, "tomorrow")
+        result = Entry.from_row("abc", "https://example.com/", None, None, None, now, now, now)
+        self.assertTrue(result.is_expired())
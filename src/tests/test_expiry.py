@@ -0,0 +1,130 @@
+# This Source Code Form is subject to the terms of the Mozilla Public
+# License, v. 2.0. If a copy of the MPL was not distributed with this
+# file, You can obtain one at http://mozilla.org/MPL/2.0/.
+
+import datetime
+import unittest
+import os, sys
+from unittest import mock
+sys.path.append(os.path.abspath(""))
+from falcon import testing
+from config_parser import ConfigParser
+from entry import Entry
+from purger import Purger
+try:
+    import mariadb
+    import api_server
+    from logic import Logic
+    from memory_client import MemoryDBClient
+except ImportError: # mariadb connector not installed
+    api_server = None
+
+
+@unittest.skipIf(api_server is None, "mariadb connector not installed.")
+class TestExpiryClass(testing.TestCase):
+
+    @classmethod
+    def setUpClass(cls):
+        ConfigParser(os.path.abspath("../sample_config.toml"))
+
+    def setUp(self):
+        super().setUp()
+        self.db = MemoryDBClient()
+        self.logic = Logic(self.db)
+        self.app = api_server.create_app(self.logic)
+
+    def tearDown(self):
+        self.logic.close()
+
+    def expired_entry(self, uri):
+        entry = Entry("", uri, None, None, datetime.datetime.now() - datetime.timedelta(seconds=1))
+        return self.logic.insert_entry(entry)
+
+    def test_expiring_links_not_deduplicated(self):
+        result = self.simulate_post("/api/v1/shorten", json={"uri": "example.com", "expires_in": 3600})
+        self.assertEqual(200, result.status_code)
+        expires_at = datetime.datetime.fromisoformat(result.json["expires_at"])
+        self.assertAlmostEqual(3600, (expires_at - datetime.datetime.now()).total_seconds(), delta=5)
+
+        again = self.simulate_post("/api/v1/shorten", json={"uri": "example.com", "expires_in": 3600})
+        permanent = self.simulate_post("/api/v1/shorten", json={"uri": "example.com"})
+        self.assertEqual(3, len({result.json["id"], again.json["id"], permanent.json["id"]}))
+        self.assertNotIn("expires_at", permanent.json)
+        self.assertEqual(permanent.json["id"], self.logic.gen_new_id("example.com").id)
+
+        result = self.simulate_get("/api/v1/retrieve", params={"id": again.json["id"]})
+        self.assertEqual(again.json["expires_at"], result.json["expires_at"])
+        result = self.simulate_get(f"/{again.json['id']}")
+        self.assertEqual(302, result.status_code)
+        self.assertEqual("no-store", result.headers["cache-control"])
+
+        for expires_in in [0, -5, 1.5, True, "60", api_server.GenerateLink.MAX_EXPIRES_IN + 1]:
+            with self.subTest(expires_in=expires_in):
+                result = self.simulate_post("/api/v1/shorten", json={"uri": "example.com", "expires_in": expires_in})
+                self.assertEqual(400, result.status_code)
+                self.assertEqual({"msg": "Invalid expires_in."}, result.json)
+
+    def test_expired_link_gone(self):
+        entry = self.expired_entry("https://example.com/gone")
+        for path, params in [("/api/v1/retrieve", {"id": entry.id}), (f"/{entry.id}", {})]:
+            with self.subTest(path=path):
+                result = self.simulate_get(path, params=params)
+                self.assertEqual(410, result.status_code)
+                self.assertEqual({"msg": "Link expired."}, result.json)
+
+        result = self.simulate_get("/api/v1/retrieve/batch", params={"id": [entry.id]})
+        self.assertEqual([{"id": entry.id, "found": False, "msg": "Link expired."}], result.json["results"])
+        self.assertEqual(0, self.logic.access_writer.pending())
+
+    def test_purge_and_archive(self):
+        expired = [self.expired_entry(f"https://example.com/{i}") for i in range(5)]
+        self.db.add_clicks({(expired[0].id, datetime.date.today()): 3})
+        live = self.logic.gen_new_id("https://example.com/live", datetime.datetime.now() + datetime.timedelta(days=1))
+        cold = self.logic.gen_new_id("https://example.com/cold")
+
+        purger = Purger(self.db, chunk_size=2, rows_per_second=0)
+        self.assertEqual((5, 0), purger.run_once())
+        self.assertEqual([], self.db.get_entries_from_ids([entry.id for entry in expired]))
+        self.assertEqual((0, []), self.db.get_clicks(expired[0].id), "Clicks purged with the entry.")
+        self.assertEqual(1, len(self.db.get_entry_from_id(live.id)))
+
+        later = lambda: datetime.datetime.now() + datetime.timedelta(days=31)
+        purger = Purger(self.db, chunk_size=2, rows_per_second=0,
+                        archive_after=datetime.timedelta(days=30), clock=later)
+        self.assertEqual((1, 1), purger.run_once(), "Live link expired by then.")
+        self.assertEqual(1, self.db.stats()["archived"])
+        self.assertEqual({"purged": 1, "archived": 1, "runs": 1, "errors": 0},
+                         {key: value for key, value in purger.stats().items() if key != "last_run_duration"})
+
+        # Archived links still resolve
+        self.logic.cache.clear()
+        result = self.simulate_get("/api/v1/retrieve", params={"id": cold.id})
+        self.assertEqual(200, result.status_code)
+        self.assertEqual("https://example.com/cold", result.json["raw_uri"])
+
+    def test_archived_ids_and_uris_taken(self):
+        cold = self.logic.gen_new_id("https://example.com/archived")
+        later = lambda: datetime.datetime.now() + datetime.timedelta(days=31)
+        purger = Purger(self.db, rows_per_second=0, archive_after=datetime.timedelta(days=30), clock=later)
+        self.assertEqual((0, 1), purger.run_once())
+
+        # Shortening an archived URI again returns its id
+        self.assertEqual(cold.id, self.logic.gen_new_id("https://example.com/archived").id)
+        self.assertEqual(cold.id, self.logic.gen_new_ids(["https://example.com/archived"])[0].id)
+        self.assertEqual(0, self.db.stats()["rows"])
+
+        # An archived id is skipped like a stored one, e.g. a sequence id
+        with mock.patch.object(self.logic, "next_id", side_effect=[cold.id, "fresh"]):
+            entry = self.logic.gen_new_id("https://example.com/new")
+        self.assertEqual("fresh", entry.id)
+        self.assertRaises(mariadb.IntegrityError, self.db.create_new_entry,
+                          Entry(cold.id, "https://example.com/shadow"))
+        self.assertEqual("https://example.com/archived", self.logic.get_uri(cold.id).uri)
+
+    def test_invalid_purger(self):
+        args = [((0,), ValueError), ((60, 0), ValueError), ((60, 500, -1), ValueError),
+                ((60, 1.5), TypeError), ((60, 500, 1000, 30), TypeError)]
+        for purger_args, error in args:
+            with self.subTest(args=purger_args):
+                self.assertRaises(error, Purger, self.db, *purger_args)
+        self.assertIsNone(Purger.from_config(self.db, {}))
@@ -0,0 +1,52 @@
+# This Source Code Form is subject to the terms of the Mozilla Public
+# License, v. 2.0. If a copy of the MPL was not distributed with this
+# file, You can obtain one at http://mozilla.org/MPL/2.0/.
+
+import unittest
+import os, sys
+sys.path.append(os.path.abspath(""))
+from health_monitor import HealthMonitor
+
+
+class TestHealthMonitorClass(unittest.TestCase):
+
+    def setUp(self):
+        self.results = []
+        self.published = []
+
+    def check(self):
+        result = self.results.pop(0)
+        if isinstance(result, Exception):
+            raise result
+        return result
+
+    def test_failure_threshold(self):
+        monitor = HealthMonitor(self.check, 1, 3, 2)
+        monitor.add_listener(self.published.append)
+        self.results = [False, False, True, False, False, False]
+        statuses = [monitor.run_check() for _ in range(6)]
+        self.assertEqual([True, True, True, True, True, False], statuses)
+        self.assertEqual([True, False], self.published)
+
+    def test_recovery_threshold(self):
+        monitor = HealthMonitor(self.check, 1, 3, 2, healthy=False)
+        self.results = [True, False, True, True]
+        statuses = [monitor.run_check() for _ in range(4)]
+        self.assertEqual([False, False, False, True], statuses)
+
+    def test_exception_counts_as_failure(self):
+        monitor = HealthMonitor(self.check, 1, 1, 1)
+        self.results = [RuntimeError("Connection refused")]
+        self.assertFalse(monitor.run_check())
+
+    def test_invalid_arguments(self):
+        args = [((None,), TypeError),
+                ((self.check, "1"), TypeError),
+                ((self.check, 1, 1.5), TypeError),
+                ((self.check, 0), ValueError),
+                ((self.check, 1, 0), ValueError),
+                ((self.check, 1, 1, 0), ValueError)]
+        for item in args:
+            with self.subTest():
+                with self.assertRaises(item[1]):
+                    HealthMonitor(*item[0])
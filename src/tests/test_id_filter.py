@@ -0,0 +1,93 @@
+# This Source Code Form is subject to the terms of the Mozilla Public
+# License, v. 2.0. If a copy of the MPL was not distributed with this
+# file, You can obtain one at http://mozilla.org/MPL/2.0/.
+
+import unittest
+import os, sys
+sys.path.append(os.path.abspath(""))
+from id_filter import BloomFilter, IdFilter
+from datetime import datetime, timedelta
+
+
+class TestIdFilterClass(unittest.TestCase):
+
+    def setUp(self):
+        self.now = datetime(2024, 1, 1)
+        self.rows = []
+        self.loads = []
+
+    def insert(self, id, age=0):
+        self.rows.append((id, self.now - timedelta(seconds=age)))
+
+    def load_ids(self, since):
+        self.loads.append(since)
+        return [row for row in self.rows if since is None or row[1] >= since]
+
+    def test_bloom_no_false_negative(self):
+        bloom = BloomFilter(10000, 0.01)
+        ids = [f"id{i}" for i in range(10000)]
+        for id in ids:
+            bloom.add(id)
+        for id in ids:
+            self.assertIn(id, bloom)
+        false_positives = sum(f"other{i}" in bloom for i in range(10000))
+        self.assertLess(false_positives, 200, "False positive rate far above 1%.")
+        self.assertFalse(bloom.add("id0"), "Known item counted again.")
+        # Items colliding with earlier ones are not counted
+        self.assertGreater(bloom.count, 9800)
+
+    def test_unknown_ids_might_exist_before_build(self):
+        id_filter = IdFilter(self.load_ids, 100)
+        self.assertFalse(id_filter.ready())
+        self.assertTrue(id_filter.might_contain("abc"))
+        id_filter.add("abc") # No-op
+        self.assertEqual(0, id_filter.stats()["count"])
+
+    def test_build_and_refresh(self):
+        self.insert("old", age=3600)
+        self.insert("new")
+        id_filter = IdFilter(self.load_ids, 100)
+        self.assertEqual(2, id_filter.build())
+        self.assertTrue(id_filter.might_contain("old"))
+        self.assertFalse(id_filter.might_contain("missing"))
+        self.assertEqual(1, id_filter.stats()["negatives"])
+
+        # Inserted by another process, committed slightly late
+        self.insert("late", age=30)
+        self.assertEqual(0, len({"late"} - {id for id, _ in self.load_ids(self.loads[-1])}))
+        self.assertEqual(2, id_filter.refresh())
+        self.assertTrue(id_filter.might_contain("late"))
+        self.assertEqual(self.now - IdFilter.SYNC_OVERLAP, self.loads[-1])
+
+        id_filter.add("local")
+        self.assertTrue(id_filter.might_contain("local"))
+
+    def test_rebuild_grows_capacity(self):
+        for i in range(10):
+            self.insert(f"id{i}")
+        id_filter = IdFilter(self.load_ids, 4)
+        id_filter.build()
+        self.assertEqual(4, id_filter.stats()["capacity"])
+        id_filter.build()
+        self.assertGreater(id_filter.stats()["capacity"], 10)
+        for i in range(10):
+            self.assertTrue(id_filter.might_contain(f"id{i}"))
+
+    def test_disabled_filter(self):
+        id_filter = IdFilter(self.load_ids, 0)
+        id_filter.start()
+        id_filter.stop()
+        self.assertEqual([], self.loads)
+        self.assertTrue(id_filter.might_contain("abc"))
+
+    def test_invalid_arguments(self):
+        args = [((None,), TypeError),
+                ((self.load_ids, "1"), TypeError),
+                ((self.load_ids, -1), ValueError),
+                ((self.load_ids, 1, 1), TypeError),
+                ((self.load_ids, 1, 1.0), ValueError),
+                ((self.load_ids, 1, 0.1, 0), ValueError)]
+        for item in args:
+            with self.subTest():
+                with self.assertRaises(item[1]):
+                    IdFilter(*item[0])
@@ -0,0 +1,72 @@
+# This Source Code Form is subject to the terms of the Mozilla Public
+# License, v. 2.0. If a copy of the MPL was not distributed with this
+# file, You can obtain one at http://mozilla.org/MPL/2.0/.
+
+import unittest
+import os, sys
+sys.path.append(os.path.abspath(""))
+from id_pool import IdPool
+import itertools
+import time
+
+
+class TestIdPoolClass(unittest.TestCase):
+
+    def setUp(self):
+        self.counter = itertools.count()
+        self.taken = set()
+        self.queries = 0
+
+    def generate(self):
+        return f"id{next(self.counter)}"
+
+    def find_taken(self, candidates):
+        self.queries += 1
+        return {candidate for candidate in candidates if candidate in self.taken}
+
+    def test_refill_skips_taken_ids(self):
+        self.taken = {"id0", "id2"}
+        pool = IdPool(self.generate, self.find_taken, 4, 2, 4)
+        self.assertEqual(2, pool.refill())
+        self.assertEqual(1, self.queries)
+        self.assertEqual(["id1", "id3"], sorted(pool.pop_many(4)))
+        stats = pool.stats()
+        self.assertEqual(2, stats["rejected"])
+        self.assertEqual(1, stats["empty_pops"])
+
+    def test_refill_respects_batch_size(self):
+        pool = IdPool(self.generate, self.find_taken, 10, 5, 3)
+        self.assertEqual(3, pool.refill())
+        self.assertEqual(3, pool.depth())
+
+    def test_pop_empty_pool(self):
+        pool = IdPool(self.generate, self.find_taken, 0, 0, 1)
+        pool.start()
+        self.assertIsNone(pool.pop())
+        pool.stop()
+
+    def test_background_refill(self):
+        pool = IdPool(self.generate, self.find_taken, 6, 3, 2)
+        pool.start()
+        deadline = time.monotonic() + 2
+        while pool.depth() < 6 and time.monotonic() < deadline:
+            time.sleep(0.01)
+        self.assertEqual(6, pool.depth())
+        ids = pool.pop_many(4)
+        deadline = time.monotonic() + 2
+        while pool.depth() < 6 and time.monotonic() < deadline:
+            time.sleep(0.01)
+        pool.stop()
+        self.assertEqual(6, pool.depth())
+        self.assertEqual(0, len(set(ids) & set(pool.pop_many(6))))
+
+    def test_invalid_arguments(self):
+        args = [((None, self.find_taken), TypeError),
+                ((self.generate, self.find_taken, "1"), TypeError),
+                ((self.generate, self.find_taken, -1, 0), ValueError),
+                ((self.generate, self.find_taken, 1, 2), ValueError),
+                ((self.generate, self.find_taken, 1, 1, 0), ValueError)]
+        for item in args:
+            with self.subTest():
+                with self.assertRaises(item[1]):
+                    IdPool(*item[0])
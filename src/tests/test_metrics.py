@@ -0,0 +1,74 @@
+# This Source Code Form is subject to the terms of the Mozilla Public
+# License, v. 2.0. If a copy of the MPL was not distributed with this
+# file, You can obtain one at http://mozilla.org/MPL/2.0/.
+
+import asyncio
+import unittest
+import os, sys
+sys.path.append(os.path.abspath(""))
+from metrics import Registry, instrument_query, DB_QUERIES, DB_LATENCY
+
+class TestMetricsClass(unittest.TestCase):
+
+    def test_counter_and_gauge(self):
+        registry = Registry()
+        counter = registry.counter("test_total", "Test counter.", ("route", "status"))
+        gauge = registry.gauge("test_in_flight", "Test gauge.")
+        counter.inc(route="/a", status=200)
+        counter.inc(2, route="/a", status=200)
+        counter.inc(route="/b\"", status=404)
+        gauge.inc()
+        gauge.inc()
+        gauge.dec()
+        self.assertEqual(3, counter.get(route="/a", status=200))
+        self.assertRaises(ValueError, counter.inc, route="/a")
+
+        text = registry.render()
+        self.assertIn("# TYPE uri_shortener_test_total counter", text)
+        self.assertIn("uri_shortener_test_total{route=\"/a\",status=\"200\"} 3", text)
+        self.assertIn("uri_shortener_test_total{route=\"/b\\\"\",status=\"404\"} 1", text)
+        self.assertIn("uri_shortener_test_in_flight 1", text)
+        self.assertRaises(ValueError, registry.counter, "test_total", "Duplicate.")
+
+    def test_histogram(self):
+        registry = Registry()
+        histogram = registry.histogram("test_seconds", "Test histogram.", ("method",), (0.1, 1))
+        for value in [0.05, 0.1, 0.5, 2]:
+            histogram.observe(value, method="get")
+        count, total = histogram.get(method="get")
+        self.assertEqual(4, count)
+        self.assertAlmostEqual(2.65, total)
+
+        lines = registry.render().splitlines()
+        self.assertIn("uri_shortener_test_seconds_bucket{method=\"get\",le=\"0.1\"} 2", lines)
+        self.assertIn("uri_shortener_test_seconds_bucket{method=\"get\",le=\"1\"} 3", lines)
+        self.assertIn("uri_shortener_test_seconds_bucket{method=\"get\",le=\"+Inf\"} 4", lines)
+        self.assertIn("uri_shortener_test_seconds_count{method=\"get\"} 4", lines)
+
+    def test_render_stats(self):
+        text = Registry().render({"cache": {"hits": 3, "ratio": 0.5, "name": "lru"}, "ready": True})
+        self.assertIn("uri_shortener_cache_hits 3", text)
+        self.assertIn("uri_shortener_cache_ratio 0.5", text)
+        self.assertIn("uri_shortener_ready 1", text)
+        self.assertNotIn("lru", text)
+
+    def test_instrument_query(self):
+        class Client:
+            @instrument_query
+            def test_lookup(self, fail):
+                if fail:
+                    raise RuntimeError("Query failed")
+                return 1
+
+            @instrument_query
+            async def test_async_lookup(self):
+                return 2
+
+        client = Client()
+        self.assertEqual(1, client.test_lookup(False))
+        self.assertRaises(RuntimeError, client.test_lookup, True)
+        self.assertEqual(2, asyncio.run(client.test_async_lookup()))
+        self.assertEqual(1, DB_QUERIES.get(method="test_lookup", outcome="ok"))
+        self.assertEqual(1, DB_QUERIES.get(method="test_lookup", outcome="error"))
+        self.assertEqual(2, DB_LATENCY.get(method="test_lookup")[0])
+        self.assertEqual(1, DB_QUERIES.get(method="test_async_lookup", outcome="ok"))
@@ -0,0 +1,152 @@
+# This Source Code Form is subject to the terms of the Mozilla Public
+# License, v. 2.0. If a copy of the MPL was not distributed with this
+# file, You can obtain one at http://mozilla.org/MPL/2.0/.
+
+import datetime
+import unittest
+from unittest import mock
+import os, sys
+sys.path.append(os.path.abspath(""))
+from entry import Entry
+try:
+    import mariadb
+    from mariadb_client import DBClient, DuplicateDigestError, PreparedConnection
+except ImportError: # mariadb connector not installed
+    mariadb = None
+
+
+@unittest.skipIf(mariadb is None, "mariadb connector not installed.")
+class TestPreparedStatementsClass(unittest.TestCase):
+
+    def setUp(self):
+        self.connection = mock.MagicMock()
+        with mock.patch("mariadb_client.mariadb.connect", return_value=self.connection), \
+                mock.patch.object(DBClient, "has_table", side_effect=lambda name: name != "uri_archive"), \
+                mock.patch.object(DBClient, "has_column", return_value=True):
+            self.db = DBClient("user", "password")
+
+    def tearDown(self):
+        self.db.close_connection()
+
+    def test_statement_cache(self):
+        created = []
+        connection = mock.MagicMock()
+        connection.cursor.side_effect = lambda **kwargs: created.append(mock.MagicMock()) or created[-1]
+        counts = []
+        prepared = PreparedConnection(connection, 2, counts.append)
+
+        prepared.query("SELECT 1")
+        prepared.query("SELECT 1")
+        self.assertEqual(1, len(created))
+        self.assertEqual(2, created[0].execute.call_count)
+        connection.cursor.assert_called_with(prepared=True)
+        self.assertEqual([False, True], counts)
+
+        prepared.execute("SELECT 2")
+        prepared.executemany("SELECT 3", [(), ()])
+        self.assertEqual(1, created[0].close.call_count, "Least recently used statement closed.")
+        prepared.query("SELECT 2")
+        self.assertEqual(3, len(created))
+
+        created[2].execute.side_effect = mariadb.IntegrityError("Duplicate entry")
+        self.assertRaises(mariadb.IntegrityError, prepared.execute, "SELECT 3")
+        created[2].execute.side_effect = None
+        prepared.execute("SELECT 3")
+        self.assertEqual(3, len(created), "Kept after a failed statement.")
+        created[2].execute.side_effect = mariadb.OperationalError("Lost connection")
+        self.assertRaises(mariadb.OperationalError, prepared.execute, "SELECT 3")
+        created[2].execute.side_effect = None
+        prepared.execute("SELECT 3")
+        self.assertEqual(4, len(created), "Prepared again after a lost connection.")
+
+        prepared.close()
+        connection.close.assert_called_once()
+        self.assertTrue(all(cursor.close.called for cursor in created))
+
+        uncached = PreparedConnection(connection, 0)
+        uncached.query("SELECT 1")
+        uncached.query("SELECT 1")
+        self.assertEqual(6, len(created))
+        connection.cursor.assert_called_with()
+        self.assertEqual(1, created[-1].close.call_count)
+        self.assertRaises(ValueError, PreparedConnection, connection, -1)
+
+    def test_padded_in_list(self):
+        self.assertEqual(("?", ("a",)), DBClient.padded(["a"]))
+        self.assertEqual(("?, ?, ?, ?", ("a", "b", "c", "c")), DBClient.padded(["a", "b", "c"]))
+        self.assertEqual(8, len(DBClient.padded(list(range(5)))[1]))
+
+        queries = []
+        query = lambda cmd, params: queries.append(cmd) or []
+        for count in range(5, 9):
+            DBClient.select_entries(query, "id", [str(i) for i in range(count)])
+        self.assertEqual(1, len(set(queries)))
+        self.assertTrue(queries[0].startswith("SELECT id, original_uri, html_safe_uri"))
+
+    def test_transaction_commits_once(self):
+        entries = [Entry("", f"https://example.com/{i}", None, None) for i in range(3)]
+        for i, entry in enumerate(entries):
+            entry.id = f"id{i}"
+        with self.db.transaction() as tx:
+            tx.create_new_entries(entries[:2])
+            tx.create_new_entry(entries[2])
+            tx.update_access_dates({"id0": datetime.datetime.now()})
+        self.connection.commit.assert_called_once()
+        self.connection.rollback.assert_not_called()
+
+        self.connection.commit.reset_mock()
+        with self.assertRaises(RuntimeError):
+            with self.db.transaction() as tx:
+                tx.create_new_entry(entries[0])
+                raise RuntimeError("Abort")
+        self.connection.commit.assert_not_called()
+        self.connection.rollback.assert_called_once()
+
+        with self.db.transaction() as tx:
+            pass
+        self.connection.commit.assert_not_called()
+
+    def test_failed_batch_undone(self):
+        entries = [Entry("", f"https://example.com/{i}", None, None) for i in range(2)]
+        for i, entry in enumerate(entries):
+            entry.id = f"id{i}"
+        cursors = []
+        def cursor(**kwargs):
+            cursor = mock.MagicMock()
+            if kwargs.get("prepared"):
+                cursor.executemany.side_effect = mariadb.IntegrityError("Duplicate entry 'id0' for key 'PRIMARY'")
+            cursors.append(cursor)
+            return cursor
+        self.connection.cursor.side_effect = cursor
+
+        # First statement, the whole unit of work is rolled back
+        with self.db.transaction() as tx:
+            self.assertRaises(mariadb.IntegrityError, tx.create_new_entries, entries)
+        self.connection.rollback.assert_called_once()
+
+        # After other statements, only the batch is undone
+        with self.db.transaction() as tx:
+            tx.create_new_entry(entries[0])
+            self.assertRaises(mariadb.IntegrityError, tx.create_new_entries, entries)
+        text = [call.args[0] for cursor in cursors for call in cursor.execute.call_args_list
+                if "SAVEPOINT" in call.args[0]]
+        self.assertEqual(["SAVEPOINT uow_0", "ROLLBACK TO SAVEPOINT uow_0"], text)
+        self.connection.rollback.assert_called_once()
+        self.connection.commit.assert_called_once()
+
+    def test_archived_ids_and_uris_taken(self):
+        self.db.archive = True
+        entry = Entry("", "https://example.com/a", None, None)
+        entry.id = "abc"
+        cursor = self.connection.cursor.return_value
+        cursor.fetchall.return_value = [("abc", None)]
+        with self.db.transaction() as tx:
+            self.assertRaises(mariadb.IntegrityError, tx.create_new_entry, entry)
+        cursor.fetchall.return_value = [("abc", None), ("xyz", entry.sha256)]
+        with self.db.transaction() as tx:
+            self.assertRaises(DuplicateDigestError, tx.create_new_entries, [entry])
+
+        queries = [call.args[0] for call in cursor.execute.call_args_list]
+        self.assertEqual(2, len(queries), "Nothing inserted.")
+        self.assertTrue(all("uri_archive" in cmd and cmd.endswith("LOCK IN SHARE MODE") for cmd in queries))
+        self.assertEqual(("abc", entry.sha256), cursor.execute.call_args_list[0].args[1])
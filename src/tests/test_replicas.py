@@ -0,0 +1,93 @@
+# This Source Code Form is subject to the terms of the Mozilla Public
+# License, v. 2.0. If a copy of the MPL was not distributed with this
+# file, You can obtain one at http://mozilla.org/MPL/2.0/.
+
+import unittest
+from unittest import mock
+import os, sys
+sys.path.append(os.path.abspath(""))
+from entry import Entry
+try:
+    import mariadb
+    from mariadb_client import DBClient
+except ImportError: # mariadb connector not installed
+    mariadb = None
+
+
+@unittest.skipIf(mariadb is None, "mariadb connector not installed.")
+class TestReplicasClass(unittest.TestCase):
+
+    def setUp(self):
+        with mock.patch("mariadb_client.mariadb.connect"), \
+                mock.patch.object(DBClient, "has_table", return_value=True), \
+                mock.patch.object(DBClient, "has_column", return_value=True):
+            self.db = DBClient("user", "password", replicas=[
+                {"host": "replica-a"}, {"host": "replica-b", "port": 3307, "user": "reader"}])
+        self.entries = {
+            "primary": {},
+            "replica-a:3306": {},
+            "replica-b:3307": {},
+        }
+        self.pools = {id(self.db.pool): "primary"}
+        for replica in self.db.replicas:
+            self.pools[id(replica.pool)] = replica.name
+        self.queries = []
+        self.failing = set()
+        self.db._select_entries = self.select
+
+    def tearDown(self):
+        self.db.close_connection()
+
+    def select(self, pool, column, values):
+        name = self.pools[id(pool)]
+        self.queries.append((name, list(values)))
+        if name in self.failing:
+            raise mariadb.OperationalError("Connection refused")
+        return [self.entries[name][value] for value in values if value in self.entries[name]]
+
+    def store(self, uri, *names):
+        entry = Entry("", uri, None, None)
+        entry.id = uri
+        for name in names:
+            self.entries[name][entry.id] = entry
+        return entry
+
+    def test_reads_spread_over_replicas(self):
+        self.store("abc", "primary", "replica-a:3306", "replica-b:3307")
+        for _ in range(4):
+            self.assertEqual("abc", self.db.get_entry_from_id("abc")[0].id)
+        self.assertEqual(["replica-a:3306", "replica-b:3307"] * 2, [name for name, _ in self.queries])
+        self.assertEqual(["replica-a:3306", "replica-b:3307"], [replica.name for replica in self.db.replicas])
+
+    def test_miss_falls_back_to_primary(self):
+        self.store("abc", "primary", "replica-a:3306", "replica-b:3307")
+        self.store("new", "primary")
+        result = self.db.get_entries_from_ids(["abc", "new", "unknown"])
+        self.assertEqual({"abc", "new"}, {entry.id for entry in result})
+        self.assertEqual(("primary", ["new", "unknown"]), self.queries[-1])
+        self.assertEqual(2, self.db.stats()["replica_misses"])
+
+    def test_failed_replica_skipped(self):
+        self.store("abc", "primary", "replica-a:3306", "replica-b:3307")
+        self.failing.add("replica-a:3306")
+        with mock.patch("builtins.print"):
+            self.assertEqual(1, len(self.db.get_entry_from_id("abc")))
+        self.assertEqual(["replica-a:3306", "primary"], [name for name, _ in self.queries])
+        self.assertFalse(self.db.replicas[0].monitor.healthy)
+
+        self.queries.clear()
+        for _ in range(3):
+            self.db.get_entry_from_id("abc")
+        self.assertEqual(["replica-b:3307"] * 3, [name for name, _ in self.queries])
+
+        self.db.replicas[1].monitor.report_failure()
+        self.queries.clear()
+        self.db.get_entry_from_id("abc")
+        self.assertEqual(["primary"], [name for name, _ in self.queries])
+        stats = self.db.stats()["replicas"]
+        self.assertEqual(1, stats["replica_0"]["errors"])
+        self.assertFalse(stats["replica_1"]["healthy"])
+
+    def test_invalid_replica(self):
+        with mock.patch("mariadb_client.mariadb.connect"):
+            self.assertRaises(TypeError, DBClient, "user", "password", replicas=["replica-a"])
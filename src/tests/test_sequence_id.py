@@ -0,0 +1,67 @@
+# This Source Code Form is subject to the terms of the Mozilla Public
+# License, v. 2.0. If a copy of the MPL was not distributed with this
+# file, You can obtain one at http://mozilla.org/MPL/2.0/.
+
+import unittest
+import os, sys
+sys.path.append(os.path.abspath(""))
+from sequence_id import FeistelPermutation, IdSpaceExhausted, SequenceIdGenerator
+
+
+class TestSequenceIdClass(unittest.TestCase):
+
+    def setUp(self):
+        self.counter = 0
+        self.allocations = []
+
+    def allocate_block(self, size):
+        start = self.counter
+        self.counter += size
+        self.allocations.append(start)
+        return start
+
+    def test_permutation_is_bijective(self):
+        for domain_size in [2, 3, 54, 1000, 2 ** 10]:
+            with self.subTest():
+                permutation = FeistelPermutation(domain_size, b"secret")
+                permuted = [permutation.permute(i) for i in range(domain_size)]
+                self.assertEqual(list(range(domain_size)), sorted(permuted))
+                for i, value in enumerate(permuted):
+                    self.assertEqual(i, permutation.inverse(value))
+
+    def test_permutation_depends_on_key(self):
+        first = FeistelPermutation(10000, b"secret")
+        second = FeistelPermutation(10000, b"other secret")
+        self.assertNotEqual([first.permute(i) for i in range(10)],
+                            [second.permute(i) for i in range(10)])
+
+    def test_permutation_not_sequential(self):
+        permutation = FeistelPermutation(54 ** 7, b"secret")
+        permuted = [permutation.permute(i) for i in range(5)]
+        self.assertNotEqual(sorted(permuted), permuted)
+
+    def test_encode(self):
+        self.assertEqual("aaa", SequenceIdGenerator.encode(0, "ab", 3))
+        self.assertEqual("bab", SequenceIdGenerator.encode(5, "ab", 3))
+        with self.assertRaises(ValueError):
+            SequenceIdGenerator.encode(8, "ab", 3)
+
+    def test_unique_ids_with_block_allocation(self):
+        generator = SequenceIdGenerator(self.allocate_block, "abcdef", 3, b"secret", 10)
+        ids = [generator.next_id() for _ in range(6 ** 3)]
+        self.assertEqual(6 ** 3, len(set(ids)))
+        self.assertTrue(all(len(id) == 3 for id in ids))
+        self.assertEqual(list(range(0, 6 ** 3, 10)), self.allocations)
+        with self.assertRaises(IdSpaceExhausted):
+            generator.next_id()
+
+    def test_invalid_arguments(self):
+        args = [((1.5, b"secret"), TypeError),
+                ((100, "secret"), TypeError),
+                ((1, b"secret"), ValueError),
+                ((100, b""), ValueError),
+                ((100, b"secret", 2), ValueError)]
+        for item in args:
+            with self.subTest():
+                with self.assertRaises(item[1]):
+                    FeistelPermutation(*item[0])
@@ -0,0 +1,155 @@
+# This Source Code Form is subject to the terms of the Mozilla Public
+# License, v. 2.0. If a copy of the MPL was not distributed with this
+# file, You can obtain one at http://mozilla.org/MPL/2.0/.
+
+import datetime
+import unittest
+from unittest import mock
+import os, sys
+sys.path.append(os.path.abspath(""))
+from config_parser import ConfigParser
+from entry import Entry
+try:
+    import mariadb
+    from logic import Logic
+    from mariadb_client import DuplicateDigestError
+    from memory_client import MemoryDBClient
+    from sharded_client import ShardedDBClient, jump_hash
+except ImportError: # mariadb connector not installed
+    mariadb = None
+
+if not mariadb is None:
+    class MemoryShard(MemoryDBClient):
+        """MemoryDBClient with the digest index of DBClient(digest_index=True)."""
+
+        def __init__(self):
+            super().__init__()
+            self.digests = {} # sha256 -> (id, created_on)
+
+        def insert_digest(self, digest, id):
+            with self._lock:
+                if digest in self.digests:
+                    raise DuplicateDigestError("Duplicate entry for key 'PRIMARY'")
+                self.digests[digest] = (id, datetime.datetime.now())
+
+        def get_digest_ids(self, digests):
+            with self._lock:
+                return {digest: self.digests[digest] for digest in digests if digest in self.digests}
+
+        def delete_digest(self, digest, id):
+            with self._lock:
+                if self.digests.get(digest, (None,))[0] == id:
+                    del self.digests[digest]
+
+
+@unittest.skipIf(mariadb is None, "mariadb connector not installed.")
+class TestShardedClientClass(unittest.TestCase):
+
+    @classmethod
+    def setUpClass(cls):
+        ConfigParser(os.path.abspath("../sample_config.toml"))
+
+    def setUp(self):
+        self.shards = [MemoryShard() for _ in range(4)]
+        self.logics = []
+
+    def tearDown(self):
+        for logic in self.logics:
+            logic.close()
+
+    def logic(self, db):
+        logic = Logic(db)
+        self.logics.append(logic)
+        return logic
+
+    def test_jump_hash(self):
+        keys = range(0, 2 ** 64, 2 ** 50)
+        before = [jump_hash(key, 3) for key in keys]
+        after = [jump_hash(key, 4) for key in keys]
+        self.assertEqual(before, [jump_hash(key, 3) for key in keys])
+        self.assertEqual({0, 1, 2}, set(before))
+        moved = [b for a, b in zip(before, after) if a != b]
+        self.assertEqual({3}, set(moved), "Keys only move to the new bucket.")
+        self.assertAlmostEqual(0.25, len(moved) / len(before), delta=0.05)
+        self.assertEqual([0] * 10, [jump_hash(key, 1) for key in range(10)])
+        self.assertRaises(ValueError, jump_hash, 1, 0)
+
+    def test_routing_and_dedupe(self):
+        db = ShardedDBClient(self.shards[:3])
+        logic = self.logic(db)
+        entries = [logic.gen_new_id(f"https://shard.example/{i}") for i in range(60)]
+        for entry in entries:
+            self.assertEqual(1, len(self.shards[db.id_shard(entry.id)].get_entry_from_id(entry.id)))
+            self.assertEqual(entry.id, self.shards[db.digest_shard(entry.sha256)].digests[entry.sha256][0])
+        self.assertTrue(all(len(shard.digests) > 0 for shard in self.shards[:3]))
+
+        again = logic.gen_new_id("https://shard.example/7")
+        self.assertEqual(entries[7].id, again.id)
+        self.assertEqual(60, sum(len(shard.get_digest_ids(shard.digests)) for shard in self.shards))
+        self.assertEqual(entries[3].uri, logic.get_uri(entries[3].id).uri)
+
+        results = logic.gen_new_ids(["https://shard.example/1", "https://shard.example/new"])
+        self.assertEqual(entries[1].id, results[0].id)
+        self.assertEqual(results[1].id, db.get_entry_from_digest(results[1].sha256)[0].id)
+
+    def test_resharding(self):
+        logic = self.logic(ShardedDBClient(self.shards[:3]))
+        entries = [logic.gen_new_id(f"https://shard.example/{i}") for i in range(60)]
+
+        db = ShardedDBClient(self.shards[:3], self.shards[3:])
+        self.assertTrue(db.resharding)
+        ids = [entry.id for entry in entries]
+        self.assertEqual(set(ids), {entry.id for entry in db.get_entries_from_ids(ids)})
+        self.assertEqual(entries[5].id, db.get_entry_from_digest(entries[5].sha256)[0].id)
+        self.assertRaises(DuplicateDigestError, db.create_new_entry, Entry(ids[0], entries[8].uri, None, None))
+        self.assertEqual([], self.shards[3].digests.get(entries[8].sha256, []))
+
+        new_entry = Entry("", "https://shard.example/new", None, None)
+        new_entry.id = next(id for id in (f"n{i}" for i in range(100)) if db.id_shard(id) == 3)
+        db.create_new_entry(new_entry)
+        self.assertEqual(1, len(self.shards[3].get_entry_from_id(new_entry.id)))
+
+        # Id not moved yet
+        moving = next(id for id in ids if db.id_shard(id) == 3)
+        self.assertRaises(mariadb.IntegrityError, db.create_new_entry, Entry(moving, "https://shard.example/taken", None, None))
+        self.assertEqual(0, len(db.get_entry_from_digest(Entry(moving, "https://shard.example/taken", None, None).sha256)))
+
+        # Move everything as reshard.py does, then serve from the new map only
+        for index, shard in enumerate(self.shards[:3]):
+            for id, row in list(shard._rows.items()):
+                if db.id_shard(id) != index:
+                    self.shards[db.id_shard(id)]._rows[id] = row
+                    self.shards[db.id_shard(id)]._digests[row[4]] = id
+                    del shard._rows[id]
+                    del shard._digests[row[4]]
+            for digest, value in list(shard.digests.items()):
+                if db.digest_shard(digest) != index:
+                    self.shards[db.digest_shard(digest)].digests[digest] = value
+                    del shard.digests[digest]
+        self.assertGreater(len(self.shards[3]._rows), 1)
+        db = ShardedDBClient(self.shards)
+        self.assertEqual(set(ids), {entry.id for entry in db.get_entries_from_ids(ids)})
+        self.assertEqual(entries[9].id, db.get_entry_from_digest(entries[9].sha256)[0].id)
+
+    def test_failed_insert_removes_index(self):
+        db = ShardedDBClient(self.shards[:2])
+        first = Entry("abc", "https://shard.example/a", None, None)
+        db.create_new_entry(first)
+        taken = Entry("abc", "https://shard.example/b", None, None)
+        self.assertRaises(mariadb.IntegrityError, db.create_new_entry, taken)
+        self.assertEqual([], db.get_entry_from_digest(taken.sha256))
+        self.assertFalse(taken.sha256 in self.shards[db.digest_shard(taken.sha256)].digests)
+
+    def test_dangling_index_removed(self):
+        db = ShardedDBClient(self.shards[:2])
+        entry = Entry("abc", "https://shard.example/a", None, None)
+        shard = self.shards[db.digest_shard(entry.sha256)]
+        shard.insert_digest(entry.sha256, entry.id)
+        self.assertEqual([], db.get_entry_from_digest(entry.sha256))
+        self.assertTrue(entry.sha256 in shard.digests, "Insert may still be in progress.")
+
+        shard.digests[entry.sha256] = (entry.id, datetime.datetime.now() - datetime.timedelta(minutes=5))
+        with mock.patch("builtins.print"):
+            self.assertEqual([], db.get_entry_from_digest(entry.sha256))
+        self.assertFalse(entry.sha256 in shard.digests)
+        self.assertEqual(1, db.stats()["dangling_removed"])
@@ -0,0 +1,96 @@
+# This Source Code Form is subject to the terms of the Mozilla Public
+# License, v. 2.0. If a copy of the MPL was not distributed with this
+# file, You can obtain one at http://mozilla.org/MPL/2.0/.
+
+import datetime
+import unittest
+import os, sys
+sys.path.append(os.path.abspath(""))
+import falcon
+import falcon.asgi
+from falcon import testing
+import tracing
+from tracing import SamplingPolicy, ServerTimingMiddleware, Timing
+
+class Echo:
+
+    def on_post(self, req, resp):
+        tracing.record("db", 0.002)
+        tracing.record("db", 0.001)
+        resp.media = req.get_media()
+
+class AsyncEcho:
+
+    async def on_post(self, req, resp):
+        tracing.record("db", 0.002)
+        resp.media = await req.get_media()
+
+class TestTracingClass(unittest.TestCase):
+
+    def test_timing_header(self):
+        now = [10.0]
+        timing = Timing(clock=lambda: now[0])
+        timing.record("parse", 0.0005)
+        timing.record("db", 0.002)
+        timing.record("db", 0.003)
+        now[0] = 10.01
+        self.assertEqual(
+            "parse;dur=0.500, db;dur=5.000;desc=\"2 calls\", total;dur=10.000", timing.header())
+        tracing.record("db", 1) # Outside of a request, ignored
+
+    def test_server_timing_header(self):
+        for app, resource in [(falcon.App, Echo()), (falcon.asgi.App, AsyncEcho())]:
+            with self.subTest(app=app.__module__):
+                api = app(middleware=[ServerTimingMiddleware()])
+                api.add_route("/echo", resource)
+                result = testing.simulate_post(api, "/echo", json={"uri": "example.com"})
+                self.assertEqual({"uri": "example.com"}, result.json)
+                metrics = [metric.split(";")[0] for metric in result.headers["server-timing"].split(", ")]
+                self.assertEqual(["parse", "db", "serialize", "total"], metrics)
+
+                result = testing.simulate_post(api, "/echo", body="{", content_type="application/json")
+                self.assertEqual(400, result.status_code)
+
+    def test_route_rates(self):
+        policy = SamplingPolicy(0.1, {"/api/v1/status": 0.0, "/{id}": 0.5})
+        self.assertEqual(0.0, policy.traces_sampler({"wsgi_environ": {"PATH_INFO": "/api/v1/status"}}))
+        self.assertEqual(0.5, policy.traces_sampler({"asgi_scope": {"path": "/abc"}}))
+        self.assertEqual(0.1, policy.traces_sampler({"wsgi_environ": {"PATH_INFO": "/api/v1/shorten"}}))
+        self.assertEqual(1.0, policy.traces_sampler({"parent_sampled": True}))
+        event = {"transaction": "/api/v1/status"}
+        self.assertIs(event, policy.before_send_transaction(event, {}))
+
+    def test_slow_requests(self):
+        draw = [0.9]
+        policy = SamplingPolicy(0.1, {"/api/v1/status": 0.0, "/{id}": 0.95}, 1.0, 0.2, random=lambda: draw[0])
+        # Head sampling keeps the route rates, with a floor to find slow requests
+        self.assertEqual(0.2, policy.traces_sampler({"wsgi_environ": {"PATH_INFO": "/api/v1/status"}}))
+        self.assertEqual(0.2, policy.traces_sampler({"wsgi_environ": {"PATH_INFO": "/api/v1/shorten"}}))
+        self.assertEqual(0.95, policy.traces_sampler({"asgi_scope": {"path": "/abc"}}))
+        self.assertEqual(0.0, SamplingPolicy(0.1, {"/api/v1/status": 0.0}, 1.0, 0.0).traces_sampler(
+            {"wsgi_environ": {"PATH_INFO": "/api/v1/status"}}))
+
+        start = datetime.datetime(2024, 1, 1, tzinfo=datetime.timezone.utc)
+        def event(path, seconds):
+            return {
+                "start_timestamp": start,
+                "timestamp": start + datetime.timedelta(seconds=seconds),
+                "request": {"url": f"http://localhost{path}"},
+            }
+        self.assertIsNone(policy.before_send_transaction(event("/api/v1/status", 0.2), {}))
+        self.assertIsNotNone(policy.before_send_transaction(event("/api/v1/status", 1.5), {}))
+        self.assertIsNotNone(policy.before_send_transaction(event("/abc", 0.2), {}))
+        # Half of the recorded fast ones are kept, 0.1 of all requests
+        self.assertIsNone(policy.before_send_transaction(event("/api/v1/shorten", 0.2), {}))
+        draw[0] = 0.45
+        self.assertIsNotNone(policy.before_send_transaction(event("/api/v1/shorten?x=1", 0.2), {}))
+
+        iso = {"start_timestamp": "2024-01-01T00:00:00Z", "timestamp": "2024-01-01T00:00:02Z"}
+        self.assertEqual(2.0, SamplingPolicy.duration(iso))
+
+    def test_invalid_arguments(self):
+        self.assertRaises(ValueError, SamplingPolicy, 1.5)
+        self.assertRaises(ValueError, SamplingPolicy, 0.1, {"/{id}": -1})
+        self.assertRaises(TypeError, SamplingPolicy, "0.1")
+        self.assertRaises(ValueError, SamplingPolicy, 0.1, None, -1)
+        self.assertRaises(ValueError, SamplingPolicy, 0.1, None, 1.0, 1.5)
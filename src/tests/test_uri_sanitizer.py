@@ -0,0 +1,81 @@
+# This Source Code Form is subject to the terms of the Mozilla Public
+# License, v. 2.0. If a copy of the MPL was not distributed with this
+# file, You can obtain one at http://mozilla.org/MPL/2.0/.
+
+import unittest
+import os, sys
+sys.path.append(os.path.abspath(""))
+from config_parser import ConfigParser
+from entry import Entry
+from uri_sanitizer import escape_uri
+import bleach
+import random
+try:
+    from logic import Logic
+    from memory_client import MemoryDBClient
+except ImportError: # mariadb connector not installed
+    Logic = None
+
+
+class TestUriSanitizerClass(unittest.TestCase):
+
+    CORPUS = ["https://example.com/?a=1&b=2",
+              "https://example.com/<script>alert(1)</script>",
+              "http://<example.com",
+              "javascript:alert('x')&#x3C;",
+              "https://xn--fsqu00a.xn--0zwm56d/測試?q=值&lang=zh",
+              "mailto:user@example.com?subject=hi&body=a%20b",
+              "https://example.com/&amp;&am;&a;&amp&ampx;",
+              "https://example.com/&#1g;&#;&#x;&#xZ;&#65;&#x41;&#X41;",
+              "https://example.com/&nbsp&nbsp;&notin;&noti;&notit;",
+              "https://example.com/&=x&;&&&",
+              "\x0chttps://example.com/\x0c\x01\x0c ",
+              "https://example.com/\x01\x08\x0b\x1f\x7f",
+              "https://example.com/\r\n\r\x00\t\n",
+              ""]
+
+    def setUp(self):
+        self.sanitizer = Entry.SANITIZER
+
+    def tearDown(self):
+        Entry.SANITIZER = self.sanitizer
+
+    def sanitize_both(self, uri_str):
+        Entry.SANITIZER = "bleach"
+        expected = Entry.sanitize_uri(uri_str)
+        Entry.SANITIZER = "fast"
+        return expected, Entry.sanitize_uri(uri_str)
+
+    def test_matches_bleach_on_corpus(self):
+        for uri_str in TestUriSanitizerClass.CORPUS:
+            with self.subTest(uri=uri_str):
+                expected, result = self.sanitize_both(uri_str)
+                self.assertEqual(expected, result)
+
+    def test_matches_bleach_on_random_input(self):
+        rand = random.Random(0)
+        alphabet = "&#;=xX09aAfFgGmnopt<> \t\n\r\x00\x01\x0b\x0c/?é測"
+        for _ in range(2000):
+            uri_str = "".join(rand.choice(alphabet) for _ in range(rand.randint(0, 16)))
+            with self.subTest(uri=uri_str):
+                expected, result = self.sanitize_both(uri_str)
+                self.assertEqual(expected, result)
+
+    def test_plain_uri_returned_unchanged(self):
+        uri_str = "https://example.com/path?q=1"
+        self.assertIs(uri_str, escape_uri(uri_str))
+        self.assertEqual(bleach.clean("a&b"), escape_uri("a&b"))
+
+    def test_set_sanitizer(self):
+        Entry.set_sanitizer("bleach")
+        self.assertEqual("bleach", Entry.SANITIZER)
+        self.assertRaises(ValueError, Entry.set_sanitizer, "none")
+        self.assertEqual("bleach", Entry.SANITIZER)
+
+    @unittest.skipIf(Logic is None, "mariadb connector not installed.")
+    def test_logic_keeps_sanitizer(self):
+        ConfigParser(os.path.abspath("../sample_config.toml"))
+        Entry.set_sanitizer("bleach")
+        logic = Logic(MemoryDBClient())
+        logic.close()
+        self.assertEqual("bleach", Entry.SANITIZER, "Set once per process, not per Logic.")
@@ -0,0 +1,217 @@
+# This Source Code Form is subject to the terms of the Mozilla Public
+# License, v. 2.0. If a copy of the MPL was not distributed with this
+# file, You can obtain one at http://mozilla.org/MPL/2.0/.
+
+"""
+Request tracing without an external service, and sampling rules for the
+Sentry SDK.
+
+`ServerTimingMiddleware` splits every request into parse, db and
+serialize time and returns it in a `Server-Timing` header, readable in
+the network panel of browsers. Database clients report their calls
+with `record("db", seconds)`.
+
+`SamplingPolicy` decides which requests Sentry traces, see the
+`[tracing]` section of the configuration.
+"""
+
+from contextvars import ContextVar
+import datetime
+import random
+import time
+
+# Timing of the request handled by the current thread or task
+_current = ContextVar("request_timing", default=None)
+
+class Timing:
+    """Time spent per span name within one request."""
+
+    def __init__(self, clock=time.perf_counter):
+        self._clock = clock
+        self.start = clock()
+        self.spans = {} # name -> [seconds, count]
+
+    def record(self, name, seconds):
+        span = self.spans.get(name)
+        if span is None:
+            span = self.spans[name] = [0.0, 0]
+        # Not locked, the count may be off when threads of one request race
+        span[0] += seconds
+        span[1] += 1
+
+    def header(self):
+        """
+        Return
+        str: Value of the Server-Timing header, durations in milliseconds
+        """
+        metrics = []
+        for name, (seconds, count) in self.spans.items():
+            metric = f"{name};dur={seconds * 1000:.3f}"
+            if count > 1:
+                metric += f";desc=\"{count} calls\""
+            metrics.append(metric)
+        metrics.append(f"total;dur={(self._clock() - self.start) * 1000:.3f}")
+        return ", ".join(metrics)
+
+def record(name, seconds):
+    """Add to span `name` of the current request, ignored outside of requests."""
+    timing = _current.get()
+    if not timing is None:
+        timing.record(name, seconds)
+
+class ServerTimingMiddleware:
+    """
+    Add a `Server-Timing` header with parse (request body), db (every
+    database call) and serialize (response body) time. Bodies are parsed
+    and rendered here, falcon keeps the result for the resource and the
+    server, so nothing is done twice. Works for both the WSGI and the
+    ASGI app.
+    """
+
+    def process_request(self, req, resp):
+        req.context.timing = Timing()
+        req.context.timing_token = _current.set(req.context.timing)
+
+    def process_resource(self, req, resp, resource, params):
+        if not req.content_length:
+            return
+        start = time.perf_counter()
+        try:
+            req.get_media()
+        except Exception:
+            pass # Raised again when the resource reads the body
+        req.context.timing.record("parse", time.perf_counter() - start)
+
+    def process_response(self, req, resp, resource, req_succeeded):
+        timing = getattr(req.context, "timing", None)
+        if timing is None:
+            return
+        _current.reset(req.context.timing_token)
+        if resp.stream is None:
+            start = time.perf_counter()
+            resp.render_body()
+            timing.record("serialize", time.perf_counter() - start)
+        resp.set_header("Server-Timing", timing.header())
+
+    async def process_request_async(self, req, resp):
+        self.process_request(req, resp)
+
+    async def process_resource_async(self, req, resp, resource, params):
+        if not req.content_length:
+            return
+        start = time.perf_counter()
+        try:
+            await req.get_media()
+        except Exception:
+            pass
+        req.context.timing.record("parse", time.perf_counter() - start)
+
+    async def process_response_async(self, req, resp, resource, req_succeeded):
+        timing = getattr(req.context, "timing", None)
+        if timing is None:
+            return
+        _current.reset(req.context.timing_token)
+        if resp.stream is None:
+            start = time.perf_counter()
+            await resp.render_body()
+            timing.record("serialize", time.perf_counter() - start)
+        resp.set_header("Server-Timing", timing.header())
+
+class SamplingPolicy:
+    """
+    Head sampling per route for Sentry traces, and optionally slow
+    requests.
+
+    Routes are matched on the request path, "/{id}" matches any single
+    segment path that has no rate of its own. The decision is made when
+    the request starts and unsampled requests cost nothing. With
+    `slow_threshold`, at least `slow_sample_rate` of the requests are
+    recorded and the decision is made once they finished: those taking
+    at least `slow_threshold` seconds are sent, others so that their
+    route's rate is kept. Slow requests are only found among the
+    recorded ones, each of which costs as much as a sent trace.
+    """
+
+    def __init__(self, default_rate=0.0, route_rates=None, slow_threshold=0, slow_sample_rate=0.1,
+                 random=random.random):
+        route_rates = {} if route_rates is None else dict(route_rates)
+        for rate in [default_rate, slow_sample_rate] + list(route_rates.values()):
+            if not isinstance(rate, (int, float)):
+                raise TypeError("Sample rate must be an integer or float type.")
+            if rate < 0 or rate > 1:
+                raise ValueError("Sample rate must be between 0 and 1 inclusive.")
+        if not isinstance(slow_threshold, (int, float)):
+            raise TypeError("Slow request threshold must be an integer or float type.")
+        if slow_threshold < 0:
+            raise ValueError("Slow request threshold cannot be negative.")
+
+        self.default_rate = default_rate
+        self.route_rates = route_rates
+        self.slow_threshold = slow_threshold
+        self.slow_sample_rate = slow_sample_rate
+        self._random = random
+
+    @staticmethod
+    def from_config(config):
+        tracing = config.get("tracing", {})
+        return SamplingPolicy(
+            tracing.get("traces_sample_rate", 0.0),
+            tracing.get("routes", {}),
+            tracing.get("slow_request_threshold", 0),
+            tracing.get("slow_request_sample_rate", 0.1))
+
+    def rate(self, path):
+        if path in self.route_rates:
+            return self.route_rates[path]
+        if "/{id}" in self.route_rates and path.count("/") == 1:
+            return self.route_rates["/{id}"]
+        return self.default_rate
+
+    def traces_sampler(self, sampling_context):
+        """`traces_sampler` of `sentry_sdk.init`."""
+        if not sampling_context.get("parent_sampled") is None:
+            # Keep the decision of the caller's trace
+            return float(sampling_context["parent_sampled"])
+        return self.recorded_rate(SamplingPolicy.path(sampling_context))
+
+    def recorded_rate(self, path):
+        rate = self.rate(path)
+        if self.slow_threshold > 0:
+            # Fast ones are dropped again in before_send_transaction
+            return max(rate, self.slow_sample_rate)
+        return rate
+
+    def before_send_transaction(self, event, hint):
+        """`before_send_transaction` of `sentry_sdk.init`, drops unsampled fast requests."""
+        if self.slow_threshold <= 0:
+            return event
+        duration = SamplingPolicy.duration(event)
+        if not duration is None and duration >= self.slow_threshold:
+            return event
+        path = event.get("request", {}).get("url", "")
+        path = path.split("://", 1)[-1]
+        path = path[path.find("/"):] if "/" in path else "/"
+        path = path.split("?", 1)[0]
+        recorded = self.recorded_rate(path)
+        if recorded > 0 and self._random() < self.rate(path) / recorded:
+            return event
+        return None
+
+    @staticmethod
+    def path(sampling_context):
+        if "wsgi_environ" in sampling_context:
+            return sampling_context["wsgi_environ"].get("PATH_INFO", "/")
+        elif "asgi_scope" in sampling_context:
+            return sampling_context["asgi_scope"].get("path", "/")
+        return "/"
+
+    @staticmethod
+    def duration(event):
+        start, end = event.get("start_timestamp"), event.get("timestamp")
+        if start is None or end is None:
+            return None
+        if isinstance(start, str):
+            start, end = datetime.datetime.fromisoformat(start), datetime.datetime.fromisoformat(end)
+        if isinstance(start, datetime.datetime):
+            return (end - start).total_seconds()
+        return end - start
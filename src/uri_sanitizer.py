@@ -0,0 +1,105 @@
+# This Source Code Form is subject to the terms of the Mozilla Public
+# License, v. 2.0. If a copy of the MPL was not distributed with this
+# file, You can obtain one at http://mozilla.org/MPL/2.0/.
+
+"""
+Purpose built replacement for `bleach.clean` on a single URI string.
+
+`Entry.sanitize_uri` escapes "<" and ">" before cleaning, so bleach never
+sees a tag and only ever produces a text node. For text, bleach:
+
+1. Normalises "\\r\\n" and "\\r" to "\\n" and drops NUL characters
+   (html5lib input stream and tree builder).
+2. Replaces control characters other than tab and newline with "?",
+   except for form feeds in leading or trailing whitespace which html5lib
+   hands to bleach as separate space tokens.
+3. Leaves "&" alone when it starts what bleach considers a character
+   entity, see `_entity_length`, and escapes every other "&" to "&amp;".
+
+`escape_uri` does the same in a single pass and produces byte-identical
+output, `tests/test_uri_sanitizer.py` checks it against bleach.
+"""
+
+import html.entities
+import re
+import string
+
+_INVISIBLE_RE = re.compile(
+    "[" + "".join(chr(c) for c in range(32) if c not in (9, 10, 13)) + "]")
+
+# bleach accepts a named entity if it is a prefix of any known entity name
+_ENTITY_PREFIXES = frozenset(
+    name[:i] for name in html.entities.html5 for i in range(1, len(name) + 1))
+
+_SPACE_CHARACTERS = " \t\n\x0c"
+_END_CHARACTERS = frozenset("<&=;" + string.whitespace)
+_DECIMAL = frozenset("0123456789")
+_HEXADECIMAL = frozenset("0123456789abcdefABCDEF")
+
+def _match_entity(text, start):
+    """
+    Mirror of `bleach.html5lib_shim.match_entity` for the "&" at text[start].
+
+    Return
+    None: Not an entity, "&" has to be escaped
+    str: Entity name without "&" and ";"
+    """
+    i = start + 1
+    end = len(text)
+    if i < end and text[i] == "#":
+        name_end = i + 1
+        allowed = _DECIMAL
+        if name_end < end and text[name_end] in "xX":
+            allowed = _HEXADECIMAL
+            name_end += 1
+        i = name_end
+        while i < end and not text[i] in _END_CHARACTERS:
+            i += 1
+            if not text[i - 1] in allowed:
+                # bleach consumes the offending character but leaves it out
+                # of the entity name, the entity still counts if ";" follows
+                break
+            name_end = i
+        if i < end and text[i] == ";":
+            return text[start + 1:name_end]
+        return None
+
+    while i < end and not text[i] in _END_CHARACTERS:
+        i += 1
+        if not text[start + 1:i] in _ENTITY_PREFIXES:
+            return None
+    if i > start + 1 and i < end and text[i] == ";":
+        return text[start + 1:i]
+    return None
+
+def escape_uri(uri_str):
+    """Return `uri_str` as bleach.clean would, "<" and ">" must already be escaped."""
+    if "\r" in uri_str:
+        uri_str = uri_str.replace("\r\n", "\n").replace("\r", "\n")
+    if "\x00" in uri_str:
+        uri_str = uri_str.replace("\x00", "")
+    if "\x0c" in uri_str:
+        body = uri_str.lstrip(_SPACE_CHARACTERS)
+        core = body.rstrip(_SPACE_CHARACTERS)
+        uri_str = uri_str[:len(uri_str) - len(body)] \
+            + _INVISIBLE_RE.sub("?", core) + body[len(core):]
+    else:
+        uri_str = _INVISIBLE_RE.sub("?", uri_str)
+
+    start = uri_str.find("&")
+    if start < 0:
+        return uri_str
+
+    parts = [uri_str[:start]]
+    while start >= 0:
+        entity = _match_entity(uri_str, start)
+        if entity is None:
+            parts.append("&amp;")
+            rest = start + 1
+        else:
+            parts.append(f"&{entity};")
+            # Skips ";" and, like bleach, any character consumed after the name
+            rest = start + len(entity) + 2
+        start = uri_str.find("&", rest)
+        parts.append(uri_str[rest:start if start >= 0 else len(uri_str)])
+    return "".join(parts)